@@ -0,0 +1,188 @@
+"""
+pyllm离线压测，所有请求都发往本地的mock服务，不需要真实的模型服务。
+
+    python benchmarks/bench.py
+    python benchmarks/bench.py --latency 0.05 --chunk-delay 0.001 --concurrency 16 --json
+
+每个场景报告：
+    throughput      每秒完成的请求（场景单位：ask/using_tool/chat）
+    overhead/iter   每轮迭代的客户端开销 = (总耗时 - 服务端耗时) / 迭代数，单线程运行时最准确
+    chunks/s        流式场景每秒处理的chunk数
+    alloc/iter      tracemalloc统计的每轮迭代分配字节数和峰值内存
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import argparse
+import contextlib
+import json
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from mock_server import MockServer
+from pyllm.llm import LLM
+from pyllm.agent_base import AgentBase
+
+TOOL_ROUNDS = 3
+TOOLS_PER_ROUND = 2
+ANSWER = "这是一个用于压测的回答，" * 8
+
+
+def tool_script(rounds=TOOL_ROUNDS, tools_per_round=TOOLS_PER_ROUND, tool="echo"):
+    turns = []
+    for r in range(rounds):
+        turns.append([(tool, {"input_str": f"round {r} call {i}"}) for i in range(tools_per_round)])
+    turns.append(ANSWER)
+    return turns
+
+
+def echo_para():
+    return {
+        "type": "object",
+        "properties": {
+            "input_str": {"type": "string", "description": "输入"},
+        },
+        "required": ["input_str"],
+    }
+
+
+class ChildAgent(AgentBase):
+    "压测用的子智能体，会调用一次echo工具"
+
+
+class ParentAgent(AgentBase):
+    "压测用的父智能体，会调用子智能体"
+
+
+def make_server(args):
+    server = MockServer(latency=args.latency, chunk_delay=args.chunk_delay)
+    server.add_script("ask", [ANSWER])
+    server.add_script("tools", tool_script())
+    server.add_script("child", tool_script(rounds=1, tools_per_round=1))
+    server.add_script("parent", [[("childagent", {"text": "子任务"})], [("echo", {"input_str": "x"})], ANSWER])
+    return server
+
+
+def make_llm(url, model):
+    llm = LLM(model=model, ak="mock", url=url)
+    llm.register_tool(lambda input_str: input_str, name="echo", tool_desc="回声", para_desc=echo_para())
+    return llm
+
+
+def scenario_ask(url):
+    llm = make_llm(url, "ask")
+    return lambda: llm.ask("你好", use_cache=False), 1
+
+
+def scenario_using_tool(url, stream):
+    llm = make_llm(url, "tools")
+    run = lambda: llm.using_tool("用工具", stream=stream, style="mute", use_cache=False)
+    return run, TOOL_ROUNDS + 1
+
+
+def scenario_agent(url):
+    child = ChildAgent(model="child", ak="mock", url=url)
+    parent = ParentAgent(model="parent", ak="mock", url=url, child_agents=[child])
+    counter = iter(range(10 ** 9))
+    # 每次用新的ctx，避免历史越来越长影响结果
+    run = lambda: parent.chat("开始", ctx=f"bench-{next(counter)}", style="mute")
+    # 父智能体3轮，子智能体2轮
+    return run, 5
+
+
+SCENARIOS = {
+    "ask": lambda url: scenario_ask(url),
+    "using_tool": lambda url: scenario_using_tool(url, stream=False),
+    "using_tool_stream": lambda url: scenario_using_tool(url, stream=True),
+    "agent_nested": lambda url: scenario_agent(url),
+}
+
+
+def measure(server, run, iterations, n, concurrency):
+    "运行n次，返回耗时相关的指标"
+    run()  # 预热：建立连接、生成工具schema
+    server.stats.reset()
+    start = time.perf_counter()
+    if concurrency <= 1:
+        for _ in range(n):
+            run()
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for future in [executor.submit(run) for _ in range(n)]:
+                future.result()
+    elapsed = time.perf_counter() - start
+    stats = server.stats
+    total_iterations = n * iterations
+    result = {
+        "runs": n,
+        "elapsed": elapsed,
+        "throughput": n / elapsed,
+        "requests": stats.requests,
+        "chunks": stats.chunks,
+        "chunks_per_sec": stats.chunks / elapsed if stats.chunks else 0.0,
+    }
+    if concurrency <= 1:
+        result["overhead_per_iter_ms"] = (elapsed - stats.server_time) / total_iterations * 1000
+    return result
+
+
+def measure_alloc(run, iterations, n):
+    "用tracemalloc统计分配，单独运行，避免影响计时"
+    run()
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    before = tracemalloc.take_snapshot()
+    for _ in range(n):
+        run()
+    after = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    allocated = sum(stat.size_diff for stat in after.compare_to(before, "filename") if stat.size_diff > 0)
+    return {
+        "alloc_per_iter_kb": allocated / (n * iterations) / 1024,
+        "peak_kb": peak / 1024,
+    }
+
+
+def format_row(name, result):
+    overhead = result.get("overhead_per_iter_ms")
+    overhead = f"{overhead:8.2f}ms" if overhead is not None else "       -  "
+    alloc = result.get("alloc_per_iter_kb")
+    alloc = f"{alloc:8.1f}KB" if alloc is not None else "       -  "
+    peak = result.get("peak_kb")
+    peak = f"{peak:9.0f}KB" if peak is not None else "        -  "
+    return f"{name:<20}{result['throughput']:>10.1f}/s {overhead} {result['chunks_per_sec']:>10.0f} {alloc} {peak}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="pyllm offline benchmark")
+    parser.add_argument("-n", "--runs", type=int, default=50, help="每个场景运行的次数")
+    parser.add_argument("-c", "--concurrency", type=int, default=1, help="并发线程数")
+    parser.add_argument("--latency", type=float, default=0.0, help="mock服务每个请求的延迟（秒）")
+    parser.add_argument("--chunk-delay", type=float, default=0.0, help="mock服务每个chunk的延迟（秒）")
+    parser.add_argument("--alloc-runs", type=int, default=10, help="统计内存分配的运行次数，0表示不统计")
+    parser.add_argument("--only", nargs="*", choices=list(SCENARIOS), help="只运行指定的场景")
+    parser.add_argument("--json", action="store_true", help="以JSON输出结果")
+    args = parser.parse_args()
+
+    results = {}
+    with make_server(args) as server:
+        for name in args.only or SCENARIOS:
+            run, iterations = SCENARIOS[name](server.url)
+            # 子智能体总是打印输出，压测时丢弃
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                result = measure(server, run, iterations, args.runs, args.concurrency)
+                if args.alloc_runs:
+                    result.update(measure_alloc(run, iterations, args.alloc_runs))
+            results[name] = result
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'scenario':<20}{'throughput':>12} {'overhead':>10} {'chunks/s':>10} {'alloc/iter':>10} {'peak':>11}")
+    for name, result in results.items():
+        print(format_row(name, result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+"""
+本地的OpenAI兼容chat completions模拟服务，用于离线压测pyllm自身的开销。
+
+每个模型名对应一段脚本，脚本是按轮次排列的响应：字符串表示回答文本，
+列表表示本轮要求调用的工具[(工具名, 参数dict), ...]。轮次由请求中最后一条user消息之后
+assistant消息的条数决定，所以服务是无状态的，可以被任意多个会话并发调用。
+"""
+import json
+import sys
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+DEFAULT_ANSWER = "done"
+CHUNK_SIZE = 4
+REQUEST_QUEUE_SIZE = 256
+
+
+class MockStats:
+    "服务端统计：请求数、发送的chunk数以及服务端模拟延迟的总耗时"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.requests = 0
+        self.chunks = 0
+        self.server_time = 0.0
+
+    def received(self):
+        "请求到达时计数，不等响应发完：客户端收到响应时这个请求已经计入"
+        with self._lock:
+            self.requests += 1
+
+    def record(self, chunks, server_time):
+        with self._lock:
+            self.chunks += chunks
+            self.server_time += server_time
+
+
+class MockServer:
+    """
+    Args:
+        scripts (dict, optional): 模型名 -> 响应脚本。
+        latency (float, optional): 每个请求返回首字节前的延迟（秒）。
+        chunk_delay (float, optional): 流式响应每个chunk之间的延迟（秒），用来模拟输出速率。
+        chunk_size (int, optional): 流式响应每个chunk的字符数。
+        host (str, optional): 监听地址。
+        port (int, optional): 监听端口，0表示随机端口。
+    """
+
+    def __init__(self, scripts=None, latency=0.0, chunk_delay=0.0, chunk_size=CHUNK_SIZE, host="127.0.0.1", port=0):
+        self.scripts = dict(scripts or {})
+        self.latency = latency
+        self.chunk_delay = chunk_delay
+        self.chunk_size = chunk_size
+        self.host = host
+        self.port = port
+        self.stats = MockStats()
+        self._failures = []
+        self._failure_lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    def add_script(self, model, turns):
+        self.scripts[model] = list(turns)
+
+    def fail(self, status, count=1):
+        "接下来的count个请求返回HTTP status错误，用于测试重试、切换地址和熔断"
+        with self._failure_lock:
+            self._failures.extend([status] * count)
+
+    def _next_failure(self):
+        with self._failure_lock:
+            return self._failures.pop(0) if self._failures else None
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}/v1"
+
+    def start(self):
+        "启动服务，返回base_url"
+        handler = type("MockHandler", (_MockHandler,), {"mock": self})
+        self._server = _MockHTTPServer((self.host, self.port), handler)
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self.url
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+        return False
+
+    def reply(self, request):
+        """
+        按脚本决定本轮响应。
+        Returns:
+            tuple: (回答文本, tool_calls)，没有工具调用时tool_calls为None。
+        """
+        messages = request["messages"]
+        turn = 0
+        for message in reversed(messages):
+            if message["role"] == "user":
+                break
+            if message["role"] == "assistant":
+                turn += 1
+        turns = self.scripts.get(request["model"]) or [DEFAULT_ANSWER]
+        if turn >= len(turns):
+            return turns[-1] if isinstance(turns[-1], str) else DEFAULT_ANSWER, None
+        step = turns[turn]
+        if isinstance(step, str):
+            return step, None
+        tool_calls = []
+        for i, (name, arguments) in enumerate(step):
+            tool_calls.append({
+                "id": f"call_{turn}_{i}",
+                "type": "function",
+                "function": {"name": name, "arguments": json.dumps(arguments, ensure_ascii=False)},
+            })
+        return None, tool_calls
+
+
+def _usage():
+    return {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15}
+
+
+class _MockHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = REQUEST_QUEUE_SIZE
+
+    def handle_error(self, request, client_address):
+        # 客户端关闭keep-alive连接是正常情况
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class _MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # 响应头和响应体分开写，不关闭Nagle会碰上延迟确认，每个请求多出约40ms
+    disable_nagle_algorithm = True
+    mock = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        start = time.perf_counter()
+        self.mock.stats.received()
+        status = self.mock._next_failure()
+        if status is not None:
+            self._error(status)
+            self.mock.stats.record(0, time.perf_counter() - start)
+            return
+        if self.mock.latency:
+            time.sleep(self.mock.latency)
+        text, tool_calls = self.mock.reply(request)
+        if request.get("stream"):
+            chunks = self._stream(request, text, tool_calls)
+        else:
+            chunks = 0
+            self._complete(request, text, tool_calls)
+        self.mock.stats.record(chunks, time.perf_counter() - start)
+
+    def _error(self, status):
+        body = json.dumps({"error": {"message": f"mock error {status}", "type": "mock_error", "code": status}}).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _complete(self, request, text, tool_calls):
+        message = {"role": "assistant", "content": text}
+        if tool_calls:
+            message["tool_calls"] = tool_calls
+        body = json.dumps({
+            "id": "chatcmpl-mock",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request["model"],
+            "choices": [{"index": 0, "message": message, "finish_reason": "tool_calls" if tool_calls else "stop"}],
+            "usage": _usage(),
+        }, ensure_ascii=False).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _stream(self, request, text, tool_calls):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        size = self.mock.chunk_size
+        sent = 0
+
+        def send(data):
+            nonlocal sent
+            if self.mock.chunk_delay:
+                time.sleep(self.mock.chunk_delay)
+            payload = f"data: {data}\n\n".encode("utf-8")
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(payload), payload))
+            self.wfile.flush()
+            sent += 1
+
+        def chunk(delta, finish_reason=None):
+            return json.dumps({
+                "id": "chatcmpl-mock",
+                "object": "chat.completion.chunk",
+                "created": 0,
+                "model": request["model"],
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }, ensure_ascii=False)
+
+        if text:
+            for i in range(0, len(text), size):
+                send(chunk({"content": text[i:i + size]}))
+        for index, tool_call in enumerate(tool_calls or []):
+            send(chunk({"tool_calls": [{"index": index, "id": tool_call["id"], "type": "function",
+                                        "function": {"name": tool_call["function"]["name"], "arguments": ""}}]}))
+            arguments = tool_call["function"]["arguments"]
+            for i in range(0, len(arguments), size):
+                send(chunk({"tool_calls": [{"index": index, "function": {"arguments": arguments[i:i + size]}}]}))
+        send(chunk({}, "tool_calls" if tool_calls else "stop"))
+        if (request.get("stream_options") or {}).get("include_usage"):
+            send(json.dumps({"id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": 0,
+                             "model": request["model"], "choices": [], "usage": _usage()}))
+        send("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+        return sent
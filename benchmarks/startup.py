@@ -0,0 +1,107 @@
+"""
+pyllm启动耗时压测：导入耗时和批量创建智能体的耗时，每次都在新的Python进程中测量。
+
+    python benchmarks/startup.py
+    python benchmarks/startup.py --runs 20 --agents 500 --json
+
+场景：
+    import              import pyllm.agent_base
+    import+eager        先导入openai和prompt_toolkit，相当于它们在模块顶层导入时的耗时
+    agents/fresh        创建agents个智能体，每个都重新注册工具、生成工具定义
+    agents/shared       第一个智能体注册工具，其余的共用它的ToolRegistry
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import argparse
+import json
+import statistics
+import subprocess
+import time
+
+HEAVY_MODULES = ("openai", "httpx", "httpx2", "prompt_toolkit", "pydantic", "asyncio")
+TOOL_COUNT = 8
+
+
+def child(scenario, agents):
+    "在子进程中运行一个场景，输出耗时（毫秒）和已经加载的重量级模块"
+    start = time.perf_counter()
+    if scenario == "import+eager":
+        import openai  # noqa: F401
+        import prompt_toolkit  # noqa: F401
+    from pyllm.agent_base import AgentBase
+    imported = time.perf_counter()
+
+    class ToolAgent(AgentBase):
+        "压测用的智能体，注册TOOL_COUNT个工具"
+
+        def perpare_tool(self):
+            for i in range(TOOL_COUNT):
+                self.register_tool(lambda input_str: input_str, name=f"tool_{i}", tool_desc=f"工具{i}",
+                                   para_desc={"type": "object",
+                                              "properties": {"input_str": {"type": "string"}},
+                                              "required": ["input_str"]})
+
+    built = []
+    if scenario.startswith("agents"):
+        tools = None
+        for _ in range(agents):
+            agent = ToolAgent(model="bench", ak="bench", url="http://127.0.0.1:9/v1", tools=tools)
+            agent.llm._prepare_tools()
+            if scenario == "agents/shared":
+                tools = agent.llm.tools
+            built.append(agent)
+    end = time.perf_counter()
+    print(json.dumps({
+        "import_ms": (imported - start) * 1000,
+        "build_ms": (end - imported) * 1000,
+        "modules": [name for name in HEAVY_MODULES if name in sys.modules],
+    }))
+
+
+def measure(scenario, runs, agents):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", scenario, "--agents", str(agents)],
+                                check=True, capture_output=True, text=True).stdout
+        wall = (time.perf_counter() - start) * 1000
+        result = json.loads(output.strip().splitlines()[-1])
+        result["wall_ms"] = wall
+        samples.append(result)
+    return {
+        "import_ms": statistics.median(s["import_ms"] for s in samples),
+        "build_ms": statistics.median(s["build_ms"] for s in samples),
+        "wall_ms": statistics.median(s["wall_ms"] for s in samples),
+        "modules": samples[-1]["modules"],
+    }
+
+
+SCENARIOS = ("import", "import+eager", "agents/fresh", "agents/shared")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="pyllm startup benchmark")
+    parser.add_argument("-n", "--runs", type=int, default=10, help="每个场景启动进程的次数，取中位数")
+    parser.add_argument("--agents", type=int, default=200, help="agents场景创建的智能体数")
+    parser.add_argument("--only", nargs="*", choices=SCENARIOS, help="只运行指定的场景")
+    parser.add_argument("--json", action="store_true", help="以JSON输出结果")
+    parser.add_argument("--child", choices=SCENARIOS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.agents)
+        return
+
+    results = {name: measure(name, args.runs, args.agents) for name in args.only or SCENARIOS}
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'scenario':<16}{'import':>10} {'build':>10} {'process':>10}  loaded")
+    for name, result in results.items():
+        print(f"{name:<16}{result['import_ms']:>8.1f}ms {result['build_ms']:>8.1f}ms {result['wall_ms']:>8.1f}ms  "
+              f"{','.join(result['modules']) or '-'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -63,7 +63,8 @@ def example_agent_25():
                                     "description": "数学表达式"},
                         },
                         "required": ["expr"]
-                    })
+                    },
+                    cache_policy="global")
     agent.chat("3 3 7 7 四个数字，通过四则运算，得出25")
 
 
@@ -1,25 +1,56 @@
-from pyllm.llm import LLM
+from pyllm.llm import LLM, TOOL_CACHE_SIZE
+from pyllm.conversation import Conversation
+from pyllm.session import MemorySessionStore
+from pyllm.context import ContextManager, TokenCounter, CONTEXT_SLIDING_WINDOW
+from pyllm.scope import current_scope
 import logging
-from prompt_toolkit import PromptSession  
-from prompt_toolkit.auto_suggest import AutoSuggestFromHistory
-from prompt_toolkit.history import InMemoryHistory  
-from prompt_toolkit.completion import WordCompleter
+import threading
 
 FUNCTION_CALL_MAX_LOOP = 20
 
 class AgentBase(object):
     "基础智能体"
 
-    def __init__(self, model=None, ak = None, url = None, system="", child_agents=[], maxloop=FUNCTION_CALL_MAX_LOOP ):
-        self.llm = LLM(model=model, ak=ak, url=url)
+    llm_class = LLM
+
+    def __init__(self, model=None, ak = None, url = None, system="", child_agents=[], maxloop=FUNCTION_CALL_MAX_LOOP, cache=None, client=None,
+                 context_budget=None, context_strategy=CONTEXT_SLIDING_WINDOW, summary_model=None, session_store=None, observer=None,
+                 spill_threshold=None, pool=None, semantic_cache=None, tools=None, transport=None):
+        """
+        Args:
+            context_budget (int, optional): 每次请求上下文的token预算，为None时不限制。
+            context_strategy (str, optional): 超出预算时的处理方式，见ContextManager。
+            summary_model (str, optional): context_strategy为"summarize"时用于生成摘要的（更便宜的）模型。
+            session_store (SessionStore, optional): 会话存储，默认为不限容量的内存存储。
+            observer (Observer|callable, optional): 接收计时span，见pyllm.metrics；没有设置observer的子智能体会共用它。
+            spill_threshold (int, optional): 工具结果超过这个字符数时存入磁盘，对话中只保留摘要和句柄，见LLM。
+            pool (EndpointPool, optional): 多地址连接池，见pyllm.pool。
+            semantic_cache (SemanticCache, optional): 语义缓存，只对会话的第一轮问题生效，见pyllm.semantic_cache。
+            tools (ToolRegistry, optional): 预先构建的工具注册表（例如另一个同类智能体的llm.tools），
+                设置时不再调用perpare_tool，也不能再传child_agents；与client一起传入可以快速创建大量智能体。
+                设置了spill_threshold时会复制一份注册表，read_tool_result只读取这个智能体保存的结果。
+            transport (Recorder|Replayer, optional): 记录或回放模型请求，见pyllm.replay；没有设置transport的子智能体会共用它。
+        """
+        if tools is not None and child_agents:
+            raise ValueError("child_agents cannot be used with a prebuilt tools registry, register them when building the registry")
+        self.llm = self.llm_class(model=model, ak=ak, url=url, cache=cache, client=client, observer=observer,
+                                  spill_threshold=spill_threshold, pool=pool, semantic_cache=semantic_cache, tools=tools,
+                                  transport=transport)
+        if context_budget is not None:
+            self.llm.context_manager = ContextManager(context_budget, strategy=context_strategy,
+                                                      counter=TokenCounter(model),
+                                                      summarizer=self.llm, summary_model=summary_model)
         self.model = model
         self.system_prompt = system
-        self.context = {}
+        self.context = session_store if session_store is not None else MemorySessionStore()
+        self.context.on_evict(self.llm._drop_session_state)
+        self._lock = threading.Lock()
         self.maxloop = maxloop
         self.name = self.__class__.__name__.lower()
         self.desc = self.__class__.__doc__
-        self.perpare_child_agent(child_agents)
-        self.perpare_tool()
+        if tools is None:
+            self.perpare_child_agent(child_agents)
+            self.perpare_tool()
         
     def perpare_tool(self):
         # 这只是一个例子，实际使用时请替换为实际的工具函数
@@ -35,8 +66,10 @@ class AgentBase(object):
                                "required": ["input_str"]
                            })
     
-    def register_tool(self, function,name=None, tool_desc=None, para_desc={}):
-        self.llm.register_tool( function,name=name, tool_desc=tool_desc, para_desc=para_desc)
+    def register_tool(self, function,name=None, tool_desc=None, para_desc={}, parallel=True,
+                      cache_policy=None, cache_size=TOOL_CACHE_SIZE, cache_ttl=None):
+        self.llm.register_tool( function,name=name, tool_desc=tool_desc, para_desc=para_desc, parallel=parallel,
+                               cache_policy=cache_policy, cache_size=cache_size, cache_ttl=cache_ttl)
     
 
     def perpare_child_agent(self, child_agents):
@@ -44,7 +77,11 @@ class AgentBase(object):
             self.register_child_agent(agent)
 
     def register_child_agent(self, agent):
-        self.register_tool(lambda text: agent.chat(text),
+        if agent.llm.observer is None:
+            agent.llm.observer = self.llm.observer
+        if agent.llm.transport is None:
+            agent.llm.transport = self.llm.transport
+        self.register_tool(self._child_agent_tool(agent),
                            name=agent.name,
                            tool_desc=agent.desc,
                            para_desc={"type": "object",
@@ -55,34 +92,72 @@ class AgentBase(object):
                                       "required": ["text"]
                                       })
         
+    def _child_agent_tool(self, agent):
+        """
+        把子智能体包装成工具：沿用调用方请求的会话ctx、输出方式和截止时间。
+        同一轮的多个子智能体调用和其他工具一样由工具调度并发执行。
+        """
+        def call_child_agent(text):
+            scope = current_scope()
+            if scope is None:
+                return agent.chat(text)
+            return agent.chat(text, ctx=scope.ctx or "default", style=scope.style or "colorful")
+        return call_child_agent
+
     def set_system_prompt(self, prompt):
         self.system_prompt = prompt
 
     def ask(self,text, stream=False):
         return self.llm.using_tool(text, maxloop= self.maxloop, stream=stream)
     
-    def chat(self, text, ctx="default", stream=False, style="colorful"):
-        if ctx not in self.context:
-            self.context[ctx] = [{
-                "role": "system",
-                "content": self.system_prompt}]
-        msg = self.context[ctx]
-        logging.debug(f"context: {msg}")
-        msg.append({
+    def chat(self, text, ctx="default", stream=False, style="colorful", on_event=None, timeout=None, max_iterations=None):
+        """
+        Args:
+            timeout (float, optional): 这次对话的时限（秒），同样限制它调用的工具和子智能体，超时时返回部分回答。
+            max_iterations (int, optional): 这次对话的迭代轮数预算，子智能体的迭代也计入。
+        """
+        msg = self._conversation(ctx)
+        logging.debug("context: %s", msg)
+        question = {
             "role": "user",
-            "content": text})
-        msg_withouttool = [m for m in msg if m["role"] != "tool"]
-        answer,function_call_history = self.llm.using_tool(messages=msg_withouttool, maxloop= self.maxloop, stream=stream, style=style)
-        msg.append({
-            "role": "tool",
-            "content": function_call_history,
-        })
-        msg.append({
-            "role": "assistant",
-            "content": answer})
+            "content": text}
+        # 本轮对话在视图上进行，结束时一次性写入对话记录，同一会话上的并发调用不会交错
+        msg_withouttool = msg.without_tool()
+        msg_withouttool.append(question)
+        with self.llm._span("agent.chat", agent=self.name, ctx=ctx):
+            answer,function_call_history = self.llm.using_tool(messages=msg_withouttool, maxloop= self.maxloop, stream=stream, style=style, ctx=ctx,
+                                                                 on_event=on_event, timeout=timeout, max_iterations=max_iterations)
+        self._commit_turn(msg, question, answer, function_call_history)
         return answer,function_call_history
 
+    def _conversation(self, ctx):
+        with self._lock:
+            if ctx not in self.context:
+                self.context[ctx] = Conversation([{
+                    "role": "system",
+                    "content": self.system_prompt}])
+            return self.context[ctx]
+
+    def _commit_turn(self, msg, question, answer, function_call_history):
+        with self._lock:
+            msg.extend([question, {
+                "role": "tool",
+                "content": function_call_history,
+            }, {
+                "role": "assistant",
+                "content": answer}])
+
+    def serve(self, host="127.0.0.1", port=8000, **options):
+        "以HTTP服务发布这个智能体，多个会话按session区分，见pyllm.server.AgentServer"
+        from pyllm.server import serve
+        serve(self, host=host, port=port, **options)
+
     def interactive(self, prompt_index = ">>> "):
+        # prompt_toolkit只有交互模式需要，在这里才导入
+        from prompt_toolkit import PromptSession
+        from prompt_toolkit.auto_suggest import AutoSuggestFromHistory
+        from prompt_toolkit.history import InMemoryHistory
+        from prompt_toolkit.completion import WordCompleter
         history = InMemoryHistory()
         history.append_string("agent")
         keywords = []
@@ -0,0 +1,66 @@
+import asyncio
+import logging
+from pyllm.agent_base import AgentBase
+from pyllm.async_llm import AsyncLLM
+from pyllm.scope import current_scope
+
+
+class AsyncAgentBase(AgentBase):
+    "基础智能体（异步版本），一个事件循环即可同时驱动大量会话"
+
+    llm_class = AsyncLLM
+
+    async def ask(self, text, stream=False):
+        return await self.llm.using_tool(text, maxloop= self.maxloop, stream=stream)
+
+    async def chat(self, text, ctx="default", stream=False, style="colorful", on_event=None, timeout=None, max_iterations=None):
+        "参数同AgentBase.chat"
+        msg = self._conversation(ctx)
+        logging.debug("context: %s", msg)
+        question = {
+            "role": "user",
+            "content": text}
+        msg_withouttool = msg.without_tool()
+        msg_withouttool.append(question)
+        with self.llm._span("agent.chat", agent=self.name, ctx=ctx):
+            answer,function_call_history = await self.llm.using_tool(messages=msg_withouttool, maxloop= self.maxloop, stream=stream, style=style, ctx=ctx,
+                                                                       on_event=on_event, timeout=timeout, max_iterations=max_iterations)
+        self._commit_turn(msg, question, answer, function_call_history)
+        return answer,function_call_history
+
+    def _child_agent_tool(self, agent):
+        "子智能体作为异步工具，见AgentBase._child_agent_tool"
+        async def call_child_agent(text):
+            scope = current_scope()
+            if scope is None:
+                return await agent.chat(text)
+            return await agent.chat(text, ctx=scope.ctx or "default", style=scope.style or "colorful")
+        return call_child_agent
+
+    def interactive(self, prompt_index = ">>> "):
+        asyncio.run(self.interactive_async(prompt_index))
+
+    async def interactive_async(self, prompt_index = ">>> "):
+        # prompt_toolkit只有交互模式需要，在这里才导入
+        from prompt_toolkit import PromptSession
+        from prompt_toolkit.auto_suggest import AutoSuggestFromHistory
+        from prompt_toolkit.history import InMemoryHistory
+        from prompt_toolkit.completion import WordCompleter
+        history = InMemoryHistory()
+        history.append_string("agent")
+        agents_completer = WordCompleter(list(self.llm.tools))
+
+        session = PromptSession(
+            history=history,
+            auto_suggest=AutoSuggestFromHistory(),
+            enable_history_search=True,
+        )
+
+        while True:
+            try:
+                text = await session.prompt_async(prompt_index,completer=agents_completer)
+            except EOFError:
+                break
+            if text == "exit":
+                break
+            await self.chat(text)
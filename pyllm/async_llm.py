@@ -0,0 +1,442 @@
+import asyncio
+import inspect
+import logging
+from pyllm.batch import RateLimiter, run_batch_async, BATCH_CONCURRENCY, BATCH_MAX_RETRIES
+from pyllm.cache import MISS
+from pyllm.client import get_async_client
+from pyllm.llm import LLM, FUNCTION_CALL_MAX_LOOP
+from pyllm.metrics import current_attr
+from pyllm.scope import request_scope, STOP_DEADLINE, STOP_MAX_LOOP
+from pyllm.utils import pretty
+from pyllm.events import make_emitter, STYLE_MUTE, IterationStart, TextDelta, ToolCallStart, ToolArgumentsDelta, ResponseDone, MaxLoopExceeded, Done
+
+
+class AsyncToolDispatcher:
+    """
+    ToolDispatcher的异步版本：可并行的工具调用立即创建任务执行（最多tool_concurrency个同时运行），
+    按tool_calls的原始顺序收集结果。
+    """
+
+    def __init__(self, llm, memo=None):
+        self.llm = llm
+        self.memo = memo
+        self.semaphore = asyncio.Semaphore(max(llm.tool_concurrency, 1))
+        self.tasks = {}
+
+    def submit(self, position, tool_call):
+        if position in self.tasks or not self.llm._is_parallel_tool(tool_call):
+            return
+        logging.debug(f"dispatch tool call {position}: {tool_call['function']['name']}")
+        self.tasks[position] = asyncio.ensure_future(self._run(tool_call))
+
+    async def _run(self, tool_call):
+        async with self.semaphore:
+            return await self.llm._run_tool(tool_call, self.memo)
+
+    async def results(self, tool_calls):
+        results = []
+        for position, tool_call in enumerate(tool_calls):
+            if position in self.tasks:
+                results.append(await self.tasks[position])
+            else:
+                results.append(await self.llm._run_tool(tool_call, self.memo))
+        return results
+
+    def close(self):
+        for task in self.tasks.values():
+            task.cancel()
+
+
+class AsyncLLM(LLM):
+    """
+    基于AsyncOpenAI的异步LLM。
+    接口与LLM保持一致，chat/ask/using_tool/function_call 均为协程，
+    工具既可以是普通函数（在线程池中运行），也可以是 async def 函数。
+    """
+
+    def _new_client(self, api_key, base_url):
+        return get_async_client(api_key, base_url)
+
+    async def _create_completion(self, **kwargs):
+        self._prepare_client()
+        self._apply_deadline(kwargs)
+        if self.transport is not None:
+            return await self.transport.acomplete(self._send_completion, kwargs)
+        return await self._send_completion(**kwargs)
+
+    async def _send_completion(self, **kwargs):
+        if self.pool is None:
+            return await self._request_client().chat.completions.create(**kwargs)
+        return await self.pool.acall(lambda client, endpoint: client.chat.completions.create(**dict(kwargs, model=endpoint.model or kwargs["model"])))
+
+    async def chat_with_context(self, question, ctx="default", model=None):
+        if model is None:
+            model = self.default_model
+        if ctx not in self.context:
+            logging.debug(f"context {ctx} not found, create a new one")
+            self.context[ctx] = []
+        messages = self.context[ctx]
+        messages.append({
+            "role": "user",
+            "content": question})
+        answer = await self.chat(messages, model=model)
+        messages.append({
+            "role": "assistant",
+            "content": answer})
+        return answer
+
+    async def ask(self, prompt, model=None, use_cache=True):
+        msg = [{"role": "user", "content": prompt}]
+        return await self.chat(msg, model=model, use_cache=use_cache)
+
+    async def chat(self, messages, model=None, use_cache=True):
+        """
+        向指定的模型发送问题并返回答案（异步）。
+        Args:
+            messages (dict): 待询问的问题，模型上下文。
+            model (str, optional): 模型名称，默认为None。如果未指定，则使用默认模型。
+            use_cache (bool, optional): 是否使用响应缓存，仅在设置了cache时有效。
+        Returns:
+            str: 模型的回答。
+        """
+        if model is None:
+            model = self.default_model
+        with self._span("llm.call", model=model, stream=False) as span:
+            cache_key = None
+            if self.cache is not None and use_cache:
+                cache_key = self.cache.make_key(model, messages)
+                cached = self.cache.get(cache_key)
+                if cached is not None:
+                    span.set(cached=True)
+                    return cached
+            semantic_query, cached = self._semantic_lookup(model, messages, use_cache=use_cache)
+            if cached is not None:
+                span.set(cached=True, semantic=True)
+                return cached
+            response = await self._create_completion(
+                model=model, messages=messages)
+            self._record_usage(span, response)
+            logging.debug(f"reponse content {str(response)}")
+            answer = response.choices[0].message.content
+            logging.debug(f"answer by {model}, {answer}")
+            if cache_key is not None and answer is not None:
+                self.cache.set(cache_key, answer)
+            if semantic_query is not None and answer is not None:
+                self.semantic_cache.add(*semantic_query, answer)
+            return answer
+
+    def _run_batch(self, items, to_messages, model=None, concurrency=BATCH_CONCURRENCY, rpm=None, tpm=None,
+                   max_retries=BATCH_MAX_RETRIES, ordered=False, progress=None, use_cache=True):
+        """
+        批量请求（异步），参数同LLM._run_batch。
+        Returns:
+            async generator: 用 async for 逐条获取BatchResult。
+        """
+        rate_limiter = RateLimiter(rpm=rpm, tpm=tpm) if rpm or tpm else None
+
+        async def call(messages):
+            with request_scope(client_retries=False):
+                return await self.chat(messages, model=model, use_cache=use_cache)
+        return run_batch_async(call, items, to_messages,
+                               concurrency=concurrency, rate_limiter=rate_limiter, max_retries=max_retries,
+                               ordered=ordered, progress=progress)
+
+    async def using_tool(self, question=None, messages=None, model=None, maxloop=FUNCTION_CALL_MAX_LOOP, stream=False, style = "colorful", early_dispatch=False, use_cache=True, ctx=None, on_event=None, timeout=None, max_iterations=None):
+        """
+        调用外部工具（异步）。
+
+        Args:
+            question (str): 待询问的问题。
+            messages (list, optional): 消息列表，默认为None。如果未指定则按question提问。
+            model (str, optional): 模型名称，默认为None。如果未指定，则使用默认模型。
+            early_dispatch (bool, optional): 仅流式模式有效，工具调用参数一完整就开始执行，不等整个响应结束。
+            use_cache (bool, optional): 是否使用响应缓存，仅在设置了cache时有效。
+            ctx (str, optional): 会话标识，cache_policy为"conversation"的工具在同一ctx的多次调用间共享结果缓存。
+            style (str, optional): 终端输出方式，"colorful"、"plain"或"mute"（不输出）。
+            on_event (callable, optional): 事件回调on_event(event)，事件类型见pyllm.events。
+            timeout (float, optional): 时限（秒），与外层请求的截止时间取较早的一个。
+            max_iterations (int, optional): 迭代轮数预算，子智能体的迭代也计入。
+
+        Returns:
+            tuple: 模型的回答和函数调用历史。
+        """
+
+        if model is None:
+            model = self.default_model
+
+        messages = self._prepare_messages(question, messages)
+        tools = self._prepare_tools()
+
+        memo = self._conversation_memo(ctx)
+        emit = make_emitter(style, on_event)
+        function_call_loop = 0
+        function_call_history = []
+        answer = partial = None
+        stop = None
+
+        # 截止时间从客户端创建好之后开始计算，第一次调用时导入openai的耗时不占用timeout
+        self._prepare_client()
+        with request_scope(ctx=ctx, style=style, timeout=timeout, max_iterations=max_iterations) as scope, \
+                self._span("llm.using_tool", model=model, ctx=ctx) as span:
+            semantic_query, cached = self._semantic_lookup(model, messages, tools, use_cache=use_cache)
+            if cached is not None:
+                span.set(cached=True, semantic=True)
+                return self._replay_semantic(cached, emit)
+            while function_call_loop < maxloop:
+                stop = scope.stop_reason()
+                if stop is not None:
+                    break
+                scope.consume_iteration()
+                function_call_loop += 1
+                if emit is not None:
+                    emit(IterationStart(function_call_loop))
+
+                with self._span("llm.iteration", model=model, iteration=function_call_loop):
+                    dispatcher = AsyncToolDispatcher(self, memo) if stream and early_dispatch else None
+                    try:
+                        request_messages = await self.context_manager.afit(messages) if self.context_manager is not None else messages
+                        # emit已经包含了终端输出，function_call不再单独输出
+                        answer, tool_calls, response_message = await self.function_call(model, request_messages, tools, stream=stream, style=STYLE_MUTE, use_cache=use_cache,
+                                                                                        on_tool_call=dispatcher.submit if dispatcher else None, on_event=emit)
+                    except BaseException as e:
+                        if dispatcher:
+                            dispatcher.close()
+                        # 请求因为截止时间被中断，返回已有的部分回答
+                        if isinstance(e, Exception) and scope.expired():
+                            logging.warning(f"request deadline exceeded: {e}")
+                            stop = STOP_DEADLINE
+                            break
+                        raise
+                    messages.append(response_message)
+                    partial = answer or partial
+
+                    # 如果模型响应没有tool_calls，则说明循环结束，返回结果。
+                    if not tool_calls:
+                        if semantic_query is not None and answer is not None:
+                            self.semantic_cache.add(*semantic_query, [answer, function_call_history])
+                        if emit is not None:
+                            emit(Done(answer, function_call_history))
+                        return answer, function_call_history
+
+                    await self._handle_tool_calls(tool_calls, function_call_history, messages, dispatcher=dispatcher, memo=memo, emit=emit)
+
+        stop = stop or STOP_MAX_LOOP
+        if emit is not None:
+            emit(MaxLoopExceeded(partial, stop))
+            emit(Done(partial, function_call_history))
+        logging.info(f"Stop before finish ({stop}), answer: {partial}, function_call_history: {function_call_history}")
+        return partial, function_call_history
+
+    async def iter_events(self, question=None, messages=None, **kwargs):
+        """
+        逐个返回using_tool产生的事件（异步生成器），最后一个事件是Done。
+        提前退出迭代时取消using_tool。
+
+        Args:
+            question, messages, kwargs: 同using_tool。
+        Yields:
+            Event: 事件类型见pyllm.events。
+        """
+        events = asyncio.Queue()
+        task = asyncio.ensure_future(self.using_tool(question, messages, style=STYLE_MUTE, on_event=events.put_nowait, **kwargs))
+        task.add_done_callback(lambda _: events.put_nowait(None))
+        try:
+            while True:
+                event = await events.get()
+                if event is None:
+                    # using_tool出错时没有Done事件
+                    task.result()
+                    return
+                yield event
+                if isinstance(event, Done):
+                    return
+        finally:
+            if not task.done():
+                task.cancel()
+
+    async def function_call(self, model, messages, tools, stream=False, style="colorful", on_tool_call=None, use_cache=True, on_event=None):
+        emit = make_emitter(style, on_event)
+        with self._span("llm.call", model=model, stream=stream, iteration=current_attr("iteration")) as span:
+            return await self._function_call(span, model, messages, tools, stream=stream, emit=emit,
+                                             on_tool_call=on_tool_call, use_cache=use_cache)
+
+    async def _function_call(self, span, model, messages, tools, stream=False, emit=None, on_tool_call=None, use_cache=True):
+        cache_key = None
+        if self.cache is not None and use_cache:
+            cache_key = self.cache.make_key(model, messages, tools)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                span.set(cached=True)
+                return self._replay_cached(cached, stream, emit, on_tool_call)
+        if not stream:
+            response = await self._create_completion(
+                model=model,
+                messages=messages,
+                tools=tools,
+            )
+            self._record_usage(span, response)
+            response_message = response.choices[0].message
+            answer = response_message.content
+            if answer and emit is not None:
+                emit(TextDelta(answer))
+            tool_calls = []
+            if response_message.tool_calls:
+                for position, tool in enumerate(response_message.tool_calls):
+                    if emit is not None:
+                        emit(ToolCallStart(position, tool.id, tool.function.name))
+                        emit(ToolArgumentsDelta(position, tool.function.arguments))
+                    tool_calls.append({
+                        "id": tool.id,
+                        "function": {
+                            "name": tool.function.name,
+                            "arguments": tool.function.arguments,
+                        }
+                    })
+            if emit is not None:
+                emit(ResponseDone(answer, tool_calls))
+            if logging.getLogger().isEnabledFor(logging.INFO):
+                logging.info(f"tool choice:{pretty(response_message.model_dump())}")
+            if cache_key is not None:
+                self._store_cached(cache_key, answer, tool_calls)
+            return answer, tool_calls, response_message
+        else:
+            # 流式调用和打印输出
+            stream = await self._create_completion(
+                model=model,
+                messages=messages,
+                tools=tools,
+                stream=True,
+                **self._stream_options()
+            )
+            tool2call = {}
+            dispatched = set()
+            answer = ""
+
+            def dispatch(index):
+                if on_tool_call is None or index in dispatched:
+                    return
+                dispatched.add(index)
+                on_tool_call(list(tool2call).index(index), self._stream_tool_call(tool2call[index]))
+
+            async for chunk in stream:
+                if not chunk.choices:
+                    # include_usage时最后一个chunk只有usage
+                    self._record_usage(span, chunk)
+                    continue
+                span.mark_first_token()
+                chunk_message = chunk.choices[0].delta.content
+                if chunk_message is not None:
+                    answer += chunk_message
+                    if emit is not None:
+                        emit(TextDelta(chunk_message))
+                delta_tool_calls = chunk.choices[0].delta.tool_calls
+                if delta_tool_calls is not None:
+                    for i in delta_tool_calls:
+                        index = i.index
+                        function_id = i.id
+                        function_name = i.function.name
+                        function_params = i.function.arguments
+                        if index not in tool2call:
+                            # 出现了新的工具调用，之前的工具调用参数已经完整
+                            for prev in tool2call:
+                                dispatch(prev)
+                            tool2call[index] = ({"id": function_id, "name": function_name, "params": function_params or ""})
+                            if emit is not None:
+                                emit(ToolCallStart(len(tool2call) - 1, function_id, function_name))
+                                if function_params:
+                                    emit(ToolArgumentsDelta(len(tool2call) - 1, function_params))
+                        else:
+                            tool2call[index]["params"] += function_params
+                            if on_tool_call is not None and "}" in function_params and self._is_complete_json(tool2call[index]["params"]):
+                                dispatch(index)
+                            if emit is not None and function_params:
+                                emit(ToolArgumentsDelta(list(tool2call).index(index), function_params))
+            for index in tool2call:
+                dispatch(index)
+            tool_calls = [self._stream_tool_call(tool2call[index]) for index in tool2call]
+            response_message = {
+                "role": "assistant",
+                "content": answer,
+                "refusal": None,
+                "function_call": None,
+                "tool_calls": tool_calls
+            }
+            if emit is not None:
+                emit(ResponseDone(answer, tool_calls))
+            if logging.getLogger().isEnabledFor(logging.DEBUG):
+                logging.debug(f"tool choice:{pretty(response_message)}")
+            if cache_key is not None:
+                self._store_cached(cache_key, answer, tool_calls)
+            return answer, tool_calls, response_message
+
+    async def _call_tool_function(self, tool_function, para):
+        # async def 工具直接await，普通函数放到线程里跑，避免阻塞事件循环
+        if inspect.iscoroutinefunction(tool_function):
+            result = await tool_function(**para)
+        else:
+            result = await asyncio.to_thread(tool_function, **para)
+        # 普通函数也可能返回协程（例如包装了异步子智能体的lambda）
+        if inspect.isawaitable(result):
+            result = await result
+        return result
+
+    async def _handle_tool_calls(self, tool_calls, function_call_history, messages, dispatcher=None, memo=None, emit=None):
+        """
+        并发执行同一轮中的全部工具调用，最多同时运行tool_concurrency个；
+        parallel=False的工具按顺序依次执行。结果按tool_calls的原始顺序追加。
+        """
+        if dispatcher is None:
+            dispatcher = AsyncToolDispatcher(self, memo)
+        try:
+            for position, tool_call in enumerate(tool_calls):
+                dispatcher.submit(position, tool_call)
+            results = await dispatcher.results(tool_calls)
+        finally:
+            dispatcher.close()
+
+        for history_item, tool_message in results:
+            self._append_tool_result(history_item, tool_message, function_call_history, messages, emit)
+
+    async def _handle_tool_call(self, tool_call, function_call_history, messages, memo=None, emit=None):
+        history_item, tool_message = await self._run_tool(tool_call, memo)
+        self._append_tool_result(history_item, tool_message, function_call_history, messages, emit)
+
+    async def _run_tool(self, tool_call, memo=None):
+        tool_name = tool_call["function"]["name"]
+        with self._span("tool", tool=tool_name) as span:
+            return await self._call_tool(span, tool_call, memo)
+
+    async def _call_tool(self, span, tool_call, memo=None):
+        tool_name = tool_call["function"]["name"]
+        para = tool_call["function"]["arguments"]
+        try:
+            if tool_name in self.tools:
+                para = self._parse_arguments(tool_name, para)
+
+            if tool_name not in self.tools:
+                logging.error(f"Tool not found: {tool_name}")
+                raise Exception(f"Tool not found: {tool_name}")
+
+            tool_memo = self._tool_memo(tool_name, memo)
+            if tool_memo is not None:
+                memo_key = self._memo_key(para)
+                result = tool_memo.get(memo_key)
+                if result is not MISS:
+                    logging.info(f"Tool cache hit: {tool_name}({para})")
+                    span.set(cache="hit")
+                    return self._tool_result(tool_call, tool_name, para, result, cache_status="hit")
+
+            logging.info(f"Running tool: {tool_name}({para})")
+            tool_function = self.tools[tool_name]["function"]
+            result = await self._call_tool_function(tool_function, para)
+
+            if tool_memo is not None:
+                result = str(result)
+                tool_memo.set(memo_key, result)
+                span.set(cache="miss")
+                return self._tool_result(tool_call, tool_name, para, result, cache_status="miss")
+            return self._tool_result(tool_call, tool_name, para, result)
+
+        except Exception as e:
+            span.set(error=repr(e))
+            return self._tool_error(tool_call, tool_name, para, e)
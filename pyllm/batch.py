@@ -0,0 +1,271 @@
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+BATCH_CONCURRENCY = 8
+BATCH_MAX_RETRIES = 3
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 60.0
+
+
+class TokenBucket:
+    """
+    令牌桶，按每分钟rate_per_minute个令牌的速度补充，容量为一分钟的额度。
+    reserve先扣减令牌（可以扣成负数），返回需要等待的秒数，同步和异步调用方各自sleep。
+    """
+
+    def __init__(self, rate_per_minute):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = float(rate_per_minute)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, n=1):
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= n
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+
+class RateLimiter:
+    "请求数（rpm）和token数（tpm）两个维度的限流，任意一个为None表示不限制"
+
+    def __init__(self, rpm=None, tpm=None):
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+
+    def reserve(self, tokens=0):
+        delay = 0.0
+        if self.requests is not None:
+            delay = max(delay, self.requests.reserve(1))
+        if self.tokens is not None and tokens:
+            delay = max(delay, self.tokens.reserve(tokens))
+        return delay
+
+    def acquire(self, tokens=0):
+        delay = self.reserve(tokens)
+        if delay > 0:
+            time.sleep(delay)
+
+    async def acquire_async(self, tokens=0):
+        import asyncio
+        delay = self.reserve(tokens)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class BatchResult:
+    """
+    批量请求中单个条目的结果。
+    Attributes:
+        index (int): 条目在输入中的序号。
+        input: 原始输入（prompt或消息列表）。
+        answer (str): 模型的回答，出错时为None。
+        error (Exception): 重试耗尽后的异常，成功时为None。
+        attempts (int): 实际请求次数。
+        elapsed (float): 包含排队、限流和重试在内的耗时（秒）。
+    """
+
+    def __init__(self, index, input, answer=None, error=None, attempts=0, elapsed=0.0):
+        self.index = index
+        self.input = input
+        self.answer = answer
+        self.error = error
+        self.attempts = attempts
+        self.elapsed = elapsed
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        if self.ok:
+            return f"BatchResult(index={self.index}, answer={self.answer!r})"
+        return f"BatchResult(index={self.index}, error={self.error!r})"
+
+
+def estimate_tokens(messages):
+    "粗略估计消息的token数（约4个字符一个token），只用于tpm限流"
+    total = 0
+    for message in messages:
+        total += len(str(message.get("content") or "")) // 4 + 4
+    return total
+
+
+def is_retryable(error):
+    "429限流、5xx服务端错误以及连接/超时错误可以重试"
+    import openai
+    if isinstance(error, (openai.APIConnectionError, openai.RateLimitError)):
+        return True
+    status_code = getattr(error, "status_code", None)
+    return status_code is not None and (status_code == 429 or status_code >= 500)
+
+
+def retry_delay(error, attempt):
+    "优先使用服务端返回的Retry-After，否则指数退避加随机抖动"
+    response = getattr(error, "response", None)
+    retry_after = None
+    if response is not None:
+        retry_after = response.headers.get("retry-after")
+    try:
+        if retry_after is not None:
+            return min(float(retry_after), RETRY_MAX_DELAY)
+    except ValueError:
+        pass
+    delay = min(RETRY_BASE_DELAY * (2 ** attempt), RETRY_MAX_DELAY)
+    return delay * (0.5 + random.random() / 2)
+
+
+def _run_item(fn, index, item, messages, rate_limiter, max_retries):
+    start = time.monotonic()
+    attempt = 0
+    while True:
+        if rate_limiter is not None:
+            rate_limiter.acquire(estimate_tokens(messages))
+        attempt += 1
+        try:
+            answer = fn(messages)
+            return BatchResult(index, item, answer=answer, attempts=attempt, elapsed=time.monotonic() - start)
+        except Exception as e:
+            if attempt > max_retries or not is_retryable(e):
+                logging.error(f"batch item {index} failed after {attempt} attempts: {e}")
+                return BatchResult(index, item, error=e, attempts=attempt, elapsed=time.monotonic() - start)
+            delay = retry_delay(e, attempt - 1)
+            logging.warning(f"batch item {index} attempt {attempt} failed: {e}, retry in {delay:.1f}s")
+            time.sleep(delay)
+
+
+def run_batch(fn, items, to_messages, concurrency=BATCH_CONCURRENCY, rate_limiter=None,
+              max_retries=BATCH_MAX_RETRIES, ordered=False, progress=None):
+    """
+    并发执行批量请求，结果以生成器的形式在完成时返回。
+
+    Args:
+        fn (callable): fn(messages) -> answer，单次请求。
+        items (iterable): 输入，按需读取，不会一次性全部提交。
+        to_messages (callable): 把输入条目转换成消息列表。
+        concurrency (int, optional): 同时进行的请求数。
+        rate_limiter (RateLimiter, optional): 限流器。
+        max_retries (int, optional): 可重试错误的最大重试次数。
+        ordered (bool, optional): True按输入顺序返回，False按完成顺序返回。
+        progress (callable, optional): 每完成一条调用progress(已完成数, BatchResult)。
+    Returns:
+        generator: 逐条产出BatchResult，出错的条目不会中断整个批次。
+    """
+    _check_concurrency(concurrency)
+    return _run_batch(fn, items, to_messages, concurrency, rate_limiter, max_retries, ordered, progress)
+
+
+def _check_concurrency(concurrency):
+    "在返回生成器之前检查，concurrency为0时不会提交任何请求，生成器直接结束"
+    if isinstance(concurrency, bool) or not isinstance(concurrency, int) or concurrency < 1:
+        raise ValueError(f"concurrency must be a positive integer, got {concurrency!r}")
+
+
+def _run_batch(fn, items, to_messages, concurrency, rate_limiter, max_retries, ordered, progress):
+    iterator = enumerate(items)
+    pending = set()
+    buffered = {}
+    next_index = 0
+    done_count = 0
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        def fill():
+            while len(pending) < concurrency:
+                try:
+                    index, item = next(iterator)
+                except StopIteration:
+                    return
+                pending.add(executor.submit(_run_item, fn, index, item, to_messages(item), rate_limiter, max_retries))
+
+        fill()
+        while pending:
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                pending.discard(future)
+                result = future.result()
+                done_count += 1
+                if progress is not None:
+                    progress(done_count, result)
+                if not ordered:
+                    yield result
+                else:
+                    buffered[result.index] = result
+            fill()
+            while next_index in buffered:
+                yield buffered.pop(next_index)
+                next_index += 1
+
+
+async def _run_item_async(fn, index, item, messages, rate_limiter, max_retries):
+    import asyncio
+    start = time.monotonic()
+    attempt = 0
+    while True:
+        if rate_limiter is not None:
+            await rate_limiter.acquire_async(estimate_tokens(messages))
+        attempt += 1
+        try:
+            answer = await fn(messages)
+            return BatchResult(index, item, answer=answer, attempts=attempt, elapsed=time.monotonic() - start)
+        except Exception as e:
+            if attempt > max_retries or not is_retryable(e):
+                logging.error(f"batch item {index} failed after {attempt} attempts: {e}")
+                return BatchResult(index, item, error=e, attempts=attempt, elapsed=time.monotonic() - start)
+            delay = retry_delay(e, attempt - 1)
+            logging.warning(f"batch item {index} attempt {attempt} failed: {e}, retry in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+
+def run_batch_async(fn, items, to_messages, concurrency=BATCH_CONCURRENCY, rate_limiter=None,
+                    max_retries=BATCH_MAX_RETRIES, ordered=False, progress=None):
+    "run_batch的异步版本，fn为协程函数，返回异步生成器"
+    _check_concurrency(concurrency)
+    return _run_batch_async(fn, items, to_messages, concurrency, rate_limiter, max_retries, ordered, progress)
+
+
+async def _run_batch_async(fn, items, to_messages, concurrency, rate_limiter, max_retries, ordered, progress):
+    # asyncio只在异步批量时导入，同步使用pyllm时不需要加载
+    import asyncio
+    iterator = enumerate(items)
+    pending = set()
+    buffered = {}
+    next_index = 0
+    done_count = 0
+
+    def fill():
+        while len(pending) < concurrency:
+            try:
+                index, item = next(iterator)
+            except StopIteration:
+                return
+            pending.add(asyncio.ensure_future(
+                _run_item_async(fn, index, item, to_messages(item), rate_limiter, max_retries)))
+
+    fill()
+    try:
+        while pending:
+            finished, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in finished:
+                pending.discard(task)
+                result = task.result()
+                done_count += 1
+                if progress is not None:
+                    progress(done_count, result)
+                if not ordered:
+                    yield result
+                else:
+                    buffered[result.index] = result
+            fill()
+            while next_index in buffered:
+                yield buffered.pop(next_index)
+                next_index += 1
+    finally:
+        for task in pending:
+            task.cancel()
@@ -0,0 +1,120 @@
+import hashlib
+import logging
+import mmap
+import os
+import re
+import shutil
+import tempfile
+import threading
+import weakref
+
+BLOB_PAGE_SIZE = 4000
+BLOB_HANDLE_PREFIX = "blob:"
+_HANDLE_PATTERN = re.compile(re.escape(BLOB_HANDLE_PREFIX) + r"[0-9a-f]{16}")
+
+
+class BlobStore:
+    """
+    大块文本的磁盘存储，读取时用mmap只映射需要的部分。
+    内容按sha256去重，句柄形如"blob:<摘要前16位>"；每页的字节偏移在写入时计算好，按页读取不会切断多字节字符。
+
+    Args:
+        path (str, optional): 存储目录，为None时使用临时目录，close()或对象回收、进程退出时删除。
+        page_size (int, optional): 每页的字符数。
+    """
+
+    def __init__(self, path=None, page_size=BLOB_PAGE_SIZE):
+        self._temporary = path is None
+        self.path = tempfile.mkdtemp(prefix="pyllm-blob-") if path is None else path
+        os.makedirs(self.path, exist_ok=True)
+        self.page_size = page_size
+        self._pages = {}
+        self._lock = threading.Lock()
+        self._cleanup = weakref.finalize(self, shutil.rmtree, self.path, True) if self._temporary else None
+
+    def put(self, text):
+        """
+        Returns:
+            str: 句柄。
+        """
+        data = text.encode("utf-8")
+        handle = BLOB_HANDLE_PREFIX + hashlib.sha256(data).hexdigest()[:16]
+        file_path = self._file(handle)
+        if not os.path.exists(file_path):
+            # 先写临时文件再改名，并发写入同一内容也不会读到半个文件
+            fd, tmp_path = tempfile.mkstemp(dir=self.path)
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, file_path)
+            logging.debug(f"spill {len(data)} bytes to {file_path}")
+        with self._lock:
+            self._pages[handle] = self._page_offsets(text)
+        return handle
+
+    def exists(self, handle):
+        return isinstance(handle, str) and _HANDLE_PATTERN.fullmatch(handle) is not None and os.path.exists(
+            self._file(handle))
+
+    def size(self, handle):
+        return os.path.getsize(self._existing_file(handle))
+
+    def page_count(self, handle):
+        return len(self._offsets(handle)) - 1
+
+    def read_page(self, handle, page):
+        """
+        Args:
+            page (int): 页码，从1开始。
+        Returns:
+            str: 该页的文本。
+        """
+        offsets = self._offsets(handle)
+        if page < 1 or page >= len(offsets):
+            raise ValueError(f"page {page} out of range, {handle} has {len(offsets) - 1} pages")
+        return self._read(handle, offsets[page - 1], offsets[page]).decode("utf-8")
+
+    def read_range(self, handle, offset, length):
+        "按字节范围读取，边界上不完整的字符会被替换"
+        return self._read(handle, offset, offset + length).decode("utf-8", errors="replace")
+
+    def _read(self, handle, start, end):
+        file_path = self._existing_file(handle)
+        with open(file_path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return b""
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                return m[max(start, 0):end]
+
+    def _offsets(self, handle):
+        with self._lock:
+            offsets = self._pages.get(handle)
+        if offsets is None:
+            # 进程重启后（path不是临时目录时）从文件重新计算分页
+            offsets = self._page_offsets(self._read(handle, 0, self.size(handle)).decode("utf-8", errors="replace"))
+            with self._lock:
+                self._pages[handle] = offsets
+        return offsets
+
+    def _page_offsets(self, text):
+        offsets = [0]
+        for start in range(0, len(text), self.page_size):
+            offsets.append(offsets[-1] + len(text[start:start + self.page_size].encode("utf-8")))
+        if len(offsets) == 1:
+            offsets.append(0)
+        return offsets
+
+    def _file(self, handle):
+        # 句柄由模型给出，只接受put生成的格式，错误信息里不带存储路径
+        if not isinstance(handle, str) or _HANDLE_PATTERN.fullmatch(handle) is None:
+            raise KeyError(f"Unknown handle: {handle}")
+        return os.path.join(self.path, handle[len(BLOB_HANDLE_PREFIX):])
+
+    def _existing_file(self, handle):
+        file_path = self._file(handle)
+        if not os.path.exists(file_path):
+            raise KeyError(f"Unknown handle: {handle}")
+        return file_path
+
+    def close(self):
+        if self._cleanup is not None:
+            self._cleanup()
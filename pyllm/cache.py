@@ -0,0 +1,177 @@
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Sequence
+
+MISS = object()
+
+
+def _json_default(obj):
+    if hasattr(obj, "model_dump"):
+        return obj.model_dump()
+    if isinstance(obj, Sequence):
+        # Conversation/MessageView等消息视图
+        return list(obj)
+    return str(obj)
+
+
+def canonical_hash(obj):
+    """
+    对请求内容计算稳定的哈希，字典按key排序，pydantic对象先转成dict。
+    Returns:
+        str: sha256十六进制摘要。
+    """
+    text = json.dumps(obj, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=_json_default)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class LRUCache:
+    "线程安全的内存LRU缓存，可选TTL（秒）"
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=MISS):
+        with self._lock:
+            item = self._data.get(key, MISS)
+            if item is MISS:
+                return default
+            value, expire_at = item
+            if expire_at is not None and expire_at < time.time():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        expire_at = time.time() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (value, expire_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SQLiteCache:
+    "基于SQLite的磁盘缓存，value以JSON保存，可选TTL（秒）"
+
+    def __init__(self, path, ttl=None):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT, created REAL)")
+        self._conn.commit()
+
+    def get(self, key, default=MISS):
+        with self._lock:
+            row = self._conn.execute("SELECT value, created FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return default
+            value, created = row
+            if self.ttl and created + self.ttl < time.time():
+                self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                self._conn.commit()
+                return default
+        return json.loads(value)
+
+    def set(self, key, value):
+        text = json.dumps(value, ensure_ascii=False, default=_json_default)
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO cache (key, value, created) VALUES (?, ?, ?)", (key, text, time.time()))
+            self._conn.commit()
+
+    def delete(self, key):
+        with self._lock:
+            self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM cache")
+            self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+
+class CompletionCache:
+    """
+    模型响应缓存。
+    key为模型、消息、工具定义和采样参数的规范化哈希；先查内存LRU，再查可选的磁盘（SQLite）层，
+    磁盘命中后回填内存。
+
+    Args:
+        maxsize (int, optional): 内存层最多缓存的条数。
+        path (str, optional): SQLite文件路径，为None时不启用磁盘层。
+        ttl (float, optional): 过期时间（秒），为None时永不过期。
+    """
+
+    def __init__(self, maxsize=1024, path=None, ttl=None):
+        self.memory = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.disk = SQLiteCache(path, ttl=ttl) if path else None
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+
+    @staticmethod
+    def make_key(model, messages, tools=None, **params):
+        return canonical_hash({
+            "model": model,
+            "messages": messages,
+            "tools": tools or [],
+            "params": params,
+        })
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is MISS and self.disk is not None:
+            value = self.disk.get(key)
+            if value is not MISS:
+                self.disk_hits += 1
+                self.memory.set(key, value)
+        if value is MISS:
+            self.misses += 1
+            logging.debug(f"cache miss: {key}")
+            return None
+        self.hits += 1
+        logging.debug(f"cache hit: {key}")
+        return value
+
+    def set(self, key, value):
+        self.memory.set(key, value)
+        if self.disk is not None:
+            self.disk.set(key, value)
+
+    def clear(self):
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "disk_hits": self.disk_hits,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": len(self.memory),
+        }
@@ -0,0 +1,152 @@
+import importlib
+import importlib.util
+import logging
+import threading
+import weakref
+
+HTTP_MAX_CONNECTIONS = 100
+HTTP_MAX_KEEPALIVE_CONNECTIONS = 20
+HTTP_KEEPALIVE_EXPIRY = 30.0
+HTTP_TIMEOUT = 600.0
+HTTP_CONNECT_TIMEOUT = 5.0
+
+
+def _http_module():
+    "openai SDK底层使用的HTTP库（较早的版本是httpx，之后换成了接口相同的httpx2），从DefaultHttpxClient的基类找到它"
+    from openai import DefaultHttpxClient
+    for base in DefaultHttpxClient.__mro__[1:]:
+        package = base.__module__.split(".")[0]
+        if package not in ("openai", "builtins"):
+            module = importlib.import_module(package)
+            if hasattr(module, "Limits"):
+                return module
+    return None
+
+
+class ClientRegistry:
+    """
+    进程级的OpenAI客户端注册表。
+    相同(base_url, api_key)的LLM/智能体共用同一个客户端和它的httpx连接池，
+    避免每个子智能体都重新建立连接、重复TLS握手。
+    openai和它底层的HTTP库（httpx或httpx2）在创建第一个客户端时才导入。
+
+    Args:
+        max_connections (int, optional): 每个连接池的最大连接数。
+        max_keepalive_connections (int, optional): 保持空闲的最大连接数。
+        keepalive_expiry (float, optional): 空闲连接的保持时间（秒）。
+        timeout (float, optional): 请求超时（秒）。
+        connect_timeout (float, optional): 建立连接的超时（秒）。
+        http2 (bool, optional): 是否启用HTTP/2，为None时在安装了h2的情况下自动启用。
+    """
+
+    def __init__(self, max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                 keepalive_expiry=HTTP_KEEPALIVE_EXPIRY, timeout=HTTP_TIMEOUT, connect_timeout=HTTP_CONNECT_TIMEOUT, http2=None):
+        self.configure(max_connections=max_connections, max_keepalive_connections=max_keepalive_connections,
+                       keepalive_expiry=keepalive_expiry, timeout=timeout, connect_timeout=connect_timeout, http2=http2)
+        self._clients = {}
+        self._async_clients = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def configure(self, max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                  keepalive_expiry=HTTP_KEEPALIVE_EXPIRY, timeout=HTTP_TIMEOUT, connect_timeout=HTTP_CONNECT_TIMEOUT, http2=None):
+        "修改连接池参数，只影响之后新建的客户端"
+        self._options = {
+            "max_connections": max_connections,
+            "max_keepalive_connections": max_keepalive_connections,
+            "keepalive_expiry": keepalive_expiry,
+            "timeout": timeout,
+            "connect_timeout": connect_timeout,
+        }
+        self._http2 = http2
+
+    def _http_options(self):
+        """
+        连接池参数，第一次创建客户端时才导入和检测h2。
+        超时使用openai.Timeout，连接数限制使用SDK底层的HTTP库，找不到它时返回None，使用SDK默认的连接池。
+        """
+        from openai import Timeout
+        http = _http_module()
+        if http is None:
+            logging.warning("cannot find the http library of openai, use its default http client")
+            return None
+        options = self._options
+        http2 = self._http2
+        if http2 is None:
+            http2 = importlib.util.find_spec("h2") is not None
+        return {
+            "limits": http.Limits(max_connections=options["max_connections"],
+                                  max_keepalive_connections=options["max_keepalive_connections"],
+                                  keepalive_expiry=options["keepalive_expiry"]),
+            "timeout": Timeout(options["timeout"], connect=options["connect_timeout"]),
+            "http2": http2,
+        }
+
+    def get(self, api_key, base_url):
+        "返回(base_url, api_key)对应的共享OpenAI客户端，不存在时创建"
+        key = (str(base_url), api_key)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                logging.debug(f"create shared openai client for {base_url}")
+                from openai import OpenAI, DefaultHttpxClient
+                http_options = self._http_options()
+                if http_options is None:
+                    client = OpenAI(api_key=api_key, base_url=base_url)
+                else:
+                    client = OpenAI(api_key=api_key, base_url=base_url, http_client=DefaultHttpxClient(**http_options))
+                self._clients[key] = client
+            return client
+
+    def get_async(self, api_key, base_url):
+        """
+        返回共享的AsyncOpenAI客户端。
+        异步连接池绑定在事件循环上，所以按当前运行的事件循环区分；
+        没有运行中的事件循环时（例如在同步代码里创建AsyncLLM）返回一个不共享的新客户端。
+        """
+        import asyncio
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+        if loop is None:
+            return AsyncOpenAI(api_key=api_key, base_url=base_url)
+        key = (str(base_url), api_key)
+        with self._lock:
+            clients = self._async_clients.setdefault(loop, {})
+            client = clients.get(key)
+            if client is None:
+                logging.debug(f"create shared async openai client for {base_url}")
+                http_options = self._http_options()
+                if http_options is None:
+                    client = AsyncOpenAI(api_key=api_key, base_url=base_url)
+                else:
+                    client = AsyncOpenAI(api_key=api_key, base_url=base_url,
+                                         http_client=DefaultAsyncHttpxClient(**http_options))
+                clients[key] = client
+            return client
+
+    def close(self):
+        "关闭所有同步客户端的连接池并清空注册表，异步客户端随事件循环一起释放"
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+            self._async_clients.clear()
+        for client in clients:
+            client.close()
+
+
+registry = ClientRegistry()
+
+
+def configure(**options):
+    "调整进程级连接池参数，参数同ClientRegistry"
+    registry.configure(**options)
+
+
+def get_client(api_key, base_url):
+    return registry.get(api_key, base_url)
+
+
+def get_async_client(api_key, base_url):
+    return registry.get_async(api_key, base_url)
@@ -0,0 +1,247 @@
+import asyncio
+import codecs
+import logging
+import os
+import signal
+import subprocess
+import threading
+import typing
+from pyllm.utils import printc, COMMAND_PARA_DESC
+from pyllm.scope import remaining_time, current_scope
+
+COMMAND_TIMEOUT = 300
+COMMAND_MAX_OUTPUT = 64 * 1024
+COMMAND_READ_SIZE = 64 * 1024
+COMMAND_KILL_GRACE = 2
+
+
+class CappedOutput:
+    """
+    有上限的输出缓冲区：只保留开头和结尾各一半，中间的部分只计数。
+    内存占用不超过max_bytes，不管命令输出多少。
+    """
+
+    def __init__(self, max_bytes=COMMAND_MAX_OUTPUT):
+        self.head_limit = max_bytes // 2
+        self.tail_limit = max_bytes - self.head_limit
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.total = 0
+
+    def write(self, data):
+        self.total += len(data)
+        room = self.head_limit - len(self.head)
+        if room > 0:
+            self.head += data[:room]
+            data = data[room:]
+        if data:
+            self.tail += data
+            if len(self.tail) > self.tail_limit:
+                del self.tail[:len(self.tail) - self.tail_limit]
+
+    @property
+    def dropped(self):
+        return self.total - len(self.head) - len(self.tail)
+
+    def text(self):
+        head = self.head.decode("utf-8", errors="replace")
+        if not self.dropped:
+            return head + self.tail.decode("utf-8", errors="replace")
+        return (f"{head}\n...[省略{self.dropped}字节]...\n"
+                f"{self.tail.decode('utf-8', errors='replace')}")
+
+
+class CommandResult:
+    """
+    命令执行结果。str()的格式与原来的run_command一致，并附上退出码，可以直接作为工具结果。
+
+    Attributes:
+        returncode (int): 退出码，被信号终止时为负数。
+        timed_out (bool): 是否因为超时被终止。
+        truncated (bool): 输出是否超过上限被截断。
+    """
+
+    def __init__(self, cmd, returncode, stdout, stderr, timed_out=False):
+        self.cmd = cmd
+        self.returncode = returncode
+        self._stdout = stdout
+        self._stderr = stderr
+        self.timed_out = timed_out
+
+    @property
+    def stdout(self):
+        return self._stdout.text()
+
+    @property
+    def stderr(self):
+        return self._stderr.text()
+
+    @property
+    def truncated(self):
+        return bool(self._stdout.dropped or self._stderr.dropped)
+
+    def __str__(self):
+        text = f"stdout\n{self.stdout}\nstderror\n{self.stderr}\nexit code {self.returncode}"
+        if self.timed_out:
+            text += "\n命令超时，已终止"
+        return text
+
+
+class _StreamReader:
+    "把一个输出流写入CappedOutput，同时按chunk回调on_output(流名称, 文本)"
+
+    def __init__(self, name, max_bytes, on_output):
+        self.name = name
+        self.output = CappedOutput(max_bytes)
+        self.on_output = on_output
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace") if on_output else None
+
+    def feed(self, data):
+        self.output.write(data)
+        if self.on_output is not None:
+            text = self.decoder.decode(data)
+            if text:
+                self.on_output(self.name, text)
+
+
+def _popen_kwargs():
+    # 命令在独立的进程组里运行，超时时连同它启动的子进程一起终止
+    if os.name == "posix":
+        return {"start_new_session": True}
+    return {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP}
+
+
+def _effective_timeout(timeout):
+    remaining = remaining_time()
+    if remaining is None:
+        return timeout
+    remaining = max(remaining, 0)
+    return remaining if timeout is None else min(timeout, remaining)
+
+
+def _kill(process, force=False):
+    try:
+        if os.name == "posix":
+            os.killpg(process.pid, signal.SIGKILL if force else signal.SIGTERM)
+        else:
+            process.kill()
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def execute_command(cmd, timeout=COMMAND_TIMEOUT, max_bytes=COMMAND_MAX_OUTPUT, on_output=None):
+    """
+    执行shell命令，边运行边读取输出。
+    Args:
+        cmd (str): shell命令。
+        timeout (float, optional): 超时时间（秒），超时后终止整个进程组，为None时不限制；不超过当前请求的剩余时间。
+        max_bytes (int, optional): stdout和stderr各自最多保留的字节数，超出时保留开头和结尾。
+        on_output (callable, optional): 实时输出回调on_output(流名称, 文本)，流名称为"stdout"或"stderr"。
+    Returns:
+        CommandResult: 退出码和截断后的输出。
+    """
+    timeout = _effective_timeout(timeout)
+    process = subprocess.Popen(cmd, shell=True, stdin=subprocess.DEVNULL,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE, **_popen_kwargs())
+    readers = [_StreamReader("stdout", max_bytes, on_output), _StreamReader("stderr", max_bytes, on_output)]
+
+    def pump(pipe, reader):
+        with pipe:
+            for data in iter(lambda: pipe.read1(COMMAND_READ_SIZE), b""):
+                reader.feed(data)
+
+    threads = [threading.Thread(target=pump, args=(pipe, reader), daemon=True)
+               for pipe, reader in zip((process.stdout, process.stderr), readers)]
+    for thread in threads:
+        thread.start()
+
+    timed_out = False
+    try:
+        process.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        timed_out = True
+        logging.warning(f"command timeout after {timeout}s: {cmd}")
+        _kill(process)
+        try:
+            process.wait(timeout=COMMAND_KILL_GRACE)
+        except subprocess.TimeoutExpired:
+            _kill(process, force=True)
+            process.wait()
+    for thread in threads:
+        # 后台进程可能继承了管道，不无限等待
+        thread.join(COMMAND_KILL_GRACE)
+    return CommandResult(cmd, process.returncode, readers[0].output, readers[1].output, timed_out)
+
+
+async def execute_command_async(cmd, timeout=COMMAND_TIMEOUT, max_bytes=COMMAND_MAX_OUTPUT, on_output=None):
+    "execute_command的异步版本，参数相同"
+    timeout = _effective_timeout(timeout)
+    process = await asyncio.create_subprocess_shell(cmd, stdin=asyncio.subprocess.DEVNULL,
+                                                    stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+                                                    **_popen_kwargs())
+    readers = [_StreamReader("stdout", max_bytes, on_output), _StreamReader("stderr", max_bytes, on_output)]
+
+    async def pump(stream, reader):
+        while True:
+            data = await stream.read(COMMAND_READ_SIZE)
+            if not data:
+                break
+            reader.feed(data)
+
+    pumps = [asyncio.ensure_future(pump(stream, reader))
+             for stream, reader in zip((process.stdout, process.stderr), readers)]
+    timed_out = False
+    try:
+        await asyncio.wait_for(process.wait(), timeout)
+    except asyncio.TimeoutError:
+        timed_out = True
+        logging.warning(f"command timeout after {timeout}s: {cmd}")
+        _kill(process)
+        try:
+            await asyncio.wait_for(process.wait(), COMMAND_KILL_GRACE)
+        except asyncio.TimeoutError:
+            _kill(process, force=True)
+            await process.wait()
+    except asyncio.CancelledError:
+        _kill(process, force=True)
+        raise
+    finally:
+        done, pending = await asyncio.wait(pumps, timeout=COMMAND_KILL_GRACE)
+        for task in pending:
+            task.cancel()
+    return CommandResult(cmd, process.returncode, readers[0].output, readers[1].output, timed_out)
+
+
+def _announce(cmd, style):
+    "没有指定style时沿用当前请求的输出方式，静默运行或在服务中运行的智能体不打印"
+    logging.debug(f"运行命令:\n{cmd}")
+    if style is None:
+        scope = current_scope()
+        style = scope.style if scope is not None and scope.style else "colorful"
+    if len(cmd.split("\n")) > 1:
+        printc(f"运行命令:\n{cmd}", style=style)
+    else:
+        printc(f"运行命令: {cmd}", style=style)
+
+
+def run_command(cmd, style=None, timeout=COMMAND_TIMEOUT, max_bytes=COMMAND_MAX_OUTPUT,
+                on_output: typing.Optional[typing.Callable] = None):
+    """
+    执行shell命令，可以直接注册为工具，模型只能给出cmd，见COMMAND_PARA_DESC。
+    Returns:
+        str: stdout、stderr和退出码，输出超过max_bytes时截断。
+    """
+    _announce(cmd, style)
+    return str(execute_command(cmd, timeout=timeout, max_bytes=max_bytes, on_output=on_output))
+
+
+async def run_command_async(cmd, style=None, timeout=COMMAND_TIMEOUT, max_bytes=COMMAND_MAX_OUTPUT,
+                            on_output: typing.Optional[typing.Callable] = None):
+    "run_command的异步版本，可以注册为AsyncLLM的工具"
+    _announce(cmd, style)
+    return str(await execute_command_async(cmd, timeout=timeout, max_bytes=max_bytes, on_output=on_output))
+
+
+# 注册为工具时超时、输出上限等由调用方决定，不交给模型
+run_command.para_desc = COMMAND_PARA_DESC
+run_command_async.para_desc = COMMAND_PARA_DESC
@@ -0,0 +1,283 @@
+import inspect
+import json
+import logging
+import threading
+from collections import OrderedDict
+from pyllm.cache import LRUCache, MISS
+
+CONTEXT_SLIDING_WINDOW = "sliding_window"
+CONTEXT_DROP_TOOL_OUTPUT = "drop_tool_output"
+CONTEXT_SUMMARIZE = "summarize"
+
+MESSAGE_TOKEN_OVERHEAD = 4
+TOKEN_CACHE_SIZE = 4096
+SUMMARY_CACHE_SIZE = 32
+TOOL_OUTPUT_PLACEHOLDER = "[工具输出已省略]"
+SUMMARY_PROMPT = "请用简洁的语言总结以下对话的要点，保留事实、结论和未完成的事项，不要遗漏关键数据。"
+
+
+def _field(message, key):
+    if isinstance(message, dict):
+        return message.get(key)
+    return getattr(message, key, None)
+
+
+class TokenCounter:
+    """
+    计算消息的token数。
+    安装了tiktoken时使用模型对应的编码，否则按字符粗略估计（ASCII约4个字符一个token，其他字符约一个token一个字）。
+    每条消息的结果按对象缓存，同一条历史消息不会在每轮对话中重复计算。
+    """
+
+    def __init__(self, model=None, cache_size=TOKEN_CACHE_SIZE):
+        self.encoding = None
+        try:
+            import tiktoken
+            try:
+                self.encoding = tiktoken.encoding_for_model(model or "gpt-4o")
+            except KeyError:
+                self.encoding = tiktoken.get_encoding("cl100k_base")
+        except ImportError:
+            logging.debug("tiktoken not installed, use approximate token counter")
+        self._cache = LRUCache(maxsize=cache_size)
+
+    def count_text(self, text):
+        if not text:
+            return 0
+        if self.encoding is not None:
+            return len(self.encoding.encode(text))
+        chars = len(text)
+        # 非ASCII字符大多是3字节的中日韩文字
+        non_ascii = (len(text.encode("utf-8")) - chars) // 2
+        return (chars - non_ascii) // 4 + non_ascii
+
+    def count_message(self, message):
+        content = _field(message, "content")
+        tool_calls = _field(message, "tool_calls")
+        cached = self._cache.get(id(message))
+        # 缓存按对象id，同时核对content和tool_calls是否还是同一个对象，防止id被复用
+        if cached is not MISS and cached[0] is content and cached[1] is tool_calls:
+            return cached[2]
+        if content and not isinstance(content, str):
+            content_text = json.dumps(content, ensure_ascii=False, default=str)
+        else:
+            content_text = content
+        tokens = MESSAGE_TOKEN_OVERHEAD + self.count_text(content_text)
+        for tool_call in tool_calls or []:
+            function = _field(tool_call, "function")
+            tokens += self.count_text(_field(function, "name")) + self.count_text(_field(function, "arguments"))
+        self._cache.set(id(message), (content, tool_calls, tokens))
+        return tokens
+
+    def count(self, messages):
+        return sum(self.count_message(message) for message in messages)
+
+
+class ContextManager:
+    """
+    按token预算裁剪发送给模型的上下文，不修改原始的消息列表。
+
+    Args:
+        budget (int): 每次请求允许的最大token数。
+        strategy (str, optional): 超出预算时的处理方式：
+            "sliding_window" 丢弃最早的对话；
+            "drop_tool_output" 先把最早的工具输出替换为占位符，仍然超出时再丢弃最早的对话；
+            "summarize" 用summarizer把较早的对话总结成一条摘要。
+        counter (TokenCounter, optional): token计数器。
+        summarizer (LLM, optional): 用于生成摘要的LLM，可以是更便宜的模型，strategy为"summarize"时必填。
+        summary_model (str, optional): 生成摘要使用的模型名。
+    """
+
+    def __init__(self, budget, strategy=CONTEXT_SLIDING_WINDOW, counter=None, summarizer=None, summary_model=None):
+        if strategy not in (CONTEXT_SLIDING_WINDOW, CONTEXT_DROP_TOOL_OUTPUT, CONTEXT_SUMMARIZE):
+            raise ValueError(f"Unknown context strategy: {strategy}")
+        if strategy == CONTEXT_SUMMARIZE and summarizer is None:
+            raise ValueError("summarize strategy requires a summarizer")
+        self.budget = budget
+        self.strategy = strategy
+        self.counter = counter or TokenCounter()
+        self.summarizer = summarizer
+        self.summary_model = summary_model
+        # 同一个ContextManager被多个会话（以及服务的多个工作线程）共用
+        self._summaries = OrderedDict()
+        self._summary_lock = threading.Lock()
+
+    def fit(self, messages):
+        """
+        Returns:
+            list: 不超过预算时原样返回messages，否则返回裁剪后的新列表。
+        """
+        plan = self._plan(messages)
+        if plan is None:
+            return messages
+        head, dropped, tail = plan
+        if not dropped:
+            return head + tail
+        summary = self._cached_summary(dropped)
+        if summary is None:
+            # 不走缓存：语义缓存可能把相近的另一段对话的摘要当作这次的摘要返回
+            summary = self.summarizer.chat(self._summary_request(dropped), model=self.summary_model, use_cache=False)
+            self._store_summary(dropped, summary)
+        return self._assemble(head, summary, tail)
+
+    async def afit(self, messages):
+        "fit的异步版本，summarizer可以是AsyncLLM"
+        plan = self._plan(messages)
+        if plan is None:
+            return messages
+        head, dropped, tail = plan
+        if not dropped:
+            return head + tail
+        summary = self._cached_summary(dropped)
+        if summary is None:
+            summary = self.summarizer.chat(self._summary_request(dropped), model=self.summary_model, use_cache=False)
+            if inspect.isawaitable(summary):
+                summary = await summary
+            self._store_summary(dropped, summary)
+        return self._assemble(head, summary, tail)
+
+    def _plan(self, messages):
+        """
+        Returns:
+            None表示不需要裁剪；否则返回(head, dropped, tail)，
+            dropped为需要总结的消息（只有summarize策略非空）。
+        """
+        counts = [self.counter.count_message(message) for message in messages]
+        total = sum(counts)
+        if total <= self.budget:
+            return None
+        logging.info(f"context has {total} tokens, exceeds budget {self.budget}, apply {self.strategy}")
+
+        # 开头的system消息总是保留
+        start = 0
+        while start < len(messages) and _field(messages[start], "role") == "system":
+            start += 1
+        head = list(messages[:start])
+        units = self._units(messages, counts, start)
+
+        if self.strategy == CONTEXT_DROP_TOOL_OUTPUT:
+            units, total = self._drop_tool_output(units, total)
+            if total <= self.budget:
+                return head, [], [m for unit in units for m in unit[0]]
+
+        if self.strategy == CONTEXT_SUMMARIZE:
+            # 多总结一些，留出一半预算给之后的对话，减少重复总结的次数
+            target = self.budget // 2
+        else:
+            target = self.budget
+        # 当前的问题（最后一条user消息）以及之后的工具调用和结果必须保留
+        keep = len(units) - 1
+        for index in range(len(units) - 1, -1, -1):
+            if _field(units[index][0][0], "role") == "user":
+                keep = index
+                break
+        dropped_units = 0
+        while total > target and dropped_units < keep:
+            total -= units[dropped_units][1]
+            dropped_units += 1
+        if total > self.budget:
+            logging.warning(f"context still has {total} tokens after trimming, budget {self.budget}")
+        dropped = [m for unit in units[:dropped_units] for m in unit[0]]
+        tail = [m for unit in units[dropped_units:] for m in unit[0]]
+        if self.strategy != CONTEXT_SUMMARIZE:
+            dropped = []
+        return head, dropped, tail
+
+    def _units(self, messages, counts, start):
+        "把消息分组：带tool_calls的assistant消息和紧随其后的tool消息是一组，不能拆开"
+        units = []
+        for message, tokens in zip(messages[start:], counts[start:]):
+            if _field(message, "role") == "tool" and units:
+                units[-1][0].append(message)
+                units[-1][1] += tokens
+            else:
+                units.append([[message], tokens])
+        return units
+
+    def _drop_tool_output(self, units, total):
+        placeholder_tokens = self.counter.count_text(TOOL_OUTPUT_PLACEHOLDER) + MESSAGE_TOKEN_OVERHEAD
+        for unit in units[:-1]:
+            for i, message in enumerate(unit[0]):
+                if total <= self.budget:
+                    return units, total
+                if _field(message, "role") != "tool" or _field(message, "content") == TOOL_OUTPUT_PLACEHOLDER:
+                    continue
+                saved = self.counter.count_message(message) - placeholder_tokens
+                unit[0][i] = dict(message, content=TOOL_OUTPUT_PLACEHOLDER)
+                unit[1] -= saved
+                total -= saved
+        return units, total
+
+    def _summary_request(self, dropped):
+        previous, summarized = self._longest_summary(dropped)
+        lines = []
+        if previous is not None:
+            lines.append(f"之前的摘要: {previous}")
+        for message in dropped[summarized:]:
+            role = _field(message, "role")
+            content = _field(message, "content")
+            if content:
+                lines.append(f"{role}: {content}")
+            for tool_call in _field(message, "tool_calls") or []:
+                function = _field(tool_call, "function")
+                lines.append(f"{role}: 调用工具 {_field(function, 'name')}({_field(function, 'arguments')})")
+        return [
+            {"role": "system", "content": SUMMARY_PROMPT},
+            {"role": "user", "content": "\n".join(lines)},
+        ]
+
+    def _summary_message(self, summary):
+        return {"role": "system", "content": f"以下是之前对话的摘要：\n{summary}"}
+
+    def _summary_tokens(self, summary):
+        return MESSAGE_TOKEN_OVERHEAD + self.counter.count_text(self._summary_message(summary)["content"])
+
+    def _assemble(self, head, summary, tail):
+        "摘要消息同样计入预算，超出剩余的预算时截断摘要，完全没有余量时不加摘要"
+        available = self.budget - self.counter.count(head) - self.counter.count(tail)
+        if self._summary_tokens(summary) > available:
+            low, high = 0, len(summary)
+            while low < high:
+                middle = (low + high + 1) // 2
+                if self._summary_tokens(summary[:middle] + "…") <= available:
+                    low = middle
+                else:
+                    high = middle - 1
+            if low == 0:
+                logging.warning(f"no budget left for the summary, {available} tokens available")
+                return head + tail
+            summary = summary[:low] + "…"
+        return head + [self._summary_message(summary)] + tail
+
+    def _cached_summary(self, dropped):
+        key = tuple(id(m) for m in dropped)
+        with self._summary_lock:
+            item = self._summaries.get(key)
+            if item is None:
+                return None
+            self._summaries.move_to_end(key)
+        return item[0]
+
+    def _longest_summary(self, dropped):
+        """
+        找到已经总结过的最长前缀，新的摘要在它的基础上增量生成。
+        Returns:
+            tuple: (摘要, 前缀长度)，没有时为(None, 0)。
+        """
+        best = None
+        best_len = 0
+        ids = tuple(id(m) for m in dropped)
+        with self._summary_lock:
+            items = list(self._summaries.items())
+        for key, (summary, _) in items:
+            if best_len < len(key) <= len(ids) and ids[:len(key)] == key:
+                best, best_len = summary, len(key)
+        return best, best_len
+
+    def _store_summary(self, dropped, summary):
+        # 同时保存消息对象本身，保证作为key的id在缓存有效期内不会被复用
+        key = tuple(id(m) for m in dropped)
+        with self._summary_lock:
+            self._summaries[key] = (summary, list(dropped))
+            while len(self._summaries) > SUMMARY_CACHE_SIZE:
+                self._summaries.popitem(last=False)
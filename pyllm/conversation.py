@@ -0,0 +1,91 @@
+from collections.abc import Sequence
+from itertools import islice
+
+
+class MessageView(Sequence):
+    """
+    共享消息列表的只读前缀加上本轮的草稿消息。
+    创建时只记录共享列表当前的长度，不复制；append只进入草稿，不会修改共享的历史。
+    """
+
+    def __init__(self, base):
+        self._base = base
+        self._base_len = len(base)
+        self.scratch = []
+
+    def append(self, message):
+        self.scratch.append(message)
+
+    def extend(self, messages):
+        self.scratch.extend(messages)
+
+    def __len__(self):
+        return self._base_len + len(self.scratch)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError("message index out of range")
+        if index < self._base_len:
+            return self._base[index]
+        return self.scratch[index - self._base_len]
+
+    def __iter__(self):
+        yield from islice(self._base, self._base_len)
+        yield from self.scratch
+
+    def __repr__(self):
+        return f"MessageView({list(self)!r})"
+
+
+class Conversation(Sequence):
+    """
+    只追加的对话记录。
+    同时维护一份不含tool条目的索引，without_tool()直接返回它的视图，不需要每轮对话重新过滤整个历史。
+
+    Args:
+        messages (list, optional): 初始消息。
+        on_append (callable, optional): 每追加一条消息调用on_append(message, 序号)，用于持久化。
+    """
+
+    def __init__(self, messages=None, on_append=None):
+        self._log = []
+        self._without_tool = []
+        self.on_append = None
+        for message in messages or []:
+            self.append(message)
+        self.on_append = on_append
+
+    def append(self, message):
+        self._log.append(message)
+        if message["role"] != "tool":
+            self._without_tool.append(message)
+        if self.on_append is not None:
+            self.on_append(message, len(self._log) - 1)
+
+    def extend(self, messages):
+        for message in messages:
+            self.append(message)
+
+    def without_tool(self):
+        "返回不含tool条目的消息视图，在视图上append不会影响对话记录"
+        return MessageView(self._without_tool)
+
+    def view(self):
+        "返回完整对话记录的视图，在视图上append不会影响对话记录"
+        return MessageView(self._log)
+
+    def __len__(self):
+        return len(self._log)
+
+    def __getitem__(self, index):
+        return self._log[index]
+
+    def __iter__(self):
+        return iter(self._log)
+
+    def __repr__(self):
+        return f"Conversation({self._log!r})"
@@ -0,0 +1,240 @@
+import sys
+import time
+from pyllm.utils import COLOR_CODES
+
+STYLE_MUTE = "mute"
+CONSOLE_FLUSH_SIZE = 1024
+CONSOLE_FLUSH_INTERVAL = 0.05
+CONSOLE_ARGUMENTS_LEN = 100
+STOP_MESSAGES = {
+    "max_loop": "超过最大迭代轮次",
+    "deadline": "超过时限",
+    "iterations": "迭代预算已用完",
+}
+
+
+class Event:
+    "using_tool/function_call过程中产生的事件，type区分事件类型"
+
+    __slots__ = ()
+    type = None
+
+    def to_dict(self):
+        data = {"type": self.type}
+        for name in self.__slots__:
+            data[name] = getattr(self, name)
+        return data
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{self.__class__.__name__}({fields})"
+
+
+class IterationStart(Event):
+    "开始第iteration轮迭代"
+
+    __slots__ = ("iteration",)
+    type = "iteration_start"
+
+    def __init__(self, iteration):
+        self.iteration = iteration
+
+
+class TextDelta(Event):
+    "模型回答的一段文本，非流式调用时是完整的回答"
+
+    __slots__ = ("text",)
+    type = "text_delta"
+
+    def __init__(self, text):
+        self.text = text
+
+
+class ToolCallStart(Event):
+    "模型申请调用工具，参数随后由ToolArgumentsDelta给出"
+
+    __slots__ = ("index", "id", "name")
+    type = "tool_call_start"
+
+    def __init__(self, index, id, name):
+        self.index = index
+        self.id = id
+        self.name = name
+
+
+class ToolArgumentsDelta(Event):
+    "第index个工具调用的一段参数，非流式调用时是完整的参数"
+
+    __slots__ = ("index", "delta")
+    type = "tool_arguments_delta"
+
+    def __init__(self, index, delta):
+        self.index = index
+        self.delta = delta
+
+
+class ResponseDone(Event):
+    "一次模型响应结束"
+
+    __slots__ = ("answer", "tool_calls")
+    type = "response_done"
+
+    def __init__(self, answer, tool_calls):
+        self.answer = answer
+        self.tool_calls = tool_calls
+
+
+class ToolResult(Event):
+    "工具执行完成，按tool_calls的原始顺序产生"
+
+    __slots__ = ("id", "name", "call", "result", "error")
+    type = "tool_result"
+
+    def __init__(self, id, name, call, result, error=False):
+        self.id = id
+        self.name = name
+        self.call = call
+        self.result = result
+        self.error = error
+
+
+class MaxLoopExceeded(Event):
+    "没有完成就停止了迭代，answer为当前的进展；reason为\"max_loop\"（超过maxloop）、\"deadline\"（超时）或\"iterations\"（迭代预算用完）"
+
+    __slots__ = ("answer", "reason")
+    type = "max_loop_exceeded"
+
+    def __init__(self, answer, reason="max_loop"):
+        self.answer = answer
+        self.reason = reason
+
+
+class Done(Event):
+    "using_tool结束"
+
+    __slots__ = ("answer", "history")
+    type = "done"
+
+    def __init__(self, answer, history):
+        self.answer = answer
+        self.history = history
+
+
+class ConsoleSink:
+    """
+    把事件渲染成终端输出（原来printc的格式）。
+    输出先写入缓冲区，在迭代开始、响应结束、缓冲区超过CONSOLE_FLUSH_SIZE个字符
+    或距上次输出超过CONSOLE_FLUSH_INTERVAL秒时才写到终端，不会每个chunk都调用一次print；
+    连续同色的文本也只输出一次颜色控制码。
+
+    Args:
+        style (str, optional): "colorful"带颜色，"plain"不带颜色。
+        stream (file, optional): 输出目标，默认sys.stdout。
+    """
+
+    def __init__(self, style="colorful", stream=None):
+        self.style = style
+        self.stream = stream
+        self._buffer = []
+        self._size = 0
+        self._last_flush = time.monotonic()
+        self._line_open = False
+        self._color = None
+        self._arguments_left = CONSOLE_ARGUMENTS_LEN
+
+    def __call__(self, event):
+        handler = getattr(self, "_on_" + event.type, None)
+        if handler is not None:
+            handler(event)
+
+    def _write(self, text, color="white"):
+        if self.style == "colorful" and color != self._color:
+            self._reset_color()
+            self._buffer.append(COLOR_CODES[color])
+            self._color = color
+        self._buffer.append(text)
+        self._size += len(text)
+        self._line_open = True
+        if self._size >= CONSOLE_FLUSH_SIZE or time.monotonic() - self._last_flush >= CONSOLE_FLUSH_INTERVAL:
+            self.flush()
+
+    def _reset_color(self):
+        if self._color is not None:
+            self._buffer.append(COLOR_CODES["reset"])
+            self._color = None
+
+    def _end_line(self):
+        if self._line_open:
+            self._reset_color()
+            self._buffer.append("\n")
+            self._line_open = False
+
+    def flush(self):
+        self._reset_color()
+        if self._buffer:
+            stream = self.stream or sys.stdout
+            stream.write("".join(self._buffer))
+            stream.flush()
+            self._buffer = []
+            self._size = 0
+        self._last_flush = time.monotonic()
+
+    def _on_iteration_start(self, event):
+        self._end_line()
+        self._write(f"## 开始第{event.iteration}轮迭代...", "yellow")
+        self._end_line()
+        self.flush()
+
+    def _on_text_delta(self, event):
+        self._write(event.text, "green")
+
+    def _on_tool_call_start(self, event):
+        self._end_line()
+        self._write(f"模型申请运行: {event.name}")
+
+    def _on_tool_arguments_delta(self, event):
+        if self._arguments_left <= 0 or not event.delta:
+            return
+        delta = event.delta[:self._arguments_left]
+        self._arguments_left -= len(delta)
+        self._write(delta.replace("{", "(").replace("}", ")"))
+        if self._arguments_left <= 0:
+            self._write("...")
+
+    def _on_response_done(self, event):
+        self._end_line()
+        self._arguments_left = CONSOLE_ARGUMENTS_LEN
+        self.flush()
+
+    def _on_max_loop_exceeded(self, event):
+        self._end_line()
+        self._write(f"{STOP_MESSAGES.get(event.reason, event.reason)}，尚未完成，当前的进展", "red")
+        self._end_line()
+        self._write(str(event.answer), "green")
+        self._end_line()
+        self.flush()
+
+    def _on_done(self, event):
+        self._end_line()
+        self.flush()
+
+
+def make_emitter(style="colorful", on_event=None):
+    """
+    根据style和回调生成事件处理函数。
+    Args:
+        style (str, optional): 不是"mute"时把事件输出到终端。
+        on_event (callable, optional): 事件回调on_event(event)。
+    Returns:
+        callable: 事件处理函数；既不输出也没有回调时返回None，调用方据此跳过构造事件。
+    """
+    console = ConsoleSink(style) if style != STYLE_MUTE else None
+    if console is None:
+        return on_event
+    if on_event is None:
+        return console
+
+    def emit(event):
+        on_event(event)
+        console(event)
+    return emit
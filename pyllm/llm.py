@@ -1,27 +1,153 @@
 import os
 import logging
-from openai import OpenAI
-from pyllm.utils import pretty, truncate_string,printc
+from pyllm.utils import pretty, truncate_string
+from pyllm.events import make_emitter, STYLE_MUTE, IterationStart, TextDelta, ToolCallStart, ToolArgumentsDelta, ResponseDone, ToolResult, MaxLoopExceeded, Done
 import copy
 import json
+import contextvars
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pyllm.conversation import MessageView
+from pyllm.session import MemorySessionStore
+from pyllm.blob import BlobStore, BLOB_PAGE_SIZE
+from pyllm.cache import CompletionCache, LRUCache, MISS
+from pyllm.client import get_client
+from pyllm.schema import ToolArgumentError
+from pyllm.tools import ToolRegistry, TOOL_CACHE_SIZE, TOOL_CACHE_NONE, TOOL_CACHE_CONVERSATION, TOOL_CACHE_GLOBAL
+from pyllm.metrics import as_observer, start_span, current_attr
+from pyllm.scope import request_scope, current_scope, remaining_time, DeadlineExceeded, STOP_DEADLINE, STOP_MAX_LOOP
+from pyllm.batch import RateLimiter, run_batch, BATCH_CONCURRENCY, BATCH_MAX_RETRIES
 
 FUNCTION_CALL_MAX_LOOP = 20
+TOOL_MAX_CONCURRENCY = 8
+CACHE_REPLAY_CHUNK_SIZE = 16
+TOOL_ERROR_PREFIX = "Function call error"
+READ_RESULT_TOOL = "read_tool_result"
+SPILL_PREVIEW_SIZE = 500
 
 class OpenAIInitializationError(Exception):
     pass
 
+class ToolDispatcher:
+    """
+    把同一轮的工具调用提交到线程池执行，并按tool_calls的原始顺序收集结果。
+    流式模式下可以在某个工具调用的参数刚刚完整时就提交，与后续的生成过程重叠。
+    """
+
+    def __init__(self, llm, memo=None):
+        self.llm = llm
+        self.memo = memo
+        self.executor = ThreadPoolExecutor(max_workers=max(llm.tool_concurrency, 1))
+        self.futures = {}
+
+    def submit(self, position, tool_call):
+        if position in self.futures or not self.llm._is_parallel_tool(tool_call):
+            return
+        logging.debug(f"dispatch tool call {position}: {tool_call['function']['name']}")
+        # 复制contextvars，让工具（包括子智能体）里的span挂在当前span下面
+        self.futures[position] = self.executor.submit(contextvars.copy_context().run, self.llm._run_tool, tool_call, self.memo)
+
+    def results(self, tool_calls):
+        results = []
+        for position, tool_call in enumerate(tool_calls):
+            if position in self.futures:
+                results.append(self.futures[position].result())
+            else:
+                # 不可并行的工具，或尚未提交的调用，在当前线程依次执行
+                results.append(self.llm._run_tool(tool_call, self.memo))
+        return results
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
 class LLM:
-    def __init__(self, model=None, ak=None, url=None, system = ""):
+    def __init__(self, model=None, ak=None, url=None, system = "", tool_concurrency=TOOL_MAX_CONCURRENCY, cache=None, client=None, context_manager=None, session_store=None, observer=None,
+                 spill_threshold=None, blob_store=None, pool=None, semantic_cache=None, tools=None, transport=None):
+        """
+        Args:
+            cache (CompletionCache|bool, optional): 模型响应缓存，传True使用默认配置的内存缓存。
+            client (OpenAI, optional): 注入已有的客户端，为None时从进程级注册表获取按(url, ak)共享的客户端。
+            context_manager (ContextManager, optional): using_tool每轮请求前按token预算裁剪上下文。
+            session_store (SessionStore, optional): chat_with_context的会话存储，默认为不限容量的内存存储。
+            observer (Observer|callable, optional): 接收模型请求、迭代和工具调用的计时span，见pyllm.metrics。
+            spill_threshold (int, optional): 工具结果超过这个字符数时存入blob_store，对话中只保留摘要和句柄，
+                并自动注册read_tool_result工具供模型分页读取。为None时不启用。
+            blob_store (BlobStore, optional): 保存大结果的存储，默认使用临时目录。
+            pool (EndpointPool, optional): 多地址连接池，设置后忽略ak、url和client，每个请求由连接池选择地址。
+            semantic_cache (SemanticCache, optional): 语义缓存，单轮问题与缓存的问题足够相近时直接返回保存的回答，
+                见pyllm.semantic_cache。use_cache=False时同样跳过。
+            tools (ToolRegistry, optional): 预先构建的工具注册表，可以在多个LLM之间共用，见pyllm.tools。
+            transport (Recorder|Replayer, optional): 所有模型请求经过的传输层，Recorder记录请求和响应，
+                Replayer离线回放记录的响应，见pyllm.replay。needs_client为False的transport不会创建客户端。
+        """
+        self.pool = pool
+        if model is None and pool is not None:
+            model = pool.endpoints[0].model
         if model is None:
             self.default_model = "gpt-4o"   # 修改为 self.default_model
         else:
             self.default_model = model     # 确保 model 被赋值给 self.default_model
-        self.init_openai(ak, url)
+        # 客户端在第一次请求时才创建，只构造LLM（例如批量创建智能体）不会导入openai
+        self._openai = client
+        self._no_retry_client = None
+        self._client_args = None
+        if pool is None and client is None:
+            self._client_args = self._resolve_endpoint(ak, url)
         self.system = system
-        self.context = {}
-        self.tools = {}
+        self.context = session_store if session_store is not None else MemorySessionStore()
+        self.context.on_evict(self._drop_session_state)
+        self.tools = tools if tools is not None else ToolRegistry()
+        self._shared_tools = tools is not None
+        self.tool_concurrency = tool_concurrency
+        self.cache = CompletionCache() if cache is True else (cache or None)
+        self.semantic_cache = semantic_cache
+        self.transport = transport
+        self.tool_memos = {}
+        self.context_manager = context_manager
+        self.observer = as_observer(observer)
+        self.spill_threshold = None
+        self.blob_store = None
+        if spill_threshold is not None:
+            self.enable_spill(spill_threshold, blob_store)
+
+    def enable_spill(self, threshold, blob_store=None):
+        """
+        超过threshold个字符的工具结果不再直接放入对话，见__init__的spill_threshold。
+        """
+        self.spill_threshold = threshold
+        self.blob_store = blob_store or BlobStore(page_size=min(BLOB_PAGE_SIZE, threshold))
+        if self._shared_tools:
+            # read_tool_result绑定在这个LLM的blob_store上，不能写进共用的注册表覆盖其他LLM的
+            self.tools = self.tools.copy()
+            self._shared_tools = False
+        self.register_tool(self._read_tool_result,
+                           name=READ_RESULT_TOOL,
+                           tool_desc="分页读取之前保存的较大的工具结果",
+                           para_desc={
+                               "type": "object",
+                               "properties": {
+                                   "handle": {"type": "string", "description": "工具结果中给出的句柄，形如blob:xxxx"},
+                                   "page": {"type": "integer", "description": "页码，从1开始"},
+                                   "offset": {"type": "integer", "description": "按字节读取时的起始位置，指定后忽略page"},
+                                   "length": {"type": "integer", "description": "按字节读取的长度，最多一页"},
+                               },
+                               "required": ["handle"],
+                           })
     
     def init_openai(self, ak=None, url=None):
+        api_key, api_url = self._resolve_endpoint(ak, url)
+        self._client_args = (api_key, api_url)
+        self._openai = None
+        return self.openai
+
+    def _resolve_endpoint(self, ak, url):
         if ak is None:
             api_key = os.environ.get("OPENAI_API_KEY", None)
             if api_key is None:
@@ -34,15 +160,69 @@ class LLM:
         else:
             api_url = url
         logging.debug(f"api_key: {api_key}, api_url: {api_url}")
-        try:
-            self.openai = OpenAI(
-                api_key=api_key,
-                base_url=api_url,
-            )
-        except Exception as e:
-            logging.error(f"初始化openai失败，{e}")
-            raise OpenAIInitializationError(f"OpenAI initialization failed: {e}")
-        return self.openai
+        return api_key, api_url
+
+    @property
+    def openai(self):
+        "OpenAI客户端，第一次使用时才创建；设置了pool时为None"
+        if self._openai is None and self._client_args is not None:
+            api_key, api_url = self._client_args
+            try:
+                self._openai = self._new_client(api_key=api_key, base_url=api_url)
+            except Exception as e:
+                logging.error(f"初始化openai失败，{e}")
+                raise OpenAIInitializationError(f"OpenAI initialization failed: {e}")
+        return self._openai
+
+    @openai.setter
+    def openai(self, client):
+        self._openai = client
+
+    def _new_client(self, api_key, base_url):
+        return get_client(api_key, base_url)
+
+    def _create_completion(self, **kwargs):
+        "所有模型请求的统一入口，设置了transport时由它记录或回放"
+        self._prepare_client()
+        self._apply_deadline(kwargs)
+        if self.transport is not None:
+            return self.transport.complete(self._send_completion, kwargs)
+        return self._send_completion(**kwargs)
+
+    def _send_completion(self, **kwargs):
+        "发送模型请求，设置了pool时由连接池选择地址，地址配置了model时替换请求中的模型名"
+        if self.pool is None:
+            return self._request_client().chat.completions.create(**kwargs)
+        return self.pool.call(lambda client, endpoint: client.chat.completions.create(**dict(kwargs, model=endpoint.model or kwargs["model"])))
+
+    @staticmethod
+    def _apply_deadline(kwargs):
+        "单次模型请求的超时不超过当前请求作用域的剩余时间，已经没有剩余时间时不再发送"
+        remaining = remaining_time()
+        if remaining is None:
+            return
+        if remaining <= 0:
+            raise DeadlineExceeded("request deadline exceeded before sending")
+        kwargs["timeout"] = min(kwargs.get("timeout", remaining), remaining)
+
+    def _prepare_client(self):
+        "第一次请求前创建客户端（导入openai），不计入请求的超时；回放请求不需要客户端"
+        if self.pool is None and (self.transport is None or self.transport.needs_client):
+            self.openai
+
+    def _request_client(self):
+        """
+        有截止时间的请求使用不自动重试的客户端：openai默认超时后重试两次，会让请求超出截止时间。
+        批量请求由run_batch重试，也不使用客户端的重试。连接池的地址本来就不重试。
+        """
+        client = self.openai
+        scope = current_scope()
+        if scope is None or (scope.deadline is None and scope.client_retries):
+            return client
+        cached = self._no_retry_client
+        if cached is None or cached[0] is not client:
+            cached = self._no_retry_client = (client, client.with_options(max_retries=0))
+        return cached[1]
 
     def chat_with_context(self, question, ctx="default", model=None):
         if model is None:
@@ -60,43 +240,101 @@ class LLM:
             "content": answer})
         return answer
     
-    def ask(self, prompt, model=None):
+    def ask(self, prompt, model=None, use_cache=True):
         msg = [{"role": "user", "content": prompt}]
-        return self.chat(msg, model=model)
+        return self.chat(msg, model=model, use_cache=use_cache)
     
-    def chat(self, messages, model=None):
+    def chat(self, messages, model=None, use_cache=True):
         """
         向指定的模型发送问题并返回答案。
         Args:
             messages (dict): 待询问的问题，模型上下文。
             model (str, optional): 模型名称，默认为None。如果未指定，则使用默认模型。
+            use_cache (bool, optional): 是否使用响应缓存，仅在设置了cache时有效。
         Returns:
             str: 模型的回答。
         """
         if model is None:
             model = self.default_model
-        response = self.openai.chat.completions.create(
-            model=model, messages=messages)
-        logging.debug(f"reponse content {str(response)}")
-        answer = response.choices[0].message.content
-        logging.debug(f"answer by {model}, {answer}")
-        return answer
+        with self._span("llm.call", model=model, stream=False) as span:
+            cache_key = None
+            if self.cache is not None and use_cache:
+                cache_key = self.cache.make_key(model, messages)
+                cached = self.cache.get(cache_key)
+                if cached is not None:
+                    span.set(cached=True)
+                    return cached
+            semantic_query, cached = self._semantic_lookup(model, messages, use_cache=use_cache)
+            if cached is not None:
+                span.set(cached=True, semantic=True)
+                return cached
+            response = self._create_completion(
+                model=model, messages=messages)
+            self._record_usage(span, response)
+            logging.debug(f"reponse content {str(response)}")
+            answer = response.choices[0].message.content
+            logging.debug(f"answer by {model}, {answer}")
+            if cache_key is not None and answer is not None:
+                self.cache.set(cache_key, answer)
+            if semantic_query is not None and answer is not None:
+                self.semantic_cache.add(*semantic_query, answer)
+            return answer
 
-    def register_tool(self, function, name=None, tool_desc=None, para_desc={}):
-        if name is None:
-            name = function.__name__
-        if tool_desc is None:
-            tool_desc = function.__doc__
-            
-        self.tools[name] = {
-            "name": name,
-            "function": function,
-            "tool_desc": tool_desc,
-            "para_desc": para_desc
-        }
-    
-            
-    def using_tool(self, question=None, messages=None, model=None, maxloop=FUNCTION_CALL_MAX_LOOP, stream=False, style = "colorful"):
+    def batch_chat(self, messages_list, model=None, **options):
+        """
+        批量发送多组对话，每组是一个消息列表，参数见_run_batch。
+        """
+        return self._run_batch(messages_list, lambda messages: messages, model=model, **options)
+
+    def batch_ask(self, prompts, model=None, **options):
+        """
+        批量提问，每条是一个prompt，参数见_run_batch。
+        """
+        return self._run_batch(prompts, lambda prompt: [{"role": "user", "content": prompt}], model=model, **options)
+
+    def _run_batch(self, items, to_messages, model=None, concurrency=BATCH_CONCURRENCY, rpm=None, tpm=None,
+                   max_retries=BATCH_MAX_RETRIES, ordered=False, progress=None, use_cache=True):
+        """
+        批量请求，受并发数和rpm/tpm限流约束，429和5xx错误按指数退避重试。
+        Args:
+            items (iterable): 输入的可迭代对象，按需读取。
+            concurrency (int, optional): 同时进行的请求数。
+            rpm (int, optional): 每分钟请求数上限。
+            tpm (int, optional): 每分钟token数上限（按字符数粗略估计）。
+            max_retries (int, optional): 单条的最大重试次数。
+            ordered (bool, optional): True按输入顺序返回，False按完成顺序返回。
+            progress (callable, optional): 每完成一条调用progress(已完成数, BatchResult)。
+        Returns:
+            generator: 逐条产出BatchResult，出错的条目记录在error中，不会中断整个批次。
+        """
+        rate_limiter = RateLimiter(rpm=rpm, tpm=tpm) if rpm or tpm else None
+
+        def call(messages):
+            # 重试只在run_batch中进行，客户端再重试会让请求数和退避时间成倍增加
+            with request_scope(client_retries=False):
+                return self.chat(messages, model=model, use_cache=use_cache)
+        return run_batch(call, items, to_messages,
+                         concurrency=concurrency, rate_limiter=rate_limiter, max_retries=max_retries,
+                         ordered=ordered, progress=progress)
+
+    def register_tool(self, function, name=None, tool_desc=None, para_desc={}, parallel=True,
+                      cache_policy=TOOL_CACHE_NONE, cache_size=TOOL_CACHE_SIZE, cache_ttl=None):
+        """
+        注册工具。
+        Args:
+            para_desc (dict, optional): 参数的JSON schema，为空时根据函数签名、类型标注和docstring的Args段落生成。
+                函数有para_desc属性时使用它，例如run_command只让模型给出cmd。
+                调用工具前按它检查参数，数字字符串等可以安全转换的参数在本地修正，不合法时把具体的错误返回给模型。
+            parallel (bool, optional): 同一轮中是否允许与其他工具并发执行，非线程安全的工具请设为False。
+            cache_policy (str, optional): 结果缓存策略，只适用于相同参数总是返回相同结果的工具。
+                None不缓存；"conversation"在同一个会话（ctx）内缓存；"global"在所有会话间共享。
+            cache_size (int, optional): 每个缓存表最多保存的结果数。
+            cache_ttl (float, optional): 缓存结果的过期时间（秒），为None时永不过期。
+        """
+        self.tools.register(function, name=name, tool_desc=tool_desc, para_desc=para_desc, parallel=parallel,
+                            cache_policy=cache_policy, cache_size=cache_size, cache_ttl=cache_ttl)
+
+    def using_tool(self, question=None, messages=None, model=None, maxloop=FUNCTION_CALL_MAX_LOOP, stream=False, style = "colorful", early_dispatch=False, use_cache=True, ctx=None, on_event=None, timeout=None, max_iterations=None):
         """
         调用外部工具。
         
@@ -104,6 +342,14 @@ class LLM:
             question (str): 待询问的问题。
             messages (list, optional): 消息列表，默认为None。如果未指定则按question提问。
             model (str, optional): 模型名称，默认为None。如果未指定，则使用默认模型。
+            early_dispatch (bool, optional): 仅流式模式有效，工具调用参数一完整就开始执行，不等整个响应结束。
+            use_cache (bool, optional): 是否使用响应缓存，仅在设置了cache时有效。
+            ctx (str, optional): 会话标识，cache_policy为"conversation"的工具在同一ctx的多次调用间共享结果缓存。
+            style (str, optional): 终端输出方式，"colorful"、"plain"或"mute"（不输出）。
+            on_event (callable, optional): 事件回调on_event(event)，事件类型见pyllm.events。
+            timeout (float, optional): 时限（秒），与外层请求（例如调用这个智能体的父智能体）的截止时间取较早的一个。
+            max_iterations (int, optional): 迭代轮数预算，子智能体的迭代也计入。
+            时间或预算用完时不再开始新的一轮，返回目前最好的部分回答。
             
         Returns:
             tuple: 模型的回答和函数调用历史。
@@ -115,27 +361,94 @@ class LLM:
         messages = self._prepare_messages(question, messages)
         tools = self._prepare_tools()
         
+        memo = self._conversation_memo(ctx)
+        emit = make_emitter(style, on_event)
         function_call_loop = 0
         function_call_history = []
+        answer = partial = None
+        stop = None
         
-        while function_call_loop < maxloop:
-            function_call_loop += 1
-            printc(f"## 开始第{function_call_loop}轮迭代...", "yellow", style=style)
-            
-            answer, tool_calls, response_message = self.function_call(model, messages, tools, stream=stream, style=style)
-            messages.append(response_message)
-            
-            # 如果模型响应没有tool_calls，则说明循环结束，返回结果。
-            if not tool_calls:
-                return answer, function_call_history
-            
-            for tool_call in tool_calls:
-                self._handle_tool_call(tool_call, function_call_history, messages)
+        # 截止时间从客户端创建好之后开始计算，第一次调用时导入openai的耗时不占用timeout
+        self._prepare_client()
+        with request_scope(ctx=ctx, style=style, timeout=timeout, max_iterations=max_iterations) as scope, \
+                self._span("llm.using_tool", model=model, ctx=ctx) as span:
+            semantic_query, cached = self._semantic_lookup(model, messages, tools, use_cache=use_cache)
+            if cached is not None:
+                span.set(cached=True, semantic=True)
+                return self._replay_semantic(cached, emit)
+            while function_call_loop < maxloop:
+                stop = scope.stop_reason()
+                if stop is not None:
+                    break
+                scope.consume_iteration()
+                function_call_loop += 1
+                if emit is not None:
+                    emit(IterationStart(function_call_loop))
+                
+                with self._span("llm.iteration", model=model, iteration=function_call_loop):
+                    dispatcher = ToolDispatcher(self, memo) if stream and early_dispatch else None
+                    try:
+                        request_messages = self.context_manager.fit(messages) if self.context_manager is not None else messages
+                        # emit已经包含了终端输出，function_call不再单独输出
+                        answer, tool_calls, response_message = self.function_call(model, request_messages, tools, stream=stream, style=STYLE_MUTE, use_cache=use_cache,
+                                                                                  on_tool_call=dispatcher.submit if dispatcher else None, on_event=emit)
+                    except BaseException as e:
+                        if dispatcher:
+                            dispatcher.close()
+                        # 请求因为截止时间被中断，返回已有的部分回答
+                        if isinstance(e, Exception) and scope.expired():
+                            logging.warning(f"request deadline exceeded: {e}")
+                            stop = STOP_DEADLINE
+                            break
+                        raise
+                    messages.append(response_message)
+                    partial = answer or partial
+                    
+                    # 如果模型响应没有tool_calls，则说明循环结束，返回结果。
+                    if not tool_calls:
+                        if dispatcher:
+                            dispatcher.close()
+                        if semantic_query is not None and answer is not None:
+                            self.semantic_cache.add(*semantic_query, [answer, function_call_history])
+                        if emit is not None:
+                            emit(Done(answer, function_call_history))
+                        return answer, function_call_history
+                    
+                    self._handle_tool_calls(tool_calls, function_call_history, messages, dispatcher=dispatcher, memo=memo, emit=emit)
         
-        printc("超过最大迭代轮次，尚未完成，当前的进展","red", style=style)
-        printc(answer, "green", style=style)
-        logging.info(f"Exceed max loop, answer: {answer}, function_call_history: {function_call_history}")
-        return answer, function_call_history
+        stop = stop or STOP_MAX_LOOP
+        if emit is not None:
+            emit(MaxLoopExceeded(partial, stop))
+            emit(Done(partial, function_call_history))
+        logging.info(f"Stop before finish ({stop}), answer: {partial}, function_call_history: {function_call_history}")
+        return partial, function_call_history
+
+    def iter_events(self, question=None, messages=None, **kwargs):
+        """
+        逐个返回using_tool产生的事件，最后一个事件是Done（包含回答和函数调用历史）。
+        using_tool在后台线程中运行，不输出到终端；出错时异常在迭代处抛出。
+
+        Args:
+            question, messages, kwargs: 同using_tool。
+        Yields:
+            Event: 事件类型见pyllm.events。
+        """
+        events = queue.Queue()
+
+        def run():
+            try:
+                self.using_tool(question, messages, style=STYLE_MUTE, on_event=events.put, **kwargs)
+            except BaseException as e:
+                events.put(e)
+
+        threading.Thread(target=contextvars.copy_context().run, args=(run,), daemon=True).start()
+        while True:
+            event = events.get()
+            if isinstance(event, BaseException):
+                raise event
+            yield event
+            if isinstance(event, Done):
+                return
 
     def _prepare_messages(self, question, messages):
         if messages is None or not messages:
@@ -144,37 +457,54 @@ class LLM:
                 return None
             messages = [{"role": "user", "content": question}]
         else:
-            messages = copy.deepcopy(messages)
+            # 本轮新增的消息只追加到视图的草稿里，不复制也不修改调用方的历史
+            messages = MessageView(messages)
         return messages
 
     def _prepare_tools(self):
-        tools = []
-        for tool_name, tool_info in self.tools.items():
-            tools.append({
-                "type": "function",
-                "function": {
-                    "name": tool_info['name'],
-                    "description": tool_info["tool_desc"],
-                    "parameters": tool_info["para_desc"],
-                }
-            })
-        return tools
-
-    def function_call(self, model, messages, tools, stream=False, style="colorful"):
+        "工具定义由注册表缓存，返回的列表请不要修改"
+        return self.tools.schema()
+
+    def function_call(self, model, messages, tools, stream=False, style="colorful", on_tool_call=None, use_cache=True, on_event=None):
+        """
+        请求一轮模型响应。
+        Args:
+            on_tool_call (callable, optional): 流式模式下，每个工具调用的参数完整后立即以(序号, tool_call)回调，
+                判断依据是出现了下一个工具调用，或者参数已经是完整的JSON。
+            on_event (callable, optional): 事件回调，见using_tool。
+        Returns:
+            tuple: (回答, tool_calls, 响应消息)
+        """
+        emit = make_emitter(style, on_event)
+        with self._span("llm.call", model=model, stream=stream, iteration=current_attr("iteration")) as span:
+            return self._function_call(span, model, messages, tools, stream=stream, emit=emit,
+                                       on_tool_call=on_tool_call, use_cache=use_cache)
+
+    def _function_call(self, span, model, messages, tools, stream=False, emit=None, on_tool_call=None, use_cache=True):
+        cache_key = None
+        if self.cache is not None and use_cache:
+            cache_key = self.cache.make_key(model, messages, tools)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                span.set(cached=True)
+                return self._replay_cached(cached, stream, emit, on_tool_call)
         if not stream:
-            response = self.openai.chat.completions.create(
+            response = self._create_completion(
                 model=model,
                 messages=messages,
                 tools=tools,
             )
+            self._record_usage(span, response)
             response_message = response.choices[0].message
             answer = response_message.content
-            if answer:
-                printc(answer, "green", style=style)
+            if answer and emit is not None:
+                emit(TextDelta(answer))
             tool_calls = []
             if response_message.tool_calls:
-                for tool in response_message.tool_calls:
-                    printc(f'模型申请运行：{tool.function.name}{truncate_string(tool.function.arguments.replace("{", "(").replace("}", ")"), 100)}', style=style)
+                for position, tool in enumerate(response_message.tool_calls):
+                    if emit is not None:
+                        emit(ToolCallStart(position, tool.id, tool.function.name))
+                        emit(ToolArgumentsDelta(position, tool.function.arguments))
                     tool_calls.append({
                         "id": tool.id,
                         "function": {
@@ -182,27 +512,43 @@ class LLM:
                             "arguments": tool.function.arguments,
                         }
                     })
-            response_message_dump = response_message.model_dump()
-            logging.info(f"tool choice:{pretty(response_message_dump)}")
+            if emit is not None:
+                emit(ResponseDone(answer, tool_calls))
+            if logging.getLogger().isEnabledFor(logging.INFO):
+                logging.info(f"tool choice:{pretty(response_message.model_dump())}")
+            if cache_key is not None:
+                self._store_cached(cache_key, answer, tool_calls)
             return answer, tool_calls, response_message
         else: 
             # 流式调用和打印输出
-            stream = self.openai.chat.completions.create(
+            stream = self._create_completion(
                 model=model,
                 messages=messages,
                 tools=tools,
-                stream=True
+                stream=True,
+                **self._stream_options()
             )
             tool2call = {}
+            dispatched = set()
             answer = ""
-            truncate_len = 100
-            first = True
+
+            def dispatch(index):
+                if on_tool_call is None or index in dispatched:
+                    return
+                dispatched.add(index)
+                on_tool_call(list(tool2call).index(index), self._stream_tool_call(tool2call[index]))
+
             for chunk in stream:
+                if not chunk.choices:
+                    # include_usage时最后一个chunk只有usage
+                    self._record_usage(span, chunk)
+                    continue
+                span.mark_first_token()
                 chunk_message = chunk.choices[0].delta.content
                 if chunk_message is not None:
                     answer += chunk_message
-                    printc(chunk_message, "green", end="", style=style)
-                    first = False
+                    if emit is not None:
+                        emit(TextDelta(chunk_message))
                 delta_tool_calls = chunk.choices[0].delta.tool_calls
                 if delta_tool_calls is not None:
                     for i in delta_tool_calls:
@@ -211,34 +557,23 @@ class LLM:
                         function_name = i.function.name
                         function_params = i.function.arguments
                         if index not in tool2call:
-                            tool2call[index] = ({"id": function_id, "name": function_name, "params": function_params})
-                            if not first:
-                                printc(style=style) 
-                            printc(f'模型申请运行: {tool2call[index]["name"]}', end="", style=style)
-                            first = False
+                            # 出现了新的工具调用，之前的工具调用参数已经完整
+                            for prev in tool2call:
+                                dispatch(prev)
+                            tool2call[index] = ({"id": function_id, "name": function_name, "params": function_params or ""})
+                            if emit is not None:
+                                emit(ToolCallStart(len(tool2call) - 1, function_id, function_name))
+                                if function_params:
+                                    emit(ToolArgumentsDelta(len(tool2call) - 1, function_params))
                         else:
                             tool2call[index]["params"] += function_params
-                            if truncate_len > 0 :
-                                if len(function_params) > truncate_len:
-                                    to_print = function_params[:truncate_len]
-                                    truncate_len = 0
-                                else:
-                                    to_print = function_params
-                                    truncate_len -= len(function_params)
-                                printc(to_print.replace("{","(").replace("}",")"), end="", style=style)
-                                if truncate_len <= 0:
-                                    printc("...", end="", style=style)
-            printc("", style=style)
-            tool_calls = []
+                            if on_tool_call is not None and "}" in function_params and self._is_complete_json(tool2call[index]["params"]):
+                                dispatch(index)
+                            if emit is not None and function_params:
+                                emit(ToolArgumentsDelta(list(tool2call).index(index), function_params))
             for index in tool2call:
-                tool_calls.append({
-                    "id": tool2call[index]["id"],
-                    "function": {
-                        "name": tool2call[index]["name"],
-                        "arguments": tool2call[index]["params"]
-                    },
-                    "type": "function",
-                })
+                dispatch(index)
+            tool_calls = [self._stream_tool_call(tool2call[index]) for index in tool2call]
             response_message = {
                 "role": "assistant",
                 "content": answer,
@@ -246,45 +581,259 @@ class LLM:
                 "function_call": None,
                 "tool_calls": tool_calls
             }
-            logging.debug(f"tool choice:{pretty(response_message)}")
+            if emit is not None:
+                emit(ResponseDone(answer, tool_calls))
+            if logging.getLogger().isEnabledFor(logging.DEBUG):
+                logging.debug(f"tool choice:{pretty(response_message)}")
+            if cache_key is not None:
+                self._store_cached(cache_key, answer, tool_calls)
             return answer, tool_calls, response_message
             
 
-    def _handle_tool_call(self, tool_call, function_call_history, messages):
+    def _store_cached(self, cache_key, answer, tool_calls):
+        tool_calls = [dict(tool_call, type="function") for tool_call in tool_calls]
+        self.cache.set(cache_key, {
+            "answer": answer,
+            "tool_calls": tool_calls,
+            "message": {
+                "role": "assistant",
+                "content": answer,
+                "refusal": None,
+                "function_call": None,
+                "tool_calls": tool_calls
+            },
+        })
+
+    def _replay_cached(self, cached, stream, emit, on_tool_call):
+        """
+        用缓存的响应代替一次模型请求，流式调用时按小块重放回答。
+        """
+        cached = copy.deepcopy(cached)
+        answer = cached["answer"]
+        tool_calls = cached["tool_calls"]
+        if emit is not None and answer:
+            step = CACHE_REPLAY_CHUNK_SIZE if stream else len(answer)
+            for i in range(0, len(answer), step):
+                emit(TextDelta(answer[i:i + step]))
+        for position, tool_call in enumerate(tool_calls):
+            if emit is not None:
+                emit(ToolCallStart(position, tool_call["id"], tool_call["function"]["name"]))
+                emit(ToolArgumentsDelta(position, tool_call["function"]["arguments"]))
+            if on_tool_call is not None:
+                on_tool_call(position, tool_call)
+        if emit is not None:
+            emit(ResponseDone(answer, tool_calls))
+        logging.debug(f"replay cached response:{pretty(cached['message'])}")
+        return answer, tool_calls, cached["message"]
+
+    def _stream_tool_call(self, entry):
+        return {
+            "id": entry["id"],
+            "function": {
+                "name": entry["name"],
+                "arguments": entry["params"]
+            },
+            "type": "function",
+        }
+
+    def _is_complete_json(self, text):
         try:
-            tool_name = tool_call["function"]["name"]
-            para = self._parse_parameters(tool_call["function"]["arguments"])
+            json.loads(text)
+            return True
+        except ValueError:
+            return False
+
+    def _handle_tool_calls(self, tool_calls, function_call_history, messages, dispatcher=None, memo=None, emit=None):
+        """
+        执行模型在同一轮中申请的全部工具调用。
+        可并行的工具放到线程池中并发执行，不可并行（parallel=False）的工具在当前线程依次执行，
+        结果仍按tool_calls的原始顺序追加到messages中，保证对话对API有效。
+        dispatcher不为空时，其中已经提前提交（early_dispatch）的调用直接取结果。
+        """
+        if dispatcher is None:
+            if self.tool_concurrency <= 1 or len(tool_calls) <= 1:
+                for tool_call in tool_calls:
+                    self._handle_tool_call(tool_call, function_call_history, messages, memo=memo, emit=emit)
+                return
+            dispatcher = ToolDispatcher(self, memo)
+
+        with dispatcher:
+            for position, tool_call in enumerate(tool_calls):
+                dispatcher.submit(position, tool_call)
+            results = dispatcher.results(tool_calls)
+
+        for history_item, tool_message in results:
+            self._append_tool_result(history_item, tool_message, function_call_history, messages, emit)
+
+    def _is_parallel_tool(self, tool_call):
+        tool = self.tools.get(tool_call["function"]["name"])
+        return tool is None or tool.get("parallel", True)
+
+    def _handle_tool_call(self, tool_call, function_call_history, messages, memo=None, emit=None):
+        history_item, tool_message = self._run_tool(tool_call, memo)
+        self._append_tool_result(history_item, tool_message, function_call_history, messages, emit)
+
+    def _append_tool_result(self, history_item, tool_message, function_call_history, messages, emit=None):
+        function_call_history.append(history_item)
+        messages.append(tool_message)
+        if emit is not None:
+            emit(ToolResult(tool_message["tool_call_id"], tool_message["name"], history_item["call"], tool_message["content"],
+                            error=tool_message["content"].startswith(TOOL_ERROR_PREFIX)))
+
+    def _semantic_lookup(self, model, messages, tools=None, use_cache=True):
+        """
+        Returns:
+            tuple: (语义缓存的查询，命中的值)；没有语义缓存或不是单轮问题时查询为None。
+        """
+        if self.semantic_cache is None or not use_cache:
+            return None, None
+        query = self.semantic_cache.make_query(model, messages, tools)
+        if query is None:
+            return None, None
+        return query, self.semantic_cache.lookup(query[0], [query[1]])[0]
+
+    def _replay_semantic(self, cached, emit):
+        "把语义缓存命中的[回答, 函数调用历史]作为一次完整的响应发出事件"
+        answer, function_call_history = cached
+        if emit is not None:
+            emit(TextDelta(answer))
+            emit(ResponseDone(answer, []))
+            emit(Done(answer, function_call_history))
+        return answer, function_call_history
+
+    def _span(self, name, **attrs):
+        return start_span(self.observer, name, **attrs)
+
+    def _stream_options(self):
+        "有观察者时请求流式响应附带token用量"
+        if self.observer is None:
+            return {}
+        return {"stream_options": {"include_usage": True}}
+
+    def _record_usage(self, span, response):
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            span.set(prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens)
+
+    def _drop_session_state(self, ctx):
+        "会话被淘汰时释放与之绑定的工具结果缓存"
+        self.tool_memos.pop(ctx, None)
+
+    def _conversation_memo(self, ctx):
+        """
+        返回会话级的工具结果缓存表（工具名 -> LRUCache）。ctx为None时只在本次using_tool内有效。
+        """
+        if ctx is None:
+            return {}
+        return self.tool_memos.setdefault(ctx, {})
+
+    def _tool_memo(self, tool_name, memo):
+        tool = self.tools[tool_name]
+        policy = tool.get("cache_policy")
+        if policy == TOOL_CACHE_GLOBAL:
+            return tool["memo"]
+        if policy == TOOL_CACHE_CONVERSATION and memo is not None:
+            return memo.setdefault(tool_name, LRUCache(maxsize=tool["cache_size"], ttl=tool["cache_ttl"]))
+        return None
+
+    def _memo_key(self, para):
+        return json.dumps(para, sort_keys=True, ensure_ascii=False, default=str)
+
+    def _tool_result(self, tool_call, tool_name, para, result, cache_status=None):
+        result = str(result)
+        history_item = {"call": f"{tool_name}({para})", "result": truncate_string(result, 256)}
+        if cache_status is not None:
+            history_item["cache"] = cache_status
+        if self.spill_threshold is not None and len(result) > self.spill_threshold and tool_name != READ_RESULT_TOOL:
+            result = self._spill(result)
+            history_item["spilled"] = True
+        return history_item, {
+            "tool_call_id": tool_call.get("id"),
+            "role": "tool",
+            "name": tool_name,
+            "content": result,
+        }
+
+    def _spill(self, result):
+        "把大结果存入blob_store，返回给模型的摘要：开头、结尾和读取方式"
+        handle = self.blob_store.put(result)
+        pages = self.blob_store.page_count(handle)
+        # 开头和结尾各占阈值的四分之一，加上说明文字，摘要仍然小于阈值
+        preview = min(SPILL_PREVIEW_SIZE, self.spill_threshold // 4)
+        logging.info(f"Spill tool result of {len(result)} chars to {handle}")
+        return (f"结果较大（{len(result)}个字符，{pages}页），已保存为{handle}。\n"
+                f"开头：\n{result[:preview]}\n...\n结尾：\n{result[-preview:]}\n"
+                f"需要完整内容时调用{READ_RESULT_TOOL}(handle=\"{handle}\", page=页码)按页读取。")
+
+    def _read_tool_result(self, handle, page=1, offset=None, length=None):
+        if offset is not None:
+            # 一次最多读一页，不能把整个结果重新放回对话
+            length = min(length or self.blob_store.page_size, self.blob_store.page_size)
+            return self.blob_store.read_range(handle, offset, length)
+        pages = self.blob_store.page_count(handle)
+        return f"[{handle} 第{page}/{pages}页]\n{self.blob_store.read_page(handle, page)}"
+
+    def _tool_error(self, tool_call, tool_name, para, e):
+        function_call_string = f"{tool_name}({para})"  # Assume para is string or can be converted to string
+        logging.error(f"Function call error:function is {function_call_string}, error is  {e}")
+        return {"call": function_call_string, "result": str(e)}, {
+            "tool_call_id": tool_call.get("id"),
+            "role": "tool",
+            "name": tool_name,
+            "content": f"{TOOL_ERROR_PREFIX}: {e}",
+        }
+
+    def _run_tool(self, tool_call, memo=None):
+        """
+        执行单个工具调用，设置了cache_policy的工具先查结果缓存。
+        Returns:
+            tuple: (函数调用历史条目, 追加到messages的tool消息)
+        """
+        tool_name = tool_call["function"]["name"]
+        with self._span("tool", tool=tool_name) as span:
+            return self._call_tool(span, tool_call, memo)
+
+    def _call_tool(self, span, tool_call, memo=None):
+        tool_name = tool_call["function"]["name"]
+        para = tool_call["function"]["arguments"]
+        try:
+            if tool_name in self.tools:
+                para = self._parse_arguments(tool_name, para)
             
             if tool_name not in self.tools:
                 logging.error(f"Tool not found: {tool_name}")
                 raise Exception(f"Tool not found: {tool_name}")
+
+            tool_memo = self._tool_memo(tool_name, memo)
+            if tool_memo is not None:
+                memo_key = self._memo_key(para)
+                result = tool_memo.get(memo_key)
+                if result is not MISS:
+                    logging.info(f"Tool cache hit: {tool_name}({para})")
+                    span.set(cache="hit")
+                    return self._tool_result(tool_call, tool_name, para, result, cache_status="hit")
             
             logging.info(f"Running tool: {tool_name}({para})")
             tool_function = self.tools[tool_name]["function"]
             result = tool_function(**para)
-            
-            function_call_history.append({"call": f"{tool_name}({para})", "result": truncate_string(str(result), 256)})
-            
-            messages.append({
-                "tool_call_id": tool_call.get("id"),
-                "role": "tool",
-                "name": tool_name,
-                "content": str(result),
-            })
+
+            if tool_memo is not None:
+                result = str(result)
+                tool_memo.set(memo_key, result)
+                span.set(cache="miss")
+                return self._tool_result(tool_call, tool_name, para, result, cache_status="miss")
+            return self._tool_result(tool_call, tool_name, para, result)
             
         except Exception as e:
-            function_call_string = f"{tool_name}({para})"  # Assume para is string or can be converted to string
-            logging.error(f"Function call error:function is {function_call_string}, error is  {e}")
-            function_call_history.append({"call": function_call_string, "result": str(e)})
-            messages.append({
-                "tool_call_id": tool_call.get("id"),
-                "role": "tool",
-                "name": tool_name,
-                "content": f"Function call error: {e}",
-            })
-
-    def _parse_parameters(self, arguments):
+            span.set(error=repr(e))
+            return self._tool_error(tool_call, tool_name, para, e)
+
+    def _parse_arguments(self, tool_name, arguments):
+        """
+        用注册时编译的验证函数解析参数，数字字符串等可以安全转换的参数在本地修正。
+        参数不合法时抛出ToolArgumentError，错误消息作为工具结果返回给模型。
+        """
         try:
-            return json.loads(arguments)
-        except (json.JSONDecodeError, TypeError):
-            return arguments  # Return original if not a JSON string or other error occurs
+            return self.tools[tool_name]["validate"](arguments)
+        except ToolArgumentError as e:
+            raise ToolArgumentError(f"invalid arguments for {tool_name}: {e}")
@@ -0,0 +1,240 @@
+import contextvars
+import itertools
+import json
+import logging
+import threading
+import time
+from collections import deque
+
+SPAN_HISTORY_SIZE = 1000
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_current_span = contextvars.ContextVar("pyllm_current_span", default=None)
+_span_ids = itertools.count(1)
+
+
+class Span:
+    """
+    一次计时的操作，例如一次模型请求或一次工具调用。
+    嵌套关系通过contextvars传递，子智能体的span会挂在父智能体调用它的工具span下面。
+    """
+
+    __slots__ = ("name", "span_id", "parent_id", "start", "end", "attrs", "_token", "_observer")
+
+    def __init__(self, name, observer, attrs):
+        parent = _current_span.get()
+        self.name = name
+        self.span_id = next(_span_ids)
+        self.parent_id = parent.span_id if parent is not None else None
+        self.attrs = attrs
+        self.start = None
+        self.end = None
+        self._observer = observer
+        self._token = None
+
+    @property
+    def duration(self):
+        if self.start is None or self.end is None:
+            return None
+        return self.end - self.start
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def mark_first_token(self):
+        "记录流式响应的首个token时间（TTFT），只记录第一次"
+        if "ttft" not in self.attrs:
+            self.attrs["ttft"] = time.perf_counter() - self.start
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self._token = _current_span.set(self)
+        try:
+            self._observer.on_span_start(self)
+        except Exception as e:
+            logging.error(f"observer error: {e}")
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end = time.perf_counter()
+        _current_span.reset(self._token)
+        if exc is not None:
+            self.attrs["error"] = repr(exc)
+        try:
+            self._observer.on_span_end(self)
+        except Exception as e:
+            logging.error(f"observer error: {e}")
+        return False
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "duration": self.duration,
+            **self.attrs,
+        }
+
+
+class _NullSpan:
+    "没有观察者时使用的空span，所有操作都是空操作"
+
+    def set(self, **attrs):
+        pass
+
+    def mark_first_token(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+def start_span(observer, name, **attrs):
+    "observer为None时返回空span，关闭观测时的开销只有一次判断"
+    if observer is None:
+        return NULL_SPAN
+    return Span(name, observer, attrs)
+
+
+def current_attr(name, default=None):
+    "读取最近一层设置了该属性的span的属性值"
+    span = _current_span.get()
+    if span is None:
+        return default
+    return span.attrs.get(name, default)
+
+
+class Observer:
+    "观察者基类，按需覆盖on_span_start/on_span_end"
+
+    def on_span_start(self, span):
+        pass
+
+    def on_span_end(self, span):
+        pass
+
+
+class CallbackObserver(Observer):
+    "把span结束事件转发给回调函数callback(span)"
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    def on_span_end(self, span):
+        self.callback(span)
+
+
+def as_observer(observer):
+    if observer is None or isinstance(observer, Observer):
+        return observer
+    if callable(observer):
+        return CallbackObserver(observer)
+    raise TypeError(f"observer must be an Observer or callable, got {type(observer)}")
+
+
+class MetricsCollector(Observer):
+    """
+    汇总span的指标：按(span名, 模型/工具名)统计次数、错误数、耗时分布、TTFT和token用量，
+    并保留最近的span明细。可以导出为Prometheus文本格式或JSON。
+
+    Args:
+        history_size (int, optional): 保留的最近span数。
+    """
+
+    def __init__(self, history_size=SPAN_HISTORY_SIZE):
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._tokens = {}
+        self.spans = deque(maxlen=history_size)
+
+    def on_span_end(self, span):
+        attrs = span.attrs
+        key = (span.name, attrs.get("tool") or attrs.get("agent") or attrs.get("model") or "")
+        duration = span.duration
+        with self._lock:
+            stat = self._stats.get(key)
+            if stat is None:
+                stat = self._stats[key] = {
+                    "count": 0, "errors": 0, "duration_sum": 0.0,
+                    "buckets": [0] * len(DURATION_BUCKETS),
+                    "ttft_count": 0, "ttft_sum": 0.0,
+                }
+            stat["count"] += 1
+            stat["duration_sum"] += duration
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if duration <= bound:
+                    stat["buckets"][i] += 1
+            if "error" in attrs:
+                stat["errors"] += 1
+            if "ttft" in attrs:
+                stat["ttft_count"] += 1
+                stat["ttft_sum"] += attrs["ttft"]
+            model = attrs.get("model")
+            for kind in ("prompt_tokens", "completion_tokens"):
+                if attrs.get(kind):
+                    self._tokens[(model, kind)] = self._tokens.get((model, kind), 0) + attrs[kind]
+            self.spans.append(span)
+
+    def to_json(self, recent=True):
+        "导出为可以json.dumps的dict"
+        with self._lock:
+            stats = []
+            for (name, label), stat in self._stats.items():
+                stats.append({
+                    "name": name,
+                    "label": label,
+                    "count": stat["count"],
+                    "errors": stat["errors"],
+                    "duration_sum": stat["duration_sum"],
+                    "duration_avg": stat["duration_sum"] / stat["count"],
+                    "ttft_avg": stat["ttft_sum"] / stat["ttft_count"] if stat["ttft_count"] else None,
+                })
+            tokens = [{"model": model, "type": kind, "count": count} for (model, kind), count in self._tokens.items()]
+            spans = [span.to_dict() for span in self.spans] if recent else []
+        return {"stats": stats, "tokens": tokens, "spans": spans}
+
+    def dumps(self):
+        return json.dumps(self.to_json(), ensure_ascii=False, default=str)
+
+    def to_prometheus(self):
+        "导出为Prometheus文本格式"
+        lines = [
+            "# TYPE pyllm_span_duration_seconds histogram",
+        ]
+        with self._lock:
+            items = sorted(self._stats.items())
+            for (name, label), stat in items:
+                labels = _labels(name=name, label=label)
+                for bound, count in zip(DURATION_BUCKETS, stat["buckets"]):
+                    lines.append(f'pyllm_span_duration_seconds_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(f'pyllm_span_duration_seconds_bucket{{{labels},le="+Inf"}} {stat["count"]}')
+                lines.append(f'pyllm_span_duration_seconds_sum{{{labels}}} {stat["duration_sum"]}')
+                lines.append(f'pyllm_span_duration_seconds_count{{{labels}}} {stat["count"]}')
+            lines.append("# TYPE pyllm_span_errors_total counter")
+            for (name, label), stat in items:
+                lines.append(f'pyllm_span_errors_total{{{_labels(name=name, label=label)}}} {stat["errors"]}')
+            lines.append("# TYPE pyllm_ttft_seconds summary")
+            for (name, label), stat in items:
+                if stat["ttft_count"]:
+                    labels = _labels(name=name, label=label)
+                    lines.append(f'pyllm_ttft_seconds_sum{{{labels}}} {stat["ttft_sum"]}')
+                    lines.append(f'pyllm_ttft_seconds_count{{{labels}}} {stat["ttft_count"]}')
+            lines.append("# TYPE pyllm_tokens_total counter")
+            for (model, kind), count in sorted(self._tokens.items(), key=lambda item: (str(item[0][0]), item[0][1])):
+                lines.append(f'pyllm_tokens_total{{{_labels(model=model, type=kind)}}} {count}')
+        return "\n".join(lines) + "\n"
+
+
+def _escape_label(value):
+    "Prometheus标签值中的反斜杠、双引号和换行需要转义，工具名、模型名可能包含任意字符"
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels):
+    return ",".join(f'{key}="{_escape_label(value)}"' for key, value in labels.items())
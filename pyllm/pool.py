@@ -0,0 +1,320 @@
+import asyncio
+import contextvars
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from pyllm.batch import is_retryable
+from pyllm.client import get_client, get_async_client
+from pyllm.scope import current_scope
+
+POOL_EWMA_ALPHA = 0.3
+POOL_FAILURE_THRESHOLD = 3
+POOL_COOLDOWN = 30.0
+POOL_LATENCY_WINDOW = 100
+POOL_HEDGE_MIN_SAMPLES = 10
+POOL_HEDGE_PERCENTILE = 0.95
+POOL_HEDGE_WORKERS = 16
+
+
+class NoEndpointAvailable(Exception):
+    pass
+
+
+class Endpoint:
+    """
+    一个模型服务地址。
+
+    Args:
+        url (str): base_url。
+        ak (str, optional): API key，默认读取OPENAI_API_KEY。
+        model (str, optional): 在这个地址上使用的模型名，为None时使用请求中的模型名。
+        weight (float, optional): 权重，越大越容易被选中。
+        client (OpenAI|AsyncOpenAI, optional): 注入已有的客户端。
+    """
+
+    def __init__(self, url, ak=None, model=None, weight=1.0, client=None):
+        self.url = url
+        self.ak = ak if ak is not None else os.environ.get("OPENAI_API_KEY")
+        self.model = model
+        self.weight = weight
+        self._client = client
+        self._async_base = None
+        self._async_client = None
+        self.ewma = None
+        self.latencies = deque(maxlen=POOL_LATENCY_WINDOW)
+        self.failures = 0
+        self.open_until = 0.0
+        self.requests = 0
+        self.errors = 0
+
+    def client(self):
+        if self._client is None:
+            # 失败由连接池切换地址，不在同一个地址上重试
+            self._client = get_client(self.ak, self.url).with_options(max_retries=0)
+        return self._client
+
+    def async_client(self):
+        if self._client is not None:
+            return self._client
+        base = get_async_client(self.ak, self.url)
+        if base is not self._async_base:
+            self._async_base = base
+            self._async_client = base.with_options(max_retries=0)
+        return self._async_client
+
+    def available(self, now):
+        return self.open_until <= now
+
+    def score(self):
+        "预计延迟除以权重，越小越好；还没有样本的地址优先尝试"
+        return (self.ewma or 0.0) / self.weight
+
+    def percentile(self, q):
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(int(len(ordered) * q), len(ordered) - 1)]
+
+    def stats(self):
+        return {
+            "url": self.url,
+            "model": self.model,
+            "ewma": self.ewma,
+            "p95": self.percentile(POOL_HEDGE_PERCENTILE),
+            "requests": self.requests,
+            "errors": self.errors,
+            "open": self.open_until > time.monotonic(),
+        }
+
+    def __repr__(self):
+        return f"Endpoint({self.url!r}, model={self.model!r})"
+
+
+class EndpointPool:
+    """
+    多个模型服务地址组成的连接池：
+    每次请求选择最近延迟（EWMA）/权重最小的地址；连续失败failure_threshold次的地址熔断cooldown秒，
+    熔断结束后放行请求试探，成功即恢复；可重试的错误（连接错误、429、5xx）自动切换到下一个地址。
+    开启hedge时，请求超过该地址p95延迟仍未返回，就向另一个地址发出相同的请求，先返回的结果生效。
+
+    Args:
+        endpoints (list): Endpoint，或者(url, ak, model[, weight])元组。
+        hedge (bool, optional): 是否发送对冲请求。
+        hedge_delay (float, optional): 固定的对冲等待时间（秒），为None时使用主地址的p95延迟。
+        failure_threshold (int, optional): 连续失败多少次后熔断。
+        cooldown (float, optional): 熔断时长（秒）。
+        ewma_alpha (float, optional): EWMA平滑系数。
+    """
+
+    def __init__(self, endpoints, hedge=False, hedge_delay=None, failure_threshold=POOL_FAILURE_THRESHOLD,
+                 cooldown=POOL_COOLDOWN, ewma_alpha=POOL_EWMA_ALPHA):
+        self.endpoints = [e if isinstance(e, Endpoint) else Endpoint(*e) for e in endpoints]
+        if not self.endpoints:
+            raise ValueError("EndpointPool needs at least one endpoint")
+        self.hedge = hedge
+        self.hedge_delay = hedge_delay
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.ewma_alpha = ewma_alpha
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def select(self, exclude=()):
+        """
+        Returns:
+            Endpoint: 可用地址中得分最好的一个；全部熔断时返回最早恢复的一个；都在exclude中时返回None。
+        """
+        now = time.monotonic()
+        with self._lock:
+            candidates = [e for e in self.endpoints if e not in exclude]
+            if not candidates:
+                return None
+            available = [e for e in candidates if e.available(now)]
+            if not available:
+                return min(candidates, key=lambda e: e.open_until)
+            return min(available, key=Endpoint.score)
+
+    def record_success(self, endpoint, latency):
+        with self._lock:
+            endpoint.requests += 1
+            endpoint.failures = 0
+            endpoint.open_until = 0.0
+            endpoint.latencies.append(latency)
+            if endpoint.ewma is None:
+                endpoint.ewma = latency
+            else:
+                endpoint.ewma = self.ewma_alpha * latency + (1 - self.ewma_alpha) * endpoint.ewma
+
+    def record_failure(self, endpoint, error):
+        "只有可重试的错误（连接错误、429、5xx）计入熔断；400、401等是请求本身的问题，地址是健康的"
+        with self._lock:
+            endpoint.requests += 1
+            endpoint.errors += 1
+            if not is_retryable(error):
+                return
+            endpoint.failures += 1
+            if endpoint.failures >= self.failure_threshold:
+                endpoint.open_until = time.monotonic() + self.cooldown
+                logging.warning(f"endpoint {endpoint.url} circuit open for {self.cooldown}s after {endpoint.failures} failures: {error}")
+
+    def _hedge_delay(self, endpoint):
+        if not self.hedge or len(self.endpoints) < 2:
+            return None
+        if self.hedge_delay is not None:
+            return self.hedge_delay
+        if len(endpoint.latencies) < POOL_HEDGE_MIN_SAMPLES:
+            return None
+        return endpoint.percentile(POOL_HEDGE_PERCENTILE)
+
+    def stats(self):
+        return [endpoint.stats() for endpoint in self.endpoints]
+
+    def _attempt(self, endpoint, request):
+        "在endpoint上执行一次请求，记录延迟或失败"
+        start = time.monotonic()
+        try:
+            result = request(endpoint.client(), endpoint)
+        except Exception as e:
+            self.record_failure(endpoint, e)
+            raise
+        self.record_success(endpoint, time.monotonic() - start)
+        return result
+
+    def call(self, request):
+        """
+        选择地址执行request(client, endpoint)，失败时切换地址。
+        Returns:
+            request的返回值。
+        """
+        tried = []
+        last_error = None
+        while True:
+            endpoint = self.select(exclude=tried)
+            if endpoint is None:
+                raise last_error or NoEndpointAvailable("all endpoints failed")
+            tried.append(endpoint)
+            delay = self._hedge_delay(endpoint)
+            try:
+                if delay is None:
+                    return self._attempt(endpoint, request)
+                return self._call_hedged(endpoint, delay, request, tried)
+            except Exception as e:
+                if not is_retryable(e) or _deadline_passed():
+                    raise
+                logging.warning(f"endpoint {endpoint.url} failed, try next: {e}")
+                last_error = e
+
+    def _call_hedged(self, endpoint, delay, request, tried):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=POOL_HEDGE_WORKERS, thread_name_prefix="pyllm-hedge")
+        # 复制contextvars，对冲请求的span和截止时间沿用调用方的请求作用域
+        primary = self._executor.submit(contextvars.copy_context().run, self._attempt, endpoint, request)
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            return primary.result()
+        backup_endpoint = self.select(exclude=tried)
+        if backup_endpoint is None:
+            return primary.result()
+        tried.append(backup_endpoint)
+        logging.info(f"hedge request to {backup_endpoint.url} after {delay:.3f}s")
+        pending = {primary, self._executor.submit(contextvars.copy_context().run, self._attempt, backup_endpoint, request)}
+        while True:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    # 同步请求无法取消，较慢的请求在后台结束，流式响应要关闭连接
+                    for other in pending:
+                        other.add_done_callback(_close_result)
+                    return future.result()
+                error = future.exception()
+                if not is_retryable(error):
+                    raise error
+                # 有一个请求失败了，换一个地址补上
+                next_endpoint = self.select(exclude=tried)
+                if next_endpoint is not None:
+                    tried.append(next_endpoint)
+                    pending.add(self._executor.submit(contextvars.copy_context().run, self._attempt, next_endpoint, request))
+            if not pending:
+                raise error
+
+    async def acall(self, request):
+        "call的异步版本，request(client, endpoint)返回awaitable"
+        tried = []
+        last_error = None
+        while True:
+            endpoint = self.select(exclude=tried)
+            if endpoint is None:
+                raise last_error or NoEndpointAvailable("all endpoints failed")
+            tried.append(endpoint)
+            delay = self._hedge_delay(endpoint)
+            try:
+                if delay is None:
+                    return await self._attempt_async(endpoint, request)
+                return await self._call_hedged_async(endpoint, delay, request, tried)
+            except Exception as e:
+                if not is_retryable(e) or _deadline_passed():
+                    raise
+                logging.warning(f"endpoint {endpoint.url} failed, try next: {e}")
+                last_error = e
+
+    async def _attempt_async(self, endpoint, request):
+        start = time.monotonic()
+        try:
+            result = await request(endpoint.async_client(), endpoint)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.record_failure(endpoint, e)
+            raise
+        self.record_success(endpoint, time.monotonic() - start)
+        return result
+
+    async def _call_hedged_async(self, endpoint, delay, request, tried):
+        primary = asyncio.ensure_future(self._attempt_async(endpoint, request))
+        done, _ = await asyncio.wait([primary], timeout=delay)
+        if done:
+            return primary.result()
+        backup_endpoint = self.select(exclude=tried)
+        if backup_endpoint is None:
+            return await primary
+        tried.append(backup_endpoint)
+        logging.info(f"hedge request to {backup_endpoint.url} after {delay:.3f}s")
+        pending = {primary, asyncio.ensure_future(self._attempt_async(backup_endpoint, request))}
+        try:
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+                    if not is_retryable(error):
+                        raise error
+                    next_endpoint = self.select(exclude=tried)
+                    if next_endpoint is not None:
+                        tried.append(next_endpoint)
+                        pending.add(asyncio.ensure_future(self._attempt_async(next_endpoint, request)))
+                if not pending:
+                    raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+
+def _deadline_passed():
+    "请求已经超过截止时间，不再切换地址重试"
+    scope = current_scope()
+    return scope is not None and scope.expired()
+
+
+def _close_result(future):
+    if future.exception() is None and hasattr(future.result(), "close"):
+        future.result().close()
@@ -0,0 +1,260 @@
+import collections
+import gzip
+import json
+import logging
+import threading
+import time
+from pyllm.cache import canonical_hash, _json_default
+
+# 回放时的计时方式
+REPLAY_SKIP = "skip"
+REPLAY_PRESERVE = "preserve"
+
+# 不参与请求匹配的参数：超时由请求作用域决定，stream_options取决于是否设置了observer
+_UNMATCHED_PARAMS = ("timeout", "stream_options")
+
+
+class ReplayMiss(LookupError):
+    "回放文件中没有与请求对应的响应"
+
+
+def request_key(kwargs):
+    "请求的匹配key：除超时等与内容无关的参数外，所有请求参数的哈希"
+    return canonical_hash({k: v for k, v in kwargs.items() if k not in _UNMATCHED_PARAMS})
+
+
+def _open(path, mode):
+    "以.gz结尾的文件按gzip压缩读写"
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def _dump(obj):
+    return obj.model_dump(mode="json", exclude_unset=True)
+
+
+class Recorder:
+    """
+    记录模型请求和响应的transport，传给LLM/AgentBase的transport参数。
+    每个请求写一行JSON：请求key、请求内容、非流式响应及其耗时，或者流式响应的每个chunk及其相对请求开始的时间。
+    文件以.gz结尾时压缩保存。记录的文件用Replayer回放。
+
+    Args:
+        path (str): 记录文件路径，已存在时追加。
+        requests (bool, optional): 是否保存请求内容（消息、工具定义），只用于排查，回放时按key匹配。
+    """
+
+    # LLM在计时开始前创建客户端，第一次请求记录的耗时不包括导入openai
+    needs_client = True
+
+    def __init__(self, path, requests=True):
+        self.path = path
+        self.requests = requests
+        self.count = 0
+        self._lock = threading.Lock()
+        self._file = _open(path, "a")
+
+    def _record(self, kwargs):
+        record = {"key": request_key(kwargs), "model": kwargs.get("model"), "stream": bool(kwargs.get("stream"))}
+        if self.requests:
+            record["request"] = json.loads(json.dumps(
+                {k: v for k, v in kwargs.items() if k not in _UNMATCHED_PARAMS}, ensure_ascii=False, default=_json_default))
+        return record
+
+    def _write(self, record):
+        line = json.dumps(record, ensure_ascii=False, separators=(",", ":"))
+        with self._lock:
+            if self._file.closed:
+                logging.warning(f"recorder {self.path} is closed, drop request {record['key'][:12]}")
+                return
+            self._file.write(line + "\n")
+            self._file.flush()
+            self.count += 1
+
+    def complete(self, send, kwargs):
+        """
+        发送请求并记录响应。
+        Args:
+            send (callable): send(**kwargs)实际发送请求。
+            kwargs (dict): 请求参数。
+        """
+        record = self._record(kwargs)
+        start = time.monotonic()
+        response = send(**kwargs)
+        if record["stream"]:
+            return self._record_stream(record, response, start)
+        record["latency"] = round(time.monotonic() - start, 6)
+        record["response"] = _dump(response)
+        self._write(record)
+        return response
+
+    def _record_stream(self, record, stream, start):
+        chunks = record["chunks"] = []
+        try:
+            for chunk in stream:
+                chunks.append([round(time.monotonic() - start, 6), _dump(chunk)])
+                yield chunk
+        finally:
+            # 中途放弃的流只记录已经收到的chunk
+            self._write(record)
+
+    async def acomplete(self, send, kwargs):
+        "complete的异步版本，send为协程函数"
+        record = self._record(kwargs)
+        start = time.monotonic()
+        response = await send(**kwargs)
+        if record["stream"]:
+            return self._arecord_stream(record, response, start)
+        record["latency"] = round(time.monotonic() - start, 6)
+        record["response"] = _dump(response)
+        self._write(record)
+        return response
+
+    async def _arecord_stream(self, record, stream, start):
+        chunks = record["chunks"] = []
+        try:
+            async for chunk in stream:
+                chunks.append([round(time.monotonic() - start, 6), _dump(chunk)])
+                yield chunk
+        finally:
+            self._write(record)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class Replayer:
+    """
+    回放Recorder记录的响应，不访问模型服务：using_tool、AgentBase.chat等可以离线、确定地重跑，用于性能分析和回归压测。
+    请求按key匹配，同一个key出现多次时按记录顺序依次返回；没有匹配的请求（例如工具结果每次不同）
+    按顺序取下一条模型相同、没有用过的记录，strict=True时抛出ReplayMiss。
+
+    Args:
+        path (str): Recorder记录的文件。
+        timing (str, optional): "skip"立即返回，"preserve"按记录的耗时和chunk间隔返回。
+        speed (float, optional): timing为"preserve"时的加速倍数。
+        strict (bool, optional): 请求必须与记录完全一致。
+        loop (bool, optional): 记录用完后从头开始，方便同一段记录反复压测。
+    """
+
+    needs_client = False
+
+    def __init__(self, path, timing=REPLAY_SKIP, speed=1.0, strict=False, loop=False):
+        if timing not in (REPLAY_SKIP, REPLAY_PRESERVE):
+            raise ValueError(f"Unknown replay timing: {timing}")
+        self.path = path
+        self.timing = timing
+        self.speed = speed
+        self.strict = strict
+        self.loop = loop
+        with _open(path, "r") as f:
+            self.records = [json.loads(line) for line in f if line.strip()]
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        "从头开始回放"
+        with self._lock:
+            self._rewind()
+
+    def _rewind(self):
+        self._used = [False] * len(self.records)
+        self._cursor = 0
+        self._by_key = collections.defaultdict(collections.deque)
+        for index, record in enumerate(self.records):
+            self._by_key[record["key"]].append(index)
+
+    def _take(self, kwargs):
+        key = request_key(kwargs)
+        with self._lock:
+            for _ in range(2):
+                indexes = self._by_key.get(key)
+                while indexes:
+                    index = indexes.popleft()
+                    if not self._used[index]:
+                        self._used[index] = True
+                        self.hits += 1
+                        return self.records[index]
+                if self.strict:
+                    raise ReplayMiss(f"no recorded response for request {key[:12]} (model {kwargs.get('model')})")
+                record = self._next_unused(kwargs.get("model"), bool(kwargs.get("stream")))
+                if record is not None:
+                    self.misses += 1
+                    logging.debug(f"replay request {key[:12]} not recorded, use next record {record['key'][:12]}")
+                    return record
+                if not self.loop or not self.records:
+                    break
+                self._rewind()
+            raise ReplayMiss(f"replay {self.path} exhausted after {len(self.records)} requests")
+
+    def _next_unused(self, model, stream):
+        "按记录顺序取下一条没有用过的、模型和是否流式都相同的记录"
+        while self._cursor < len(self.records) and self._used[self._cursor]:
+            self._cursor += 1
+        for index in range(self._cursor, len(self.records)):
+            record = self.records[index]
+            if not self._used[index] and record.get("model") == model and record.get("stream") == stream:
+                self._used[index] = True
+                return record
+        return None
+
+    def _delay(self, offset, start):
+        "按记录的时间偏移还需要等待的秒数"
+        if self.timing == REPLAY_SKIP:
+            return 0
+        return max(offset / self.speed - (time.monotonic() - start), 0)
+
+    def complete(self, send, kwargs):
+        "返回记录的响应，send不会被调用"
+        from openai.types.chat import ChatCompletion
+        record = self._take(kwargs)
+        start = time.monotonic()
+        if "chunks" in record:
+            return self._replay_stream(record, start)
+        delay = self._delay(record.get("latency", 0), start)
+        if delay:
+            time.sleep(delay)
+        return ChatCompletion.model_validate(record["response"])
+
+    def _replay_stream(self, record, start):
+        from openai.types.chat import ChatCompletionChunk
+        for offset, chunk in record["chunks"]:
+            delay = self._delay(offset, start)
+            if delay:
+                time.sleep(delay)
+            yield ChatCompletionChunk.model_validate(chunk)
+
+    async def acomplete(self, send, kwargs):
+        "complete的异步版本"
+        import asyncio
+        from openai.types.chat import ChatCompletion
+        record = self._take(kwargs)
+        start = time.monotonic()
+        if "chunks" in record:
+            return self._areplay_stream(record, start)
+        delay = self._delay(record.get("latency", 0), start)
+        if delay:
+            await asyncio.sleep(delay)
+        return ChatCompletion.model_validate(record["response"])
+
+    async def _areplay_stream(self, record, start):
+        import asyncio
+        from openai.types.chat import ChatCompletionChunk
+        for offset, chunk in record["chunks"]:
+            delay = self._delay(offset, start)
+            if delay:
+                await asyncio.sleep(delay)
+            yield ChatCompletionChunk.model_validate(chunk)
+
+    def stats(self):
+        return {"records": len(self.records), "hits": self.hits, "misses": self.misses, "unused": self._used.count(False)}
@@ -0,0 +1,346 @@
+import collections.abc
+import copy
+import enum
+import inspect
+import json
+import re
+import threading
+import typing
+import weakref
+
+_JSON_TYPES = {
+    str: "string",
+    int: "integer",
+    float: "number",
+    bool: "boolean",
+    list: "array",
+    tuple: "array",
+    set: "array",
+    dict: "object",
+}
+_ARG_DOC = re.compile(r"^\s*(\w+)\s*(?:\(([^)]*)\))?\s*[:：]\s*(.+)$")
+_TRUE = ("true", "yes", "1")
+_FALSE = ("false", "no", "0")
+_JSON_DEFAULTS = (str, int, float, bool, type(None))
+
+# 按函数弱引用缓存生成的schema，不会让工具函数（以及闭包里的智能体）一直留在内存中
+_schema_cache = weakref.WeakKeyDictionary()
+_schema_lock = threading.Lock()
+
+
+class ToolArgumentError(ValueError):
+    "工具参数不合法，消息会原样返回给模型，指明是哪个参数、期望什么"
+
+
+def _type_schema(hint):
+    "把类型标注转成JSON schema，没有标注时按字符串处理，无法识别的类型不加限制"
+    if hint is inspect.Parameter.empty:
+        return {"type": "string"}
+    if hint is typing.Any:
+        return {}
+    origin = typing.get_origin(hint)
+    args = typing.get_args(hint)
+    if origin is typing.Union or (origin is not None and origin.__class__.__name__ == "UnionType"):
+        options = [arg for arg in args if arg is not type(None)]
+        if len(options) == 1:
+            return _type_schema(options[0])
+        return {"anyOf": [_type_schema(arg) for arg in options]}
+    if origin is typing.Literal:
+        return {"enum": list(args)}
+    if isinstance(hint, type) and issubclass(hint, enum.Enum):
+        return {"enum": [member.value for member in hint]}
+    if origin in (list, tuple, set):
+        schema = {"type": "array"}
+        if args and args[0] is not Ellipsis:
+            schema["items"] = _type_schema(args[0])
+        return schema
+    if origin is dict:
+        return {"type": "object"}
+    if hint in _JSON_TYPES:
+        return {"type": _JSON_TYPES[hint]}
+    return {}
+
+
+def _doc_descriptions(doc):
+    "从Args:段落中取出每个参数的说明，格式同本项目的docstring：name (type): 说明"
+    descriptions = {}
+    in_args = False
+    for line in (doc or "").splitlines():
+        stripped = line.strip()
+        if stripped in ("Args:", "Arguments:", "参数:", "参数："):
+            in_args = True
+            continue
+        if in_args:
+            if stripped.endswith(":") and not _ARG_DOC.match(stripped):
+                break
+            match = _ARG_DOC.match(line)
+            if match:
+                descriptions[match.group(1)] = match.group(3).strip()
+    return descriptions
+
+
+def _is_callable_hint(hint):
+    origin = typing.get_origin(hint)
+    if origin is typing.Union or (origin is not None and origin.__class__.__name__ == "UnionType"):
+        return any(_is_callable_hint(arg) for arg in typing.get_args(hint) if arg is not type(None))
+    return hint is collections.abc.Callable or origin is collections.abc.Callable or hint is typing.Callable
+
+
+def _schema_from_function(function):
+    signature = inspect.signature(function)
+    try:
+        hints = typing.get_type_hints(function)
+    except Exception:
+        hints = {}
+    descriptions = _doc_descriptions(inspect.getdoc(function))
+    properties = {}
+    required = []
+    for name, parameter in signature.parameters.items():
+        # **kwargs不会让模型传入任意参数
+        if parameter.kind in (inspect.Parameter.VAR_KEYWORD, inspect.Parameter.VAR_POSITIONAL,
+                              inspect.Parameter.POSITIONAL_ONLY):
+            continue
+        hint = hints.get(name, parameter.annotation)
+        if parameter.default is not inspect.Parameter.empty and (
+                name.startswith("_") or not isinstance(parameter.default, _JSON_DEFAULTS) or _is_callable_hint(hint)):
+            # 下划线开头的内部参数、回调函数、对象等模型不应给出的可选参数不暴露给模型
+            continue
+        schema = _type_schema(hint)
+        if name in descriptions:
+            schema["description"] = descriptions[name]
+        if parameter.default is inspect.Parameter.empty:
+            required.append(name)
+        else:
+            schema["default"] = parameter.default
+        properties[name] = schema
+    return json.dumps({"type": "object", "properties": properties, "required": required,
+                       "additionalProperties": False})
+
+
+def schema_from_function(function):
+    """
+    根据函数签名、类型标注和docstring的Args段落生成工具参数的JSON schema，结果按函数缓存。
+    函数有para_desc属性时直接使用它。没有标注的参数按字符串处理；**kwargs、下划线开头的可选参数、
+    默认值不是JSON值（例如对象）或者标注为Callable的可选参数不会出现在schema中。
+    Returns:
+        dict: JSON schema，可以直接作为register_tool的para_desc。
+    """
+    para_desc = getattr(function, "para_desc", None)
+    if isinstance(para_desc, dict):
+        return copy.deepcopy(para_desc)
+    # 绑定方法每次访问都是新对象，按底层函数缓存，是否绑定分开保存
+    target = getattr(function, "__func__", function)
+    bound = target is not function
+    try:
+        with _schema_lock:
+            text = _schema_cache.get(target, {}).get(bound)
+    except TypeError:
+        # 不能弱引用的可调用对象不缓存
+        return json.loads(_schema_from_function(function))
+    if text is None:
+        text = _schema_from_function(function)
+        with _schema_lock:
+            _schema_cache.setdefault(target, {})[bound] = text
+    return json.loads(text)
+
+
+def _describe(value):
+    text = json.dumps(value, ensure_ascii=False, default=str)
+    return text if len(text) <= 50 else text[:47] + "..."
+
+
+def _compile(schema, path):
+    """
+    把schema编译成检查函数check(value) -> 转换后的值，不合法时抛出ToolArgumentError。
+    只做不会改变含义的转换：数字字符串转数字、"true"/"false"转布尔、数字转字符串、JSON字符串转数组/对象。
+    """
+    checks = []
+    if "anyOf" in schema:
+        options = [_compile(option, path) for option in schema["anyOf"]]
+
+        def check_any(value):
+            errors = []
+            for option in options:
+                try:
+                    return option(value)
+                except ToolArgumentError as e:
+                    errors.append(str(e))
+            raise ToolArgumentError("; ".join(errors))
+        checks.append(check_any)
+    kind = schema.get("type")
+    if isinstance(kind, list):
+        options = [_compile(dict(schema, type=option), path) for option in kind]
+
+        def check_types(value):
+            for option in options:
+                try:
+                    return option(value)
+                except ToolArgumentError:
+                    pass
+            raise ToolArgumentError(f"{path} should be one of {kind}, got {_describe(value)}")
+        checks.append(check_types)
+    elif kind is not None:
+        checks.append(_TYPE_CHECKS[kind](schema, path) if kind in _TYPE_CHECKS else (lambda value: value))
+    if "enum" in schema:
+        allowed = schema["enum"]
+
+        def check_enum(value):
+            if value not in allowed:
+                raise ToolArgumentError(f"{path} should be one of {_describe(allowed)}, got {_describe(value)}")
+            return value
+        checks.append(check_enum)
+    if len(checks) == 1:
+        return checks[0]
+
+    def check(value):
+        for step in checks:
+            value = step(value)
+        return value
+    return check
+
+
+def _check_string(schema, path):
+    def check(value):
+        if isinstance(value, str):
+            return value
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return str(value)
+        raise ToolArgumentError(f"{path} should be string, got {_describe(value)}")
+    return check
+
+
+def _check_integer(schema, path):
+    def check(value):
+        if isinstance(value, bool):
+            raise ToolArgumentError(f"{path} should be integer, got {_describe(value)}")
+        if isinstance(value, int):
+            return value
+        if isinstance(value, float) and value.is_integer():
+            return int(value)
+        if isinstance(value, str):
+            try:
+                return int(value.strip())
+            except ValueError:
+                try:
+                    number = float(value.strip())
+                except ValueError:
+                    number = None
+                if number is not None and number.is_integer():
+                    return int(number)
+        raise ToolArgumentError(f"{path} should be integer, got {_describe(value)}")
+    return check
+
+
+def _check_number(schema, path):
+    def check(value):
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return value
+        if isinstance(value, str):
+            try:
+                return float(value.strip())
+            except ValueError:
+                pass
+        raise ToolArgumentError(f"{path} should be number, got {_describe(value)}")
+    return check
+
+
+def _check_boolean(schema, path):
+    def check(value):
+        if isinstance(value, bool):
+            return value
+        if isinstance(value, str) and value.strip().lower() in _TRUE + _FALSE:
+            return value.strip().lower() in _TRUE
+        if value in (0, 1) and isinstance(value, int):
+            return bool(value)
+        raise ToolArgumentError(f"{path} should be boolean, got {_describe(value)}")
+    return check
+
+
+def _decode_json(value, expected, path):
+    if isinstance(value, str):
+        try:
+            decoded = json.loads(value)
+        except ValueError:
+            decoded = None
+        if isinstance(decoded, expected):
+            return decoded
+    return value
+
+
+def _check_array(schema, path):
+    items = _compile(schema["items"], f"{path}[]") if schema.get("items") else None
+
+    def check(value):
+        value = _decode_json(value, list, path)
+        if not isinstance(value, list):
+            raise ToolArgumentError(f"{path} should be array, got {_describe(value)}")
+        if items is None:
+            return value
+        result = []
+        for index, item in enumerate(value):
+            try:
+                result.append(items(item))
+            except ToolArgumentError as e:
+                raise ToolArgumentError(str(e).replace(f"{path}[]", f"{path}[{index}]", 1))
+        return result
+    return check
+
+
+def _check_object(schema, path):
+    properties = {name: _compile(prop, f"{path}.{name}" if path != "arguments" else name)
+                  for name, prop in schema.get("properties", {}).items()}
+    required = [name for name in schema.get("required", [])]
+    additional = schema.get("additionalProperties", True)
+
+    def check(value):
+        value = _decode_json(value, dict, path)
+        if not isinstance(value, dict):
+            raise ToolArgumentError(f"{path} should be object, got {_describe(value)}")
+        missing = [name for name in required if name not in value]
+        if missing:
+            expected = ", ".join(f"{name} ({schema.get('properties', {}).get(name, {}).get('type', 'any')})" for name in missing)
+            raise ToolArgumentError(f"missing required argument: {expected}")
+        result = {}
+        for name, item in value.items():
+            check_property = properties.get(name)
+            if check_property is not None:
+                result[name] = check_property(item)
+            elif additional is False:
+                raise ToolArgumentError(f"unexpected argument {name!r}, expected {sorted(properties)}")
+            else:
+                result[name] = item
+        return result
+    return check
+
+
+_TYPE_CHECKS = {
+    "string": _check_string,
+    "integer": _check_integer,
+    "number": _check_number,
+    "boolean": _check_boolean,
+    "array": _check_array,
+    "object": _check_object,
+}
+
+
+def compile_validator(schema):
+    """
+    把工具的参数schema编译成验证函数，注册工具时编译一次。
+    Args:
+        schema (dict): 工具的para_desc。
+    Returns:
+        callable: validate(arguments)，arguments为模型给出的JSON字符串或已解析的dict，
+            返回转换后的参数dict；不合法时抛出ToolArgumentError，消息指明出错的参数。
+    """
+    check = _compile(dict(schema or {}, type="object"), "arguments")
+
+    def validate(arguments):
+        if arguments is None or (isinstance(arguments, str) and not arguments.strip()):
+            arguments = "{}"
+        if isinstance(arguments, str):
+            try:
+                arguments = json.loads(arguments)
+            except json.JSONDecodeError as e:
+                raise ToolArgumentError(f"arguments are not valid JSON: {e.msg} at line {e.lineno} column {e.colno}")
+        return check(arguments)
+    return validate
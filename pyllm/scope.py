@@ -0,0 +1,101 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+STOP_MAX_LOOP = "max_loop"
+STOP_DEADLINE = "deadline"
+STOP_ITERATIONS = "iterations"
+
+_current_scope = contextvars.ContextVar("pyllm_request_scope", default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    "请求作用域的截止时间已过，不再发送新的模型请求"
+
+
+class RequestScope:
+    """
+    一次请求的作用域：会话ctx、输出方式、截止时间和迭代预算。
+    通过contextvars传递，工具（包括在线程池中运行的工具）和子智能体都能读到调用它的请求的作用域。
+    嵌套的作用域截止时间取两者中较早的一个，迭代次数同时计入所有外层的预算。
+    client_retries为False时模型请求不使用openai客户端的自动重试，由调用方（例如批量请求）自己重试。
+    """
+
+    def __init__(self, ctx=None, style=None, deadline=None, max_iterations=None, parent=None, client_retries=True):
+        self.ctx = ctx
+        self.style = style
+        self.deadline = deadline
+        self.max_iterations = max_iterations
+        self.client_retries = client_retries
+        self.iterations = 0
+        self.parent = parent
+        self._lock = threading.Lock()
+
+    def remaining(self):
+        "剩余时间（秒），没有截止时间时返回None"
+        if self.deadline is None:
+            return None
+        return self.deadline - time.monotonic()
+
+    def expired(self):
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def stop_reason(self):
+        """
+        Returns:
+            str: 预算已经用完的原因，还可以继续时返回None。
+        """
+        if self.expired():
+            return STOP_DEADLINE
+        scope = self
+        while scope is not None:
+            if scope.max_iterations is not None and scope.iterations >= scope.max_iterations:
+                return STOP_ITERATIONS
+            scope = scope.parent
+        return None
+
+    def consume_iteration(self):
+        scope = self
+        while scope is not None:
+            with scope._lock:
+                scope.iterations += 1
+            scope = scope.parent
+
+
+@contextmanager
+def request_scope(ctx=None, style=None, timeout=None, max_iterations=None, client_retries=None):
+    """
+    进入新的请求作用域，没有指定的ctx、style和client_retries沿用外层作用域。
+    Args:
+        timeout (float, optional): 从现在开始的时限（秒）。
+        max_iterations (int, optional): 这个作用域内（包括子智能体）最多的模型迭代轮数。
+        client_retries (bool, optional): 是否使用openai客户端的自动重试，默认使用。
+    """
+    parent = _current_scope.get()
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    if parent is not None:
+        if parent.deadline is not None:
+            deadline = parent.deadline if deadline is None else min(deadline, parent.deadline)
+        ctx = parent.ctx if ctx is None else ctx
+        style = parent.style if style is None else style
+        client_retries = parent.client_retries if client_retries is None else client_retries
+    scope = RequestScope(ctx=ctx, style=style, deadline=deadline, max_iterations=max_iterations, parent=parent,
+                         client_retries=client_retries is not False)
+    token = _current_scope.set(scope)
+    try:
+        yield scope
+    finally:
+        _current_scope.reset(token)
+
+
+def current_scope():
+    return _current_scope.get()
+
+
+def remaining_time():
+    "当前请求的剩余时间（秒），没有截止时间时返回None；工具可以用它限制自己的耗时"
+    scope = _current_scope.get()
+    if scope is None:
+        return None
+    return scope.remaining()
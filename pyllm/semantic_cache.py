@@ -0,0 +1,273 @@
+import copy
+import json
+import logging
+import os
+import re
+import threading
+import unicodedata
+import zlib
+from pyllm.cache import canonical_hash
+
+SEMANTIC_DIM = 1024
+SEMANTIC_NGRAMS = (1, 2, 3)
+# 字符n-gram向量对只差一个数字、一个否定词的问题相似度也很高（0.9以上），阈值太低会返回别的问题的答案
+SEMANTIC_THRESHOLD = 0.97
+SEMANTIC_CAPACITY = 10000
+# 相似度达到这个值就认为是同一个问题，覆盖原来的答案而不是新增一条
+SEMANTIC_DUPLICATE = 0.999
+
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError("SemanticCache requires numpy, install it with `pip install numpy`")
+    return numpy
+
+
+def normalize_text(text):
+    "NFKC规范化、转小写、合并空白并去掉标点符号两侧的空白，全角半角、大小写和空格不同的问题得到相同的向量"
+    text = unicodedata.normalize("NFKC", text).lower()
+    text = re.sub(r"\s*([^\w\s])\s*", r"\1", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+class HashingEmbedder:
+    """
+    离线的字符n-gram哈希向量：每个n-gram按crc32映射到dim维中的一维，符号也由哈希决定，最后做L2归一化。
+    不需要模型和网络，对字面上相近的问题（多几个字、换个说法的一部分）有效，中文按字切分同样适用。
+
+    Args:
+        dim (int, optional): 向量维度。
+        ngrams (tuple, optional): 使用的n-gram长度。
+    """
+
+    def __init__(self, dim=SEMANTIC_DIM, ngrams=SEMANTIC_NGRAMS):
+        self.dim = dim
+        self.ngrams = ngrams
+
+    def __call__(self, texts):
+        """
+        Args:
+            texts (list): 文本列表。
+        Returns:
+            numpy.ndarray: 形状为(len(texts), dim)的float32矩阵，每行已归一化。
+        """
+        np = _numpy()
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            text = normalize_text(text)
+            hashes = [zlib.crc32(text[i:i + n].encode("utf-8"))
+                      for n in self.ngrams for i in range(len(text) - n + 1)]
+            if not hashes:
+                continue
+            hashes = np.array(hashes, dtype=np.uint32)
+            signs = np.where(hashes & 0x80000000, -1.0, 1.0).astype(np.float32)
+            np.add.at(matrix[row], hashes % self.dim, signs)
+        return _normalize_rows(np, matrix)
+
+
+def _normalize_rows(np, matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class SemanticCache:
+    """
+    语义缓存：问题相近（向量余弦相似度不低于threshold）时直接返回保存的答案，不再请求模型。
+    向量保存在容量固定的NumPy矩阵中，一次矩阵乘法算出与全部条目的相似度；满了之后淘汰最久没有命中的条目。
+    只缓存单轮问题（前面只有system消息），模型、system消息和工具定义都相同的条目之间才会比较。
+    注意：相似不等于同义，"123 + 456等于多少"和"123 + 457等于多少"的相似度在0.9以上。
+    默认的HashingEmbedder只适合措辞几乎相同的重复问题；答案依赖问题中的数字、名称时请提高threshold或不要使用语义缓存。
+
+    Args:
+        embedder (callable, optional): embedder(texts)返回形状为(n, dim)的矩阵，默认HashingEmbedder。
+        threshold (float, optional): 命中需要的最低余弦相似度，降低它会提高命中率，也会提高返回错误答案的风险。
+        capacity (int, optional): 最多保存的条目数。
+        path (str, optional): 索引文件前缀，向量在path.npy，其他数据在path.json；文件存在时加载。
+        mmap (bool, optional): 向量矩阵使用内存映射的path.npy，新增条目直接写入文件，save()只需要写元数据。
+    """
+
+    def __init__(self, embedder=None, threshold=SEMANTIC_THRESHOLD, capacity=SEMANTIC_CAPACITY, path=None, mmap=False):
+        self.np = _numpy()
+        self.embedder = embedder or HashingEmbedder()
+        self.threshold = threshold
+        self.capacity = capacity
+        self.path = path
+        self.mmap = mmap
+        self.dim = getattr(self.embedder, "dim", None) or self.embedder([""]).shape[1]
+        self._lock = threading.Lock()
+        self._size = 0
+        self._tick = 0
+        self._group_ids = {}
+        self._entries = [None] * capacity
+        self._groups = self.np.full(capacity, -1, dtype=self.np.int64)
+        self._last_used = self.np.zeros(capacity, dtype=self.np.int64)
+        self._vectors = None
+        if path is not None and os.path.exists(path + ".json"):
+            self._load(path)
+        else:
+            self._vectors = self._new_matrix(path)
+        self.hits = 0
+        self.misses = 0
+
+    def _new_matrix(self, path):
+        np = self.np
+        if self.mmap:
+            if path is None:
+                raise ValueError("mmap=True needs a path")
+            return np.lib.format.open_memmap(path + ".npy", mode="w+", dtype=np.float32, shape=(self.capacity, self.dim))
+        return np.zeros((self.capacity, self.dim), dtype=np.float32)
+
+    def _load(self, path):
+        np = self.np
+        with open(path + ".json", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta["dim"] != self.dim:
+            raise ValueError(f"index {path} has dim {meta['dim']}, embedder has dim {self.dim}")
+        self.capacity = meta["capacity"]
+        vectors = np.load(path + ".npy", mmap_mode="r+" if self.mmap else None)
+        self._vectors = vectors if self.mmap else np.array(vectors, dtype=np.float32)
+        groups = meta["groups"]
+        self._group_ids = {group: i for i, group in enumerate(groups)}
+        self._size = len(meta["entries"])
+        self._tick = meta["tick"]
+        self._entries = [None] * self.capacity
+        self._groups = np.full(self.capacity, -1, dtype=np.int64)
+        self._last_used = np.zeros(self.capacity, dtype=np.int64)
+        for i, (group_id, last_used, text, value) in enumerate(meta["entries"]):
+            self._entries[i] = (text, value)
+            self._groups[i] = group_id
+            self._last_used[i] = last_used
+        logging.debug(f"load semantic cache {path} with {self._size} entries")
+
+    def save(self, path=None):
+        "保存到path（默认构造时的path），之后可以用SemanticCache.load(path)加载"
+        path = path or self.path
+        if path is None:
+            raise ValueError("no path to save semantic cache")
+        np = self.np
+        with self._lock:
+            groups = [None] * len(self._group_ids)
+            for group, i in self._group_ids.items():
+                groups[i] = group
+            meta = {
+                "dim": self.dim,
+                "capacity": self.capacity,
+                "tick": self._tick,
+                "groups": groups,
+                "entries": [[int(self._groups[i]), int(self._last_used[i]), *self._entries[i]] for i in range(self._size)],
+            }
+            if self.mmap and path == self.path:
+                self._vectors.flush()
+            else:
+                np.save(path + ".npy", self._vectors)
+            tmp_path = path + ".json.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(meta, f, ensure_ascii=False)
+            os.replace(tmp_path, path + ".json")
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        return cls(path=path, **kwargs)
+
+    def make_query(self, model, messages, tools=None):
+        """
+        Returns:
+            tuple: (分组key, 问题文本)；消息不是单轮问题时返回None，不使用语义缓存。
+        """
+        if not messages:
+            return None
+        *prefix, last = messages
+        if not isinstance(last, dict) or last.get("role") != "user" or not isinstance(last.get("content"), str):
+            return None
+        if any(not isinstance(message, dict) or message.get("role") != "system" for message in prefix):
+            return None
+        group = canonical_hash([model, [message.get("content") for message in prefix], tools])
+        return group, last["content"]
+
+    def get(self, model, messages, tools=None):
+        """
+        Returns:
+            保存的答案，没有命中或不是单轮问题时返回None。
+        """
+        query = self.make_query(model, messages, tools)
+        if query is None:
+            return None
+        return self.lookup(query[0], [query[1]])[0]
+
+    def set(self, model, messages, value, tools=None):
+        query = self.make_query(model, messages, tools)
+        if query is not None and value is not None:
+            self.add(query[0], query[1], value)
+
+    def _embed(self, texts):
+        vectors = self.np.asarray(self.embedder(texts), dtype=self.np.float32)
+        return _normalize_rows(self.np, vectors)
+
+    def _similarities(self, group, vectors):
+        "返回(最相近条目的下标, 相似度)，分组内没有条目时下标为-1"
+        np = self.np
+        group_id = self._group_ids.get(group)
+        if group_id is None or self._size == 0:
+            return np.full(len(vectors), -1), np.zeros(len(vectors), dtype=np.float32)
+        scores = vectors @ self._vectors[:self._size].T
+        scores[:, self._groups[:self._size] != group_id] = -np.inf
+        best = scores.argmax(axis=1)
+        best_scores = scores[np.arange(len(vectors)), best]
+        best[~np.isfinite(best_scores)] = -1
+        return best, best_scores
+
+    def lookup(self, group, texts):
+        """
+        批量查询同一分组中的多个问题。
+        Returns:
+            list: 每个问题命中的答案，没有命中时为None。
+        """
+        vectors = self._embed(texts)
+        with self._lock:
+            best, scores = self._similarities(group, vectors)
+            results = []
+            for index, score in zip(best, scores):
+                if index >= 0 and score >= self.threshold:
+                    self._tick += 1
+                    self._last_used[index] = self._tick
+                    self.hits += 1
+                    # 返回副本，调用方修改命中的回答或历史不会影响缓存
+                    results.append(copy.deepcopy(self._entries[index][1]))
+                else:
+                    self.misses += 1
+                    results.append(None)
+            return results
+
+    def add(self, group, text, value):
+        vector = self._embed([text])
+        with self._lock:
+            best, scores = self._similarities(group, vector)
+            if best[0] >= 0 and scores[0] >= SEMANTIC_DUPLICATE:
+                index = best[0]
+            elif self._size < self.capacity:
+                index = self._size
+                self._size += 1
+            else:
+                index = int(self._last_used[:self._size].argmin())
+            group_id = self._group_ids.setdefault(group, len(self._group_ids))
+            self._tick += 1
+            self._vectors[index] = vector[0]
+            self._groups[index] = group_id
+            self._last_used[index] = self._tick
+            self._entries[index] = (text, copy.deepcopy(value))
+
+    def clear(self):
+        with self._lock:
+            self._size = 0
+            self._entries = [None] * self.capacity
+            self._groups[:] = -1
+            self._group_ids.clear()
+
+    def stats(self):
+        return {"size": self._size, "capacity": self.capacity, "hits": self.hits, "misses": self.misses}
+
+    def __len__(self):
+        return self._size
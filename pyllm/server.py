@@ -0,0 +1,400 @@
+import asyncio
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import math
+import signal
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote, urlsplit
+from pyllm.events import Done
+
+SERVER_QUEUE_SIZE = 64
+SERVER_WORKERS = 16
+SERVER_MAX_BODY = 1024 * 1024
+SERVER_MAX_HEADER = 64 * 1024
+SERVER_SHUTDOWN_GRACE = 30.0
+SERVER_RETRY_AFTER = 1
+
+HTTP_REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    409: "Conflict",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.headers = headers or {}
+
+
+class _Turn:
+    "排队中或正在运行的一轮对话"
+
+    def __init__(self, session, message, stream, timeout):
+        self.session = session
+        self.message = message
+        self.stream = stream
+        self.timeout = timeout
+        self.events = asyncio.Queue() if stream else None
+        self.result = asyncio.get_running_loop().create_future()
+        self.task = None
+        # 同步智能体运行这一轮的线程池future，取消task后线程仍会运行到结束
+        self.thread = None
+
+    def emit(self, event):
+        if self.events is not None:
+            self.events.put_nowait(event)
+
+
+class AgentServer:
+    """
+    把智能体发布为HTTP服务，基于asyncio，一个事件循环同时服务大量会话。
+
+    接口：
+        POST /chat              {"session": "会话ID", "message": "问题", "stream": false, "timeout": null}
+                                stream为true（或请求头Accept: text/event-stream）时以SSE逐个返回pyllm.events中的事件，
+                                否则等回答完成后返回{"session", "answer", "history"}。
+        DELETE /sessions/<ID>   删除会话。
+        GET /health             运行状态和排队情况。
+
+    每个会话同一时间只有一轮对话，前一轮没有结束时新的请求返回409；
+    排队的请求超过queue_size时返回503和Retry-After，由客户端退避重试，服务端不会无限积压。
+    AsyncAgentBase直接在事件循环中运行；同步的AgentBase在专用的线程池中运行，占用的线程数不超过workers。
+
+    Args:
+        agent (AgentBase|AsyncAgentBase): 要发布的智能体。
+        host (str, optional): 监听地址。
+        port (int, optional): 监听端口，0表示随机选择，启动后见self.port。
+        workers (int, optional): 同时运行的对话轮数。
+        queue_size (int, optional): 等待运行的最大请求数。
+        max_body (int, optional): 请求体的最大字节数。
+    """
+
+    def __init__(self, agent, host="127.0.0.1", port=8000, workers=SERVER_WORKERS, queue_size=SERVER_QUEUE_SIZE,
+                 max_body=SERVER_MAX_BODY):
+        self.agent = agent
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.queue_size = queue_size
+        self.max_body = max_body
+        self._server = None
+        self._queue = None
+        self._executor = None
+        self._workers = []
+        self._busy = set()
+        self._running = set()
+        self._connections = set()
+        self._active = set()
+        self._closing = False
+        self._stopped = None
+        self.served = 0
+        self.rejected = 0
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self):
+        "开始监听，返回后即可接受请求"
+        # 容量由_submit按workers + queue_size控制，队列本身不限长度
+        self._queue = asyncio.Queue()
+        self._stopped = asyncio.Event()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="pyllm-server")
+        self._workers = [asyncio.ensure_future(self._work()) for _ in range(self.workers)]
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port,
+                                                  limit=SERVER_MAX_HEADER)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logging.info(f"agent {self.agent.name} serving on {self.url}")
+        return self
+
+    async def shutdown(self, grace=SERVER_SHUTDOWN_GRACE):
+        """
+        优雅退出：停止接受新连接和新请求，等待排队和正在运行的对话在grace秒内完成，超时后取消。
+        """
+        if self._closing:
+            await self._stopped.wait()
+            return
+        self._closing = True
+        logging.info(f"shutting down, {self._queue.qsize()} queued, {len(self._running)} running")
+        self._server.close()
+        # 空闲的keep-alive连接直接关闭，正在处理请求的连接等它们写完响应
+        for connection in self._connections - self._active:
+            connection.cancel()
+        try:
+            await asyncio.wait_for(self._queue.join(), grace)
+        except asyncio.TimeoutError:
+            logging.warning(f"shutdown grace {grace}s exceeded, cancel remaining turns")
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        while not self._queue.empty():
+            turn = self._queue.get_nowait()
+            turn.result.set_exception(HTTPError(503, "server is shutting down"))
+        # 等待连接把最后的响应写完
+        if self._connections:
+            await asyncio.wait(list(self._connections), timeout=grace)
+        for connection in self._connections:
+            connection.cancel()
+        await self._server.wait_closed()
+        # 已经取消的同步对话无法中断线程，不等待它们结束
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._stopped.set()
+
+    async def serve_forever(self, grace=SERVER_SHUTDOWN_GRACE):
+        "启动服务，收到SIGINT/SIGTERM时优雅退出"
+        await self.start()
+        loop = asyncio.get_running_loop()
+        stop = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop.set)
+            except (NotImplementedError, RuntimeError):
+                pass
+        await stop.wait()
+        await self.shutdown(grace)
+
+    def stats(self):
+        return {
+            "status": "closing" if self._closing else "ok",
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "running": len(self._running),
+            "sessions_busy": len(self._busy),
+            "served": self.served,
+            "rejected": self.rejected,
+        }
+
+    async def _work(self):
+        while True:
+            turn = await self._queue.get()
+            try:
+                await self._run_turn(turn)
+            finally:
+                self._queue.task_done()
+
+    async def _run_turn(self, turn):
+        self._running.add(turn)
+        turn.task = asyncio.ensure_future(self._chat(turn))
+        try:
+            # 不直接await：客户端断开时取消的是这一轮对话，不是worker
+            await asyncio.wait([turn.task])
+        except asyncio.CancelledError:
+            turn.task.cancel()
+            raise
+        finally:
+            self._running.discard(turn)
+            self._release(turn)
+            if turn.result.done():
+                pass
+            elif not turn.task.done() or turn.task.cancelled():
+                turn.result.set_exception(HTTPError(503, "turn cancelled"))
+            elif turn.task.exception() is not None:
+                logging.error(f"session {turn.session} failed: {turn.task.exception()!r}")
+                turn.result.set_exception(turn.task.exception())
+            else:
+                self.served += 1
+                turn.result.set_result(turn.task.result())
+            if turn.events is not None:
+                turn.events.put_nowait(None)
+
+    def _release(self, turn):
+        "会话在这一轮真正结束后才能开始下一轮：同步智能体的线程可能在取消之后还在写这个会话"
+        if turn.thread is None or turn.thread.done():
+            self._busy.discard(turn.session)
+            return
+        loop = asyncio.get_running_loop()
+
+        def release(future):
+            try:
+                loop.call_soon_threadsafe(self._busy.discard, turn.session)
+            except RuntimeError:
+                # 事件循环已经关闭
+                pass
+        turn.thread.add_done_callback(release)
+
+    async def _chat(self, turn):
+        options = {"ctx": turn.session, "style": "mute", "timeout": turn.timeout}
+        if turn.stream:
+            options["stream"] = True
+        if inspect.iscoroutinefunction(self.agent.chat):
+            return await self.agent.chat(turn.message, on_event=turn.emit if turn.stream else None, **options)
+        loop = asyncio.get_running_loop()
+        on_event = (lambda event: loop.call_soon_threadsafe(turn.emit, event)) if turn.stream else None
+        call = functools.partial(self.agent.chat, turn.message, on_event=on_event, **options)
+        turn.thread = self._executor.submit(contextvars.copy_context().run, call)
+        return await asyncio.wrap_future(turn.thread)
+
+    def _submit(self, turn):
+        if self._closing:
+            raise HTTPError(503, "server is shutting down")
+        if turn.session in self._busy:
+            self.rejected += 1
+            raise HTTPError(409, f"session {turn.session} already has a turn in flight")
+        if len(self._busy) >= self.workers + self.queue_size:
+            self.rejected += 1
+            raise HTTPError(503, "too many queued requests", {"Retry-After": str(SERVER_RETRY_AFTER)})
+        self._busy.add(turn.session)
+        self._queue.put_nowait(turn)
+
+    async def _handle_connection(self, reader, writer):
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            keep_alive = True
+            while keep_alive and not self._closing:
+                try:
+                    request = await self._read_request(reader)
+                except HTTPError as e:
+                    await self._send_json(writer, e.status, {"error": e.message}, keep_alive=False)
+                    break
+                if request is None:
+                    break
+                keep_alive = request["keep_alive"] and not self._closing
+                self._active.add(task)
+                try:
+                    keep_alive = await self._dispatch(request, writer) and keep_alive
+                except HTTPError as e:
+                    await self._send_json(writer, e.status, {"error": e.message}, e.headers, keep_alive=keep_alive)
+                except Exception as e:
+                    logging.exception("request failed")
+                    await self._send_json(writer, 500, {"error": str(e)}, keep_alive=False)
+                    break
+                finally:
+                    self._active.discard(task)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._connections.discard(task)
+            self._active.discard(task)
+            writer.close()
+
+    async def _read_request(self, reader):
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError:
+            return None
+        except asyncio.LimitOverrunError:
+            raise HTTPError(413, "headers too large")
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, version = lines[0].split(" ", 2)
+        except ValueError:
+            raise HTTPError(400, "bad request line")
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        try:
+            length = int(headers.get("content-length", 0) or 0)
+        except ValueError:
+            raise HTTPError(400, "invalid Content-Length")
+        if length < 0:
+            raise HTTPError(400, "invalid Content-Length")
+        if length > self.max_body:
+            raise HTTPError(413, f"body larger than {self.max_body} bytes")
+        body = await reader.readexactly(length) if length else b""
+        connection = headers.get("connection", "").lower()
+        keep_alive = connection != "close" if version == "HTTP/1.1" else connection == "keep-alive"
+        return {"method": method, "path": unquote(urlsplit(target).path), "headers": headers, "body": body,
+                "keep_alive": keep_alive}
+
+    async def _dispatch(self, request, writer):
+        "处理一个请求，返回连接是否还可以继续使用"
+        method, path = request["method"], request["path"]
+        if path == "/health":
+            if method != "GET":
+                raise HTTPError(405, "use GET")
+            await self._send_json(writer, 200, self.stats(), keep_alive=request["keep_alive"])
+            return True
+        if path == "/chat":
+            if method != "POST":
+                raise HTTPError(405, "use POST")
+            return await self._handle_chat(request, writer)
+        if path.startswith("/sessions/"):
+            if method != "DELETE":
+                raise HTTPError(405, "use DELETE")
+            session = path[len("/sessions/"):]
+            if session in self._busy:
+                raise HTTPError(409, f"session {session} already has a turn in flight")
+            if session in self.agent.context:
+                del self.agent.context[session]
+            await self._send_json(writer, 200, {"session": session, "deleted": True}, keep_alive=request["keep_alive"])
+            return True
+        raise HTTPError(404, f"no route for {path}")
+
+    async def _handle_chat(self, request, writer):
+        try:
+            data = json.loads(request["body"] or b"{}")
+        except ValueError as e:
+            raise HTTPError(400, f"invalid JSON: {e}")
+        if not isinstance(data, dict) or not isinstance(data.get("message"), str):
+            raise HTTPError(400, "message is required")
+        timeout = data.get("timeout")
+        if timeout is not None and (isinstance(timeout, bool) or not isinstance(timeout, (int, float))
+                                    or not math.isfinite(timeout) or timeout <= 0):
+            raise HTTPError(400, "timeout should be a positive number of seconds")
+        session = str(data.get("session") or "default")
+        stream = bool(data.get("stream")) or "text/event-stream" in request["headers"].get("accept", "")
+        turn = _Turn(session, data["message"], stream, timeout)
+        self._submit(turn)
+        if not stream:
+            answer, history = await turn.result
+            await self._send_json(writer, 200, {"session": session, "answer": answer, "history": history},
+                                  keep_alive=request["keep_alive"])
+            return True
+        await self._stream_events(turn, writer)
+        return False
+
+    async def _stream_events(self, turn, writer):
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream; charset=utf-8\r\n"
+                     b"Cache-Control: no-cache\r\nConnection: close\r\n\r\n")
+        done = False
+        try:
+            while True:
+                event = await turn.events.get()
+                if event is None:
+                    break
+                done = done or isinstance(event, Done)
+                writer.write(_sse(event.type, event.to_dict()))
+                await writer.drain()
+            if not done:
+                try:
+                    await turn.result
+                except Exception as e:
+                    writer.write(_sse("error", {"type": "error", "error": getattr(e, "message", str(e))}))
+            await writer.drain()
+        except ConnectionError:
+            # 客户端断开，不再为它继续运行这一轮对话
+            logging.info(f"client of session {turn.session} disconnected")
+            if turn.task is not None:
+                turn.task.cancel()
+
+    async def _send_json(self, writer, status, data, headers=None, keep_alive=True):
+        body = json.dumps(data, ensure_ascii=False, default=str).encode("utf-8")
+        head = [f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}",
+                "Content-Type: application/json; charset=utf-8",
+                f"Content-Length: {len(body)}",
+                f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+        head.extend(f"{name}: {value}" for name, value in (headers or {}).items())
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
+
+
+def _sse(name, data):
+    return f"event: {name}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n".encode("utf-8")
+
+
+def serve(agent, host="127.0.0.1", port=8000, **options):
+    "启动HTTP服务直到收到SIGINT/SIGTERM，参数见AgentServer"
+    asyncio.run(AgentServer(agent, host=host, port=port, **options).serve_forever())
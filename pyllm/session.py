@@ -0,0 +1,220 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pyllm.cache import _json_default
+from pyllm.conversation import Conversation
+
+
+class SessionStore:
+    """
+    会话存储接口，按ctx保存Conversation。
+    支持和dict相同的 `ctx in store` / `store[ctx]` / `store[ctx] = messages` 用法，
+    所以chat_with_context和AgentBase.chat不需要关心具体的存储方式。
+    """
+
+    def __init__(self):
+        self._evict_listeners = []
+
+    def get(self, ctx):
+        "返回ctx对应的Conversation，不存在时返回None"
+        raise NotImplementedError
+
+    def create(self, ctx, messages=None):
+        "新建（或覆盖）一个会话，返回Conversation"
+        raise NotImplementedError
+
+    def delete(self, ctx):
+        raise NotImplementedError
+
+    def on_evict(self, listener):
+        "注册会话被淘汰或删除时的回调listener(ctx)，用于清理和会话绑定的其他状态"
+        self._evict_listeners.append(listener)
+
+    def _notify_evict(self, ctx):
+        for listener in self._evict_listeners:
+            try:
+                listener(ctx)
+            except Exception as e:
+                logging.error(f"session evict listener error: {e}")
+
+    def __contains__(self, ctx):
+        return self.get(ctx) is not None
+
+    def __getitem__(self, ctx):
+        conversation = self.get(ctx)
+        if conversation is None:
+            raise KeyError(ctx)
+        return conversation
+
+    def __setitem__(self, ctx, messages):
+        self.create(ctx, messages)
+
+    def __delitem__(self, ctx):
+        self.delete(ctx)
+
+
+class MemorySessionStore(SessionStore):
+    """
+    内存会话存储，按最近访问时间淘汰。
+
+    Args:
+        max_sessions (int, optional): 最多保存的会话数，超出时淘汰最久未访问的会话，为None时不限制。
+        idle_ttl (float, optional): 会话空闲多久（秒）后淘汰，为None时不过期。
+    """
+
+    def __init__(self, max_sessions=None, idle_ttl=None):
+        super().__init__()
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, ctx):
+        with self._lock:
+            item = self._sessions.get(ctx)
+            if item is None:
+                return None
+            conversation, last_access = item
+            now = time.monotonic()
+            if self.idle_ttl is not None and last_access + self.idle_ttl < now:
+                del self._sessions[ctx]
+                expired = True
+            else:
+                self._sessions[ctx] = (conversation, now)
+                self._sessions.move_to_end(ctx)
+                expired = False
+        if expired:
+            self._notify_evict(ctx)
+            return None
+        return conversation
+
+    def create(self, ctx, messages=None):
+        conversation = messages if isinstance(messages, Conversation) else Conversation(messages)
+        self._put(ctx, conversation)
+        return conversation
+
+    def _put(self, ctx, conversation):
+        evicted = []
+        with self._lock:
+            now = time.monotonic()
+            self._sessions[ctx] = (conversation, now)
+            self._sessions.move_to_end(ctx)
+            if self.idle_ttl is not None:
+                # 顺带清理最久未访问的过期会话
+                while self._sessions:
+                    oldest, (_, last_access) = next(iter(self._sessions.items()))
+                    if last_access + self.idle_ttl >= now:
+                        break
+                    del self._sessions[oldest]
+                    evicted.append(oldest)
+            while self.max_sessions is not None and len(self._sessions) > self.max_sessions:
+                oldest, _ = self._sessions.popitem(last=False)
+                evicted.append(oldest)
+        for ctx in evicted:
+            logging.debug(f"evict session {ctx}")
+            self._notify_evict(ctx)
+
+    def delete(self, ctx):
+        with self._lock:
+            existed = self._sessions.pop(ctx, None) is not None
+        if existed:
+            self._notify_evict(ctx)
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def keys(self):
+        return list(self._sessions.keys())
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    SQLite会话存储，进程重启后会话仍然存在。
+    会话在第一次访问时才从磁盘加载，新消息逐条追加写入；内存中只保留最近访问的会话。
+    从内存中释放不是淘汰，只有delete时才通知on_evict的回调。
+
+    Args:
+        path (str): SQLite文件路径。
+        max_cached (int, optional): 内存中最多保留的会话数，淘汰只释放内存，不删除磁盘数据。
+        idle_ttl (float, optional): 内存中的会话空闲多久（秒）后释放。
+    """
+
+    def __init__(self, path, max_cached=1024, idle_ttl=None):
+        super().__init__()
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS messages (ctx TEXT, seq INTEGER, data TEXT, PRIMARY KEY (ctx, seq))")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS sessions (ctx TEXT PRIMARY KEY, updated REAL)")
+        self._conn.commit()
+        self._db_lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._loading = {}
+        self._cached = MemorySessionStore(max_sessions=max_cached, idle_ttl=idle_ttl)
+
+    def get(self, ctx):
+        conversation = self._cached.get(ctx)
+        if conversation is not None:
+            return conversation
+        # 同一个ctx同时只加载一次，否则会有两个Conversation各自追加消息
+        with self._load_lock:
+            lock = self._loading.setdefault(ctx, threading.Lock())
+        with lock:
+            conversation = self._cached.get(ctx)
+            if conversation is None:
+                conversation = self._load(ctx)
+            with self._load_lock:
+                self._loading.pop(ctx, None)
+        return conversation
+
+    def _load(self, ctx):
+        with self._db_lock:
+            if self._conn.execute("SELECT 1 FROM sessions WHERE ctx = ?", (ctx,)).fetchone() is None:
+                return None
+            rows = self._conn.execute("SELECT data FROM messages WHERE ctx = ? ORDER BY seq", (ctx,)).fetchall()
+        logging.debug(f"load session {ctx} with {len(rows)} messages")
+        conversation = self._attach(ctx, Conversation([json.loads(row[0]) for row in rows]))
+        self._cached.create(ctx, conversation)
+        return conversation
+
+    def create(self, ctx, messages=None):
+        messages = list(messages or [])
+        with self._db_lock:
+            self._conn.execute("DELETE FROM messages WHERE ctx = ?", (ctx,))
+            self._conn.execute("INSERT OR REPLACE INTO sessions (ctx, updated) VALUES (?, ?)", (ctx, time.time()))
+            self._conn.executemany("INSERT INTO messages (ctx, seq, data) VALUES (?, ?, ?)",
+                                   [(ctx, seq, self._dumps(message)) for seq, message in enumerate(messages)])
+            self._conn.commit()
+        conversation = self._attach(ctx, Conversation(messages))
+        self._cached.create(ctx, conversation)
+        return conversation
+
+    def delete(self, ctx):
+        self._cached.delete(ctx)
+        with self._db_lock:
+            deleted = self._conn.execute("DELETE FROM sessions WHERE ctx = ?", (ctx,)).rowcount
+            self._conn.execute("DELETE FROM messages WHERE ctx = ?", (ctx,))
+            self._conn.commit()
+        if deleted:
+            self._notify_evict(ctx)
+
+    def _attach(self, ctx, conversation):
+        "新追加的消息写入磁盘，序号按磁盘上已有的消息计算，不依赖内存中的长度"
+        def on_append(message, seq):
+            with self._db_lock:
+                self._conn.execute("INSERT INTO messages (ctx, seq, data) "
+                                   "SELECT ?, COALESCE(MAX(seq), -1) + 1, ? FROM messages WHERE ctx = ?",
+                                   (ctx, self._dumps(message), ctx))
+                self._conn.execute("UPDATE sessions SET updated = ? WHERE ctx = ?", (time.time(), ctx))
+                self._conn.commit()
+        conversation.on_append = on_append
+        return conversation
+
+    def _dumps(self, message):
+        return json.dumps(message, ensure_ascii=False, default=_json_default)
+
+    def close(self):
+        self._conn.close()
@@ -0,0 +1,84 @@
+import threading
+from collections.abc import Mapping
+from pyllm.cache import LRUCache
+from pyllm.schema import schema_from_function, compile_validator
+
+TOOL_CACHE_SIZE = 256
+
+# 工具结果缓存策略
+TOOL_CACHE_NONE = None
+TOOL_CACHE_CONVERSATION = "conversation"
+TOOL_CACHE_GLOBAL = "global"
+
+
+class ToolRegistry(Mapping):
+    """
+    工具注册表：工具名到工具信息的映射，同时缓存发给模型的工具定义。
+    可以预先构建好，传给多个LLM/智能体共用，创建智能体时不必每次重新注册工具、重新生成工具定义。
+    共用时注册的工具对所有使用者可见，绑定在某个智能体上的工具（例如它的方法）总是在那个智能体上运行。
+    注册时把参数schema编译成验证函数，调用工具前先在本地检查和转换参数，见pyllm.schema。
+    """
+
+    def __init__(self):
+        self._tools = {}
+        self._schema = None
+        self._lock = threading.Lock()
+
+    def register(self, function, name=None, tool_desc=None, para_desc=None, parallel=True,
+                 cache_policy=TOOL_CACHE_NONE, cache_size=TOOL_CACHE_SIZE, cache_ttl=None):
+        "参数见LLM.register_tool，para_desc为空时根据函数签名和类型标注生成"
+        if cache_policy not in (TOOL_CACHE_NONE, TOOL_CACHE_CONVERSATION, TOOL_CACHE_GLOBAL):
+            raise ValueError(f"Unknown tool cache policy: {cache_policy}")
+        if name is None:
+            name = function.__name__
+        if tool_desc is None:
+            tool_desc = function.__doc__
+        if not para_desc:
+            para_desc = schema_from_function(function)
+        validate = compile_validator(para_desc)
+        with self._lock:
+            self._tools[name] = {
+                "name": name,
+                "function": function,
+                "tool_desc": tool_desc,
+                "para_desc": para_desc,
+                "validate": validate,
+                "parallel": parallel,
+                "cache_policy": cache_policy,
+                "cache_size": cache_size,
+                "cache_ttl": cache_ttl,
+                "memo": LRUCache(maxsize=cache_size, ttl=cache_ttl) if cache_policy == TOOL_CACHE_GLOBAL else None,
+            }
+            self._schema = None
+
+    def schema(self):
+        """
+        发给模型的工具定义，只在注册新工具之后重新生成一次，返回的列表请不要修改。
+        """
+        schema = self._schema
+        if schema is None:
+            with self._lock:
+                schema = self._schema = [{
+                    "type": "function",
+                    "function": {
+                        "name": tool_info["name"],
+                        "description": tool_info["tool_desc"],
+                        "parameters": tool_info["para_desc"],
+                    }
+                } for tool_info in self._tools.values()]
+        return schema
+
+    def copy(self):
+        "复制一份注册表，在副本上注册工具不影响原来的注册表；全局结果缓存仍然共用"
+        registry = ToolRegistry()
+        registry._tools = dict(self._tools)
+        return registry
+
+    def __getitem__(self, name):
+        return self._tools[name]
+
+    def __iter__(self):
+        return iter(self._tools)
+
+    def __len__(self):
+        return len(self._tools)
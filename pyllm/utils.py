@@ -1,17 +1,25 @@
-import subprocess
-import logging
 import json
 import copy
 
-def run_command(cmd, style="colorful"):
-    process = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)  
-    logging.debug(f"运行命令:\n{cmd}")
-    if len(cmd.split("\n")) > 1:
-        printc(f"运行命令:\n{cmd}", style=style)
-    else:
-        printc(f"运行命令: {cmd}", style=style)
-    stdout, stderr = process.communicate()  
-    return f"stdout\n{stdout.decode()}\nstderror\n{stderr.decode()}"
+# 把run_command注册为工具时使用的参数定义，只让模型给出命令本身
+COMMAND_PARA_DESC = {
+    "type": "object",
+    "properties": {
+        "cmd": {"type": "string", "description": "要执行的shell命令"},
+    },
+    "required": ["cmd"],
+    "additionalProperties": False,
+}
+
+def run_command(cmd, style=None, **kwargs):
+    """
+    执行shell命令，输出有上限，超时后终止，返回值附带退出码。
+    kwargs（timeout、max_bytes、on_output）见pyllm.command.execute_command。
+    """
+    from pyllm.command import run_command as _run_command
+    return _run_command(cmd, style=style, **kwargs)
+
+run_command.para_desc = COMMAND_PARA_DESC
 
 def truncate_string(text,length,truncate_mark = "<TRUNCATED>"):
     """
@@ -58,6 +66,24 @@ def pretty(obj):
     except Exception as e:
         return str(obj)
 
+COLOR_CODES = {  
+    'red': '\033[91m',  
+    'green': '\033[92m',  
+    'yellow': '\033[93m',  
+    'blue': '\033[94m',  
+    'magenta': '\033[95m',  
+    'cyan': '\033[96m',  
+    'white': '\033[97m',  
+    'grey': '\033[90m',
+    'reset': '\033[0m'  # 重置颜色  
+}  
+
+def colorize(text, color = "white", style = "colorful"):
+    "style为colorful时给文本加上终端颜色，否则原样返回"
+    if style == "colorful":
+        return f"{COLOR_CODES[color]}{text}{COLOR_CODES['reset']}"
+    return text
+
 def printc(text, color = "white", end="\n",style = "colorful"):  
     """  
     在终端中打印彩色文本。  
@@ -67,21 +93,4 @@ def printc(text, color = "white", end="\n",style = "colorful"):
     """  
     if style == "mute":
         return
-    elif style == "colorful":
-        color_codes = {  
-            'red': '\033[91m',  
-            'green': '\033[92m',  
-            'yellow': '\033[93m',  
-            'blue': '\033[94m',  
-            'magenta': '\033[95m',  
-            'cyan': '\033[96m',  
-            'white': '\033[97m',  
-            'grey': '\033[90m',
-            'reset': '\033[0m'  # 重置颜色  
-        }  
-        print(f"{color_codes[color]}{text}{color_codes['reset']}",end=end)  
-    elif style == "plain":
-        print(text, end=end)
-    else:
-        print(text, end=end)
-        
\ No newline at end of file
+    print(colorize(text, color, style), end=end)
@@ -0,0 +1,19 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "benchmarks")]
+
+import pytest
+from mock_server import MockServer
+
+# 没有服务监听的本地端口，连接会立即被拒绝
+DEAD_URL = "http://127.0.0.1:9/v1"
+
+
+@pytest.fixture
+def mock_server():
+    server = MockServer()
+    server.start()
+    yield server
+    server.stop()
@@ -0,0 +1,56 @@
+import asyncio
+import pytest
+from pyllm import batch
+from pyllm.async_llm import AsyncLLM
+from pyllm.llm import LLM
+
+
+@pytest.fixture(autouse=True)
+def fast_retry(monkeypatch):
+    monkeypatch.setattr(batch, "RETRY_BASE_DELAY", 0.01)
+
+
+def test_batch_ordered_results(mock_server):
+    mock_server.add_script("batch", ["ok"])
+    llm = LLM(model="batch", ak="mock", url=mock_server.url)
+    results = list(llm.batch_ask([f"q{i}" for i in range(10)], concurrency=4, ordered=True))
+    assert [result.index for result in results] == list(range(10))
+    assert all(result.ok and result.answer == "ok" for result in results)
+
+
+def test_batch_is_the_only_retry_layer(mock_server):
+    mock_server.add_script("batch", ["ok"])
+    llm = LLM(model="batch", ak="mock", url=mock_server.url)
+    mock_server.fail(500, 2)
+    result, = llm.batch_ask(["q"], concurrency=1, max_retries=3)
+    assert result.ok and result.attempts == 3
+    # 客户端不自动重试：两次失败加一次成功，共3个请求
+    assert mock_server.stats.requests == 3
+
+
+def test_batch_does_not_retry_client_errors(mock_server):
+    llm = LLM(model="batch", ak="mock", url=mock_server.url)
+    mock_server.fail(400, 1)
+    result, = llm.batch_ask(["q"], concurrency=1, max_retries=3)
+    assert not result.ok and result.attempts == 1
+    assert mock_server.stats.requests == 1
+
+
+def test_async_batch_is_the_only_retry_layer(mock_server):
+    mock_server.add_script("batch", ["ok"])
+    llm = AsyncLLM(model="batch", ak="mock", url=mock_server.url)
+    mock_server.fail(503, 2)
+
+    async def main():
+        return [result async for result in llm.batch_ask(["q"], concurrency=1, max_retries=1)]
+    result, = asyncio.run(main())
+    assert not result.ok and result.attempts == 2
+    assert mock_server.stats.requests == 2
+
+
+@pytest.mark.parametrize("concurrency", [0, -1, 1.5])
+def test_invalid_concurrency(concurrency):
+    with pytest.raises(ValueError, match="concurrency"):
+        batch.run_batch(lambda messages: "ok", ["q"], lambda item: [], concurrency=concurrency)
+    with pytest.raises(ValueError, match="concurrency"):
+        batch.run_batch_async(lambda messages: "ok", ["q"], lambda item: [], concurrency=concurrency)
@@ -0,0 +1,47 @@
+import hashlib
+import pytest
+from pyllm.blob import BlobStore
+from pyllm.llm import LLM, READ_RESULT_TOOL
+
+RESULT = "".join(f"第{i}行\n" for i in range(2000))
+
+
+def test_pages_keep_multibyte_characters(tmp_path):
+    store = BlobStore(path=str(tmp_path), page_size=100)
+    handle = store.put(RESULT)
+    assert handle == "blob:" + hashlib.sha256(RESULT.encode("utf-8")).hexdigest()[:16]
+    pages = [store.read_page(handle, page) for page in range(1, store.page_count(handle) + 1)]
+    assert "".join(pages) == RESULT
+    # 重新打开同一目录时从文件计算分页
+    assert BlobStore(path=str(tmp_path), page_size=100).read_page(handle, 2) == pages[1]
+
+
+@pytest.mark.parametrize("handle", ["blob:../../etc/passwd", "blob:0123456789abcdef", "file:0123456789abcdef",
+                                    "blob:0123456789ABCDEF", 42])
+def test_unknown_handle_does_not_touch_files(tmp_path, handle):
+    store = BlobStore(path=str(tmp_path))
+    assert not store.exists(handle)
+    for read in (lambda: store.read_page(handle, 1), lambda: store.read_range(handle, 0, 10), lambda: store.size(handle)):
+        with pytest.raises(KeyError, match="Unknown handle") as error:
+            read()
+        assert str(tmp_path) not in str(error.value)
+
+
+def test_large_result_is_spilled_and_read_by_page(mock_server):
+    handle = "blob:" + hashlib.sha256(RESULT.encode("utf-8")).hexdigest()[:16]
+    mock_server.add_script("spill", [[("dump", {})],
+                                     [(READ_RESULT_TOOL, {"handle": handle, "page": 2})],
+                                     [(READ_RESULT_TOOL, {"handle": "blob:../secret"})],
+                                     "ok"])
+    requests = []
+    reply = mock_server.reply
+    mock_server.reply = lambda request: requests.append(request) or reply(request)
+    llm = LLM(model="spill", ak="mock", url=mock_server.url, spill_threshold=1000)
+    llm.register_tool(lambda: RESULT, name="dump", tool_desc="输出很长的结果", para_desc={})
+    answer, history = llm.using_tool("dump", style="mute", use_cache=False)
+    assert answer == "ok"
+    summary, page, unknown = [message["content"] for message in requests[-1]["messages"] if message["role"] == "tool"]
+    # 对话里保存的是摘要和句柄，不是完整结果
+    assert handle in summary and len(summary) < 1000
+    assert page.startswith(f"[{handle} 第2/")
+    assert "Unknown handle" in unknown and llm.blob_store.path not in unknown
@@ -0,0 +1,44 @@
+import time
+from pyllm.cache import CompletionCache
+from pyllm.llm import LLM
+
+
+def test_ask_is_served_from_cache(mock_server):
+    mock_server.add_script("cached", ["answer"])
+    llm = LLM(model="cached", ak="mock", url=mock_server.url, cache=True)
+    assert llm.ask("q") == llm.ask("q") == "answer"
+    assert mock_server.stats.requests == 1
+    assert llm.ask("q", use_cache=False) == "answer"
+    assert mock_server.stats.requests == 2
+    assert llm.cache.stats()["hits"] == 1
+
+
+def test_cached_turn_is_replayed_as_stream(mock_server):
+    mock_server.add_script("cached", ["a fairly long cached answer for replay"])
+    llm = LLM(model="cached", ak="mock", url=mock_server.url, cache=True)
+    llm.using_tool("q", stream=True, style="mute")
+    events = []
+    answer, _ = llm.using_tool("q", stream=True, style="mute", on_event=events.append)
+    assert answer == "a fairly long cached answer for replay"
+    assert mock_server.stats.requests == 1
+    deltas = [event.text for event in events if event.type == "text_delta"]
+    assert len(deltas) > 1 and "".join(deltas) == answer
+
+
+def test_disk_tier_survives_restart(mock_server, tmp_path):
+    mock_server.add_script("cached", ["answer"])
+    path = str(tmp_path / "cache.db")
+    LLM(model="cached", ak="mock", url=mock_server.url, cache=CompletionCache(path=path)).ask("q")
+    llm = LLM(model="cached", ak="mock", url=mock_server.url, cache=CompletionCache(path=path))
+    assert llm.ask("q") == "answer"
+    assert mock_server.stats.requests == 1
+    assert llm.cache.stats()["disk_hits"] == 1
+
+
+def test_expired_entries_are_refetched(mock_server, tmp_path):
+    mock_server.add_script("cached", ["answer"])
+    llm = LLM(model="cached", ak="mock", url=mock_server.url, cache=CompletionCache(path=str(tmp_path / "cache.db"), ttl=0.1))
+    llm.ask("q")
+    time.sleep(0.2)
+    llm.ask("q")
+    assert mock_server.stats.requests == 2
@@ -0,0 +1,55 @@
+import asyncio
+import sys
+import time
+import pytest
+from pyllm.command import execute_command, execute_command_async, run_command
+from pyllm.llm import LLM
+
+pytestmark = pytest.mark.skipif(sys.platform == "win32", reason="命令使用POSIX shell")
+
+
+def test_exit_code_and_streams():
+    result = execute_command("echo out; echo err >&2; exit 3")
+    assert (result.stdout, result.stderr, result.returncode) == ("out\n", "err\n", 3)
+    assert str(result).endswith("exit code 3")
+
+
+def test_output_is_capped():
+    chunks = []
+    result = execute_command("head -c 1000000 /dev/zero | tr '\\0' a", max_bytes=1000,
+                             on_output=lambda name, text: chunks.append(text))
+    assert result.truncated and "省略999000字节" in result.stdout
+    assert len(result.stdout) < 1100
+    assert sum(len(chunk) for chunk in chunks) == 1000000
+
+
+def test_timeout_kills_process_group():
+    start = time.monotonic()
+    result = execute_command("sleep 10 & sleep 10; wait", timeout=0.3)
+    assert result.timed_out and result.returncode != 0
+    assert time.monotonic() - start < 5
+
+
+def test_async_execution():
+    result = asyncio.run(execute_command_async("printf 'a\\nb'", timeout=5))
+    assert result.stdout == "a\nb" and result.returncode == 0
+
+
+def test_registered_run_command_follows_request(mock_server, capsys):
+    mock_server.add_script("shell", [[("run_command", {"cmd": "echo from-shell"})], "done"])
+    llm = LLM(model="shell", ak="mock", url=mock_server.url)
+    llm.register_tool(run_command, name="run_command", tool_desc="执行shell命令")
+    _, history = llm.using_tool("run", style="mute", use_cache=False)
+    assert "from-shell" in history[0]["result"] and "exit code 0" in history[0]["result"]
+    # 静默运行的请求不打印“运行命令”
+    assert capsys.readouterr().out == ""
+
+
+def test_timeout_is_bounded_by_request_deadline(mock_server):
+    mock_server.add_script("shell", [[("run_command", {"cmd": "sleep 5"})], "done"])
+    llm = LLM(model="shell", ak="mock", url=mock_server.url)
+    llm.register_tool(run_command, name="run_command", tool_desc="执行shell命令")
+    start = time.monotonic()
+    _, history = llm.using_tool("run", style="mute", use_cache=False, timeout=0.5)
+    assert time.monotonic() - start < 3
+    assert "命令超时" in history[0]["result"]
@@ -0,0 +1,91 @@
+import threading
+from pyllm import context
+from pyllm.agent_base import AgentBase
+from pyllm.context import ContextManager, TokenCounter, CONTEXT_SUMMARIZE, CONTEXT_DROP_TOOL_OUTPUT, TOOL_OUTPUT_PLACEHOLDER
+
+LONG = "这是一段比较长的对话内容。" * 20
+
+
+class ContextAgent(AgentBase):
+    "有上下文预算的智能体"
+
+
+def capture(mock_server):
+    requests = []
+    reply = mock_server.reply
+    mock_server.reply = lambda request: requests.append(request) or reply(request)
+    return requests
+
+
+def test_sliding_window_keeps_requests_within_budget(mock_server):
+    mock_server.add_script("ctx", [LONG])
+    requests = capture(mock_server)
+    agent = ContextAgent(model="ctx", ak="mock", url=mock_server.url, context_budget=800)
+    counter = TokenCounter()
+    for i in range(6):
+        agent.chat(f"问题{i} {LONG}", ctx="s1", style="mute")
+    # 会话历史完整保存，发送给模型的上下文不超过预算
+    assert len(agent.context["s1"]) >= 12
+    assert counter.count(requests[-1]["messages"]) <= 800
+    assert requests[-1]["messages"][-1]["content"].startswith("问题5")
+
+
+def test_summarize_reuses_cached_summary(mock_server):
+    mock_server.add_script("ctx", ["ok"])
+    mock_server.add_script("cheap", ["之前讨论了很多问题"])
+    requests = capture(mock_server)
+    agent = ContextAgent(model="ctx", ak="mock", url=mock_server.url, context_budget=600,
+                         context_strategy=CONTEXT_SUMMARIZE, summary_model="cheap")
+    for i in range(4):
+        agent.chat(f"问题{i} {LONG}", ctx="s1", style="mute")
+    summaries = [request for request in requests if request["model"] == "cheap"]
+    answers = [request for request in requests if request["model"] == "ctx"]
+    assert summaries and len(summaries) < len(answers)
+    assert any("之前讨论了很多问题" in (message.get("content") or "") for message in answers[-1]["messages"])
+
+
+def test_drop_tool_output_first():
+    manager = ContextManager(300, strategy=CONTEXT_DROP_TOOL_OUTPUT)
+    messages = [{"role": "user", "content": "查一下"},
+                {"role": "assistant", "content": None, "tool_calls": [
+                    {"id": "c1", "type": "function", "function": {"name": "search", "arguments": "{}"}}]},
+                {"role": "tool", "tool_call_id": "c1", "content": LONG * 2},
+                {"role": "assistant", "content": "查到了"},
+                {"role": "user", "content": "继续"}]
+    fitted = manager.fit(messages)
+    assert [message["role"] for message in fitted] == [message["role"] for message in messages]
+    assert fitted[2]["content"] == TOOL_OUTPUT_PLACEHOLDER
+    assert messages[2]["content"] == LONG * 2
+
+
+class CountingSummarizer:
+    def __init__(self):
+        self.calls = 0
+
+    def chat(self, messages, model=None, use_cache=True):
+        self.calls += 1
+        return "摘要"
+
+
+def test_shared_summary_cache_across_threads(monkeypatch):
+    monkeypatch.setattr(context, "SUMMARY_CACHE_SIZE", 4)
+    manager = ContextManager(200, strategy=CONTEXT_SUMMARIZE, summarizer=CountingSummarizer())
+    errors = []
+
+    def session():
+        history = []
+        try:
+            for i in range(30):
+                history.append({"role": "user", "content": f"问题{i} {LONG}"})
+                history.append({"role": "assistant", "content": "回答"})
+                manager.fit(history)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=session) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert len(manager._summaries) <= 4
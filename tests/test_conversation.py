@@ -0,0 +1,59 @@
+from pyllm.agent_base import AgentBase
+from pyllm.conversation import Conversation, MessageView
+from pyllm.llm import LLM
+
+
+class HistoryAgent(AgentBase):
+    "保存会话历史的智能体"
+
+
+def test_view_does_not_touch_base():
+    base = [{"role": "user", "content": "1"}]
+    view = MessageView(base)
+    base.append({"role": "assistant", "content": "later"})
+    view.append({"role": "user", "content": "2"})
+    assert [message["content"] for message in view] == ["1", "2"]
+    assert view[-1]["content"] == "2" and len(view) == 2 and len(base) == 2
+
+
+def test_conversation_without_tool_index():
+    conversation = Conversation([{"role": "user", "content": "q"}])
+    conversation.append({"role": "tool", "content": "r"})
+    conversation.append({"role": "assistant", "content": "a"})
+    assert [message["role"] for message in conversation.without_tool()] == ["user", "assistant"]
+    assert len(conversation) == 3
+
+
+def test_using_tool_does_not_copy_or_modify_history(mock_server):
+    mock_server.add_script("history", [[("echo", {"input_str": "x"})], "answer"])
+    llm = LLM(model="history", ak="mock", url=mock_server.url)
+    llm.register_tool(lambda input_str: input_str, name="echo", tool_desc="回声")
+    history = [{"role": "user", "content": "hi"}]
+    before = list(history)
+    answer, _ = llm.using_tool(messages=history, style="mute", use_cache=False)
+    assert answer == "answer"
+    assert history == before and all(a is b for a, b in zip(history, before))
+
+
+def test_agent_history_keeps_tool_entries_out_of_requests(mock_server):
+    mock_server.add_script("history", [[("echo", {"input_str": "x"})], "answer"])
+    requests = []
+    reply = mock_server.reply
+    mock_server.reply = lambda request: requests.append(request) or reply(request)
+    agent = HistoryAgent(model="history", ak="mock", url=mock_server.url)
+    agent.chat("first", ctx="s1", style="mute")
+    agent.chat("second", ctx="s1", style="mute")
+    roles = [message["role"] for message in agent.context["s1"]]
+    assert roles.count("user") == 2 and roles.count("assistant") == 2
+    # 新的一轮只带上之前的问答，不带工具条目
+    first_request = [message["content"] for message in requests[2]["messages"]]
+    assert first_request[-3:] == ["first", "answer", "second"]
+
+
+def test_tool_schema_is_cached_until_register(mock_server):
+    llm = LLM(model="history", ak="mock", url=mock_server.url)
+    llm.register_tool(lambda input_str: input_str, name="echo", tool_desc="回声")
+    schema = llm._prepare_tools()
+    assert llm._prepare_tools() is schema
+    llm.register_tool(lambda text: text, name="upper", tool_desc="大写")
+    assert [tool["function"]["name"] for tool in llm._prepare_tools()] == ["echo", "upper"]
@@ -0,0 +1,32 @@
+from pyllm.llm import LLM
+
+
+def make_llm(mock_server):
+    mock_server.add_script("events", [[("echo", {"input_str": "x"})], "final answer"])
+    llm = LLM(model="events", ak="mock", url=mock_server.url)
+    llm.register_tool(lambda input_str: f"echo {input_str}", name="echo", tool_desc="回声")
+    return llm
+
+
+def collapse(types):
+    "合并连续的同类事件"
+    return [kind for i, kind in enumerate(types) if i == 0 or types[i - 1] != kind]
+
+
+def test_event_order(mock_server, capsys):
+    llm = make_llm(mock_server)
+    events = []
+    answer, _ = llm.using_tool("hi", stream=True, style="mute", use_cache=False, on_event=events.append)
+    assert collapse([event.type for event in events]) == [
+        "iteration_start", "tool_call_start", "tool_arguments_delta", "response_done", "tool_result",
+        "iteration_start", "text_delta", "response_done", "done"]
+    assert "".join(event.text for event in events if event.type == "text_delta") == answer == "final answer"
+    result = next(event for event in events if event.type == "tool_result")
+    assert result.to_dict()["type"] == "tool_result"
+    # mute时没有任何终端输出
+    assert capsys.readouterr().out == ""
+
+
+def test_console_sink_prints_answer(mock_server, capsys):
+    make_llm(mock_server).using_tool("hi", stream=True, style="colorful", use_cache=False)
+    assert "final answer" in capsys.readouterr().out
@@ -0,0 +1,29 @@
+import re
+from pyllm.llm import LLM
+from pyllm.metrics import MetricsCollector
+
+SAMPLE = re.compile(r'^[a-z_]+\{(?:[a-z]+="(?:[^"\\\n]|\\["\\n])*",?)+\} \S+$')
+
+
+def test_spans_are_collected(mock_server):
+    mock_server.add_script("metrics", [[("lookup", {})], "answer"])
+    metrics = MetricsCollector()
+    llm = LLM(model="metrics", ak="mock", url=mock_server.url, observer=metrics)
+    llm.register_tool(lambda: "found", name="lookup", tool_desc="查找", para_desc={})
+    llm.using_tool("hi", stream=True, style="mute", use_cache=False)
+    stats = {(stat["name"], stat["label"]): stat for stat in metrics.to_json()["stats"]}
+    assert stats[("llm.call", "metrics")]["count"] == 2
+    assert stats[("llm.call", "metrics")]["ttft_avg"] is not None
+    assert stats[("tool", "lookup")]["count"] == 1
+    assert stats[("llm.using_tool", "metrics")]["count"] == 1
+
+
+def test_prometheus_escapes_label_values(mock_server):
+    model = 'odd"model\\name\nnext'
+    mock_server.add_script(model, ["answer"])
+    metrics = MetricsCollector()
+    LLM(model=model, ak="mock", url=mock_server.url, observer=metrics).chat([{"role": "user", "content": "hi"}])
+    text = metrics.to_prometheus()
+    assert 'label="odd\\"model\\\\name\\nnext"' in text
+    for line in text.splitlines():
+        assert line.startswith("# TYPE ") or SAMPLE.match(line), line
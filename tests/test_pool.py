@@ -0,0 +1,81 @@
+import time
+import openai
+import pytest
+from conftest import DEAD_URL
+from pyllm.llm import LLM
+from pyllm.pool import Endpoint, EndpointPool
+from pyllm.scope import request_scope, current_scope
+
+
+def make_pool(*urls, **options):
+    return EndpointPool([Endpoint(url, ak="mock") for url in urls], **options)
+
+
+def test_failover_to_next_endpoint(mock_server):
+    mock_server.add_script("m", ["hello"])
+    pool = make_pool(DEAD_URL, mock_server.url)
+    llm = LLM(model="m", pool=pool)
+    assert llm.ask("hi", use_cache=False) == "hello"
+    dead, live = pool.endpoints
+    assert dead.errors == 1 and live.errors == 0
+    assert live.requests == 1
+
+
+def test_circuit_opens_and_recovers(mock_server):
+    mock_server.add_script("m", ["ok"])
+    pool = make_pool(mock_server.url, failure_threshold=3, cooldown=0.2)
+    llm = LLM(model="m", pool=pool)
+    mock_server.fail(500, 3)
+    for _ in range(3):
+        with pytest.raises(openai.InternalServerError):
+            llm.ask("hi", use_cache=False)
+    endpoint = pool.endpoints[0]
+    assert not endpoint.available(time.monotonic())
+    assert pool.stats()[0]["open"]
+
+    time.sleep(0.25)
+    # 熔断结束后放行的试探请求成功，地址恢复
+    assert llm.ask("hi", use_cache=False) == "ok"
+    assert endpoint.failures == 0
+    assert not pool.stats()[0]["open"]
+
+
+def test_open_endpoint_is_skipped(mock_server):
+    mock_server.add_script("m", ["ok"])
+    pool = make_pool(DEAD_URL, mock_server.url, failure_threshold=1, cooldown=30)
+    llm = LLM(model="m", pool=pool)
+    assert llm.ask("hi", use_cache=False) == "ok"
+    dead = pool.endpoints[0]
+    assert not dead.available(time.monotonic())
+    assert llm.ask("again", use_cache=False) == "ok"
+    # 熔断的地址不再被选中
+    assert dead.requests == 1
+
+
+def test_client_errors_do_not_open_circuit(mock_server):
+    mock_server.add_script("m", ["ok"])
+    pool = make_pool(mock_server.url, failure_threshold=2)
+    llm = LLM(model="m", pool=pool)
+    mock_server.fail(400, 5)
+    for _ in range(5):
+        with pytest.raises(openai.BadRequestError):
+            llm.ask("hi", use_cache=False)
+    endpoint = pool.endpoints[0]
+    assert endpoint.errors == 5
+    assert endpoint.failures == 0
+    assert endpoint.available(time.monotonic())
+    assert llm.ask("hi", use_cache=False) == "ok"
+
+
+def test_hedged_attempts_keep_request_scope():
+    pool = EndpointPool([Endpoint("http://a", client=object()), Endpoint("http://b", client=object())],
+                        hedge=True, hedge_delay=0.01)
+
+    def request(client, endpoint):
+        if endpoint.url == "http://a":
+            time.sleep(0.2)
+        return current_scope()
+
+    with request_scope(ctx="session", timeout=5) as scope:
+        assert pool.call(request) is scope
+    pool.close()
@@ -0,0 +1,50 @@
+import time
+import pytest
+from conftest import DEAD_URL
+from pyllm.agent_base import AgentBase
+from pyllm.replay import Recorder, Replayer, ReplayMiss, REPLAY_PRESERVE
+
+
+class ReplayAgent(AgentBase):
+    "录制和回放的智能体"
+
+
+def record(mock_server, path, stream):
+    mock_server.add_script("replay", [[("echo", {"input_str": "x"})], "recorded answer"])
+    with Recorder(path) as recorder:
+        agent = ReplayAgent(model="replay", ak="mock", url=mock_server.url, transport=recorder)
+        answer, history = agent.chat("hi", stream=stream, style="mute")
+    assert recorder.count == 2
+    return answer, history
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_replay_without_server(mock_server, tmp_path, stream):
+    path = str(tmp_path / "run.jsonl.gz")
+    expected = record(mock_server, path, stream)
+    replayer = Replayer(path)
+    agent = ReplayAgent(model="replay", ak="mock", url=DEAD_URL, transport=replayer)
+    assert agent.chat("hi", stream=stream, style="mute") == expected
+    assert replayer.stats() == {"records": 2, "hits": 2, "misses": 0, "unused": 0}
+
+
+def test_preserve_timing(mock_server, tmp_path):
+    path = str(tmp_path / "run.jsonl")
+    mock_server.latency = 0.2
+    record(mock_server, path, stream=False)
+    agent = ReplayAgent(model="replay", ak="mock", url=DEAD_URL, transport=Replayer(path, timing=REPLAY_PRESERVE))
+    start = time.monotonic()
+    agent.chat("hi", style="mute")
+    assert time.monotonic() - start >= 0.35
+    skipped = ReplayAgent(model="replay", ak="mock", url=DEAD_URL, transport=Replayer(path))
+    start = time.monotonic()
+    skipped.chat("hi", style="mute")
+    assert time.monotonic() - start < 0.2
+
+
+def test_strict_replay_rejects_new_requests(mock_server, tmp_path):
+    path = str(tmp_path / "run.jsonl")
+    record(mock_server, path, stream=False)
+    agent = ReplayAgent(model="replay", ak="mock", url=DEAD_URL, transport=Replayer(path, strict=True))
+    with pytest.raises(ReplayMiss):
+        agent.llm.ask("a different question")
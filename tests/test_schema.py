@@ -0,0 +1,69 @@
+import json
+import typing
+import pytest
+from pyllm.command import run_command, run_command_async
+from pyllm.llm import LLM, TOOL_ERROR_PREFIX
+from pyllm.schema import ToolArgumentError, compile_validator, schema_from_function
+from pyllm.tools import ToolRegistry
+from pyllm import utils
+
+
+def forecast(city: str, days: int = 3, units: typing.Literal["c", "f"] = "c", tags: typing.List[str] = None,
+             verbose=False, _trace=None, on_progress: typing.Callable = None, **extra):
+    """
+    查询天气预报。
+    Args:
+        city (str): 城市名
+        days (int): 预报天数
+    """
+    return f"{city} {days} {units}"
+
+
+def test_schema_from_signature():
+    schema = schema_from_function(forecast)
+    assert schema["required"] == ["city"]
+    assert schema["additionalProperties"] is False
+    assert list(schema["properties"]) == ["city", "days", "units", "tags", "verbose"]
+    assert schema["properties"]["city"] == {"type": "string", "description": "城市名"}
+    assert schema["properties"]["units"]["enum"] == ["c", "f"]
+    assert schema["properties"]["tags"]["items"] == {"type": "string"}
+
+
+def test_unannotated_parameters_are_strings():
+    assert schema_from_function(lambda input_str: input_str)["properties"]["input_str"] == {"type": "string"}
+
+
+@pytest.mark.parametrize("function", [run_command, run_command_async, utils.run_command])
+def test_run_command_only_exposes_cmd(function):
+    registry = ToolRegistry()
+    registry.register(function, name="run_command")
+    assert registry["run_command"]["para_desc"]["properties"].keys() == {"cmd"}
+    validate = registry["run_command"]["validate"]
+    with pytest.raises(ToolArgumentError, match="unexpected argument 'on_output'"):
+        validate(json.dumps({"cmd": "echo hi", "on_output": "x"}))
+    with pytest.raises(ToolArgumentError, match="max_bytes"):
+        validate({"cmd": "echo hi", "max_bytes": 10 ** 9})
+
+
+def test_validator_coerces_and_reports():
+    validate = compile_validator(schema_from_function(forecast))
+    assert validate('{"city": "北京", "days": "5", "tags": "[\\"a\\"]"}') == {"city": "北京", "days": 5, "tags": ["a"]}
+    with pytest.raises(ToolArgumentError, match='days should be integer, got "ten"'):
+        validate({"city": "北京", "days": "ten"})
+    with pytest.raises(ToolArgumentError, match=r"missing required argument: city \(string\)"):
+        validate("{}")
+    with pytest.raises(ToolArgumentError, match="not valid JSON"):
+        validate("{city")
+
+
+def test_invalid_arguments_are_returned_to_model(mock_server):
+    mock_server.add_script("weather", [[("forecast", {"city": "北京", "days": "ten"})],
+                                       [("forecast", {"city": "北京", "days": "2"})], "晴"])
+    llm = LLM(model="weather", ak="mock", url=mock_server.url)
+    calls = []
+    llm.register_tool(lambda city, days=3: calls.append((city, days)) or "晴", name="forecast", tool_desc="天气",
+                      para_desc=schema_from_function(forecast))
+    answer, history = llm.using_tool("北京天气", style="mute", use_cache=False)
+    assert answer == "晴"
+    assert "days should be integer" in history[0]["result"]
+    assert calls == [("北京", 2)]
@@ -0,0 +1,63 @@
+import os
+import subprocess
+import sys
+import time
+from pyllm.agent_base import AgentBase
+from pyllm.llm import LLM
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class ChildAgent(AgentBase):
+    "子智能体"
+
+
+class ParentAgent(AgentBase):
+    "父智能体"
+
+
+def test_children_run_concurrently(mock_server):
+    mock_server.add_script("child", ["子回答"])
+    mock_server.add_script("parent", [[("first", {"text": "a"}), ("second", {"text": "b"})], "汇总"])
+    children = [ChildAgent(model="child", ak="mock", url=mock_server.url) for _ in range(2)]
+    children[0].name, children[1].name = "first", "second"
+    parent = ParentAgent(model="parent", ak="mock", url=mock_server.url, child_agents=children)
+    # 先创建好各个智能体的客户端
+    parent.chat("预热", ctx="warmup", style="mute")
+    mock_server.latency = 0.4
+    start = time.monotonic()
+    answer, history = parent.chat("问题", style="mute")
+    elapsed = time.monotonic() - start
+    assert answer == "汇总"
+    assert len(history) == 2 and all("子回答" in call["result"] for call in history)
+    # 父智能体两轮加上并发的子智能体共三段延迟，顺序执行是四段
+    assert elapsed < 1.45
+
+
+def test_deadline_returns_partial_answer(mock_server):
+    mock_server.latency = 0.2
+    mock_server.add_script("loop", [[("echo", {"input_str": "x"})]] * 20)
+    llm = LLM(model="loop", ak="mock", url=mock_server.url)
+    llm.register_tool(lambda input_str: input_str, name="echo", tool_desc="回声", para_desc={
+        "type": "object", "properties": {"input_str": {"type": "string"}}, "required": ["input_str"]})
+    start = time.monotonic()
+    _, history = llm.using_tool("循环", style="mute", use_cache=False, timeout=0.7)
+    assert time.monotonic() - start < 1.2
+    assert 1 <= len(history) < 5
+
+
+def test_max_iterations_budget(mock_server):
+    mock_server.add_script("loop", [[("echo", {"input_str": "x"})]] * 20)
+    llm = LLM(model="loop", ak="mock", url=mock_server.url)
+    llm.register_tool(lambda input_str: input_str, name="echo", tool_desc="回声")
+    _, history = llm.using_tool("循环", style="mute", use_cache=False, max_iterations=3)
+    assert mock_server.stats.requests == 3 and len(history) == 3
+
+
+def test_client_import_is_not_charged_to_timeout(mock_server):
+    "新进程第一次调用时导入openai，不应该用掉timeout"
+    mock_server.add_script("fresh", ["ok"])
+    code = ("import sys; from pyllm.llm import LLM; "
+            f"print(LLM(model='fresh', ak='mock', url='{mock_server.url}').using_tool('hi', style='mute', timeout=0.3)[0])")
+    result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, timeout=60)
+    assert result.stdout.strip() == "ok", result.stderr
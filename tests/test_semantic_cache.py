@@ -0,0 +1,39 @@
+import pytest
+from pyllm.llm import LLM
+from pyllm.semantic_cache import SemanticCache
+
+pytest.importorskip("numpy")
+
+
+def test_near_duplicate_question_skips_request(mock_server):
+    mock_server.add_script("semantic", ["上海的人口大约两千五百万"])
+    llm = LLM(model="semantic", ak="mock", url=mock_server.url, semantic_cache=SemanticCache(threshold=0.8))
+    first = llm.ask("上海的人口有多少？")
+    second = llm.ask("上海的人口有多少")
+    assert first == second
+    assert mock_server.stats.requests == 1
+    assert llm.semantic_cache.stats()["hits"] == 1
+
+
+def test_lookup_returns_copies(mock_server):
+    mock_server.add_script("semantic", [[("lookup", {"q": "x"})], "答案"])
+    llm = LLM(model="semantic", ak="mock", url=mock_server.url, semantic_cache=SemanticCache(threshold=0.8))
+    llm.register_tool(lambda q: "结果", name="lookup", tool_desc="查找", para_desc={
+        "type": "object", "properties": {"q": {"type": "string"}}, "required": ["q"]})
+    _, history = llm.using_tool("查一下x", style="mute")
+    history.append({"call": "injected", "result": ""})
+    _, cached_history = llm.using_tool("查一下x", style="mute")
+    assert mock_server.stats.requests == 2
+    assert [call["result"] for call in cached_history] == ["结果"]
+    cached_history[0]["result"] = "changed"
+    assert [call["result"] for call in llm.using_tool("查一下x", style="mute")[1]] == ["结果"]
+
+
+def test_save_and_load(tmp_path):
+    path = str(tmp_path / "index")
+    cache = SemanticCache(capacity=2)
+    cache.set("m", [{"role": "user", "content": "你好"}], "hi")
+    cache.save(path)
+    loaded = SemanticCache.load(path, capacity=2)
+    assert loaded.get("m", [{"role": "user", "content": "你好"}]) == "hi"
+    assert loaded.get("other", [{"role": "user", "content": "你好"}]) is None
@@ -0,0 +1,172 @@
+import asyncio
+import json
+import pytest
+from pyllm.agent_base import AgentBase
+from pyllm.server import AgentServer
+
+ANSWER = "served answer"
+
+
+class ServedAgent(AgentBase):
+    "通过HTTP服务的智能体"
+
+
+async def http(port, method, path, body=None):
+    "发送一个Connection: close的请求，返回(状态码, 响应头, 响应体)"
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    data = body if isinstance(body, bytes) else json.dumps(body).encode("utf-8") if body is not None else b""
+    head = [f"{method} {path} HTTP/1.1", "Host: test", "Connection: close", f"Content-Length: {len(data)}"]
+    writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + data)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, payload = response.partition(b"\r\n\r\n")
+    lines = head.decode("latin-1").split("\r\n")
+    status = int(lines[0].split(" ")[1])
+    response_headers = {}
+    for line in lines[1:]:
+        name, _, value = line.partition(":")
+        response_headers[name.strip().lower()] = value.strip()
+    return status, response_headers, payload
+
+
+def parse_sse(payload):
+    events = []
+    for block in payload.decode("utf-8").split("\n\n"):
+        if block.strip():
+            name, data = block.split("\n", 1)
+            events.append((name[len("event: "):], json.loads(data[len("data: "):])))
+    return events
+
+
+@pytest.fixture
+def served(mock_server):
+    "返回run(scenario, **server_options)：启动服务，在事件循环中运行scenario(server)后关闭"
+    mock_server.add_script("served", [ANSWER])
+    agent = ServedAgent(model="served", ak="mock", url=mock_server.url)
+
+    def run(scenario, **options):
+        async def main():
+            server = await AgentServer(agent, port=0, **options).start()
+            try:
+                return await scenario(server)
+            finally:
+                await server.shutdown(grace=5)
+        return asyncio.run(main())
+    return run
+
+
+def test_chat_and_health(served):
+    async def scenario(server):
+        status, _, body = await http(server.port, "POST", "/chat", {"session": "s1", "message": "hi"})
+        assert status == 200
+        assert json.loads(body)["answer"] == ANSWER
+        status, _, body = await http(server.port, "GET", "/health")
+        assert status == 200 and json.loads(body)["served"] == 1
+    served(scenario)
+
+
+def test_busy_session_returns_409(served, mock_server):
+    mock_server.latency = 0.3
+
+    async def scenario(server):
+        first = asyncio.ensure_future(http(server.port, "POST", "/chat", {"session": "s1", "message": "hi"}))
+        await asyncio.sleep(0.1)
+        status, _, _ = await http(server.port, "POST", "/chat", {"session": "s1", "message": "again"})
+        assert status == 409
+        assert (await first)[0] == 200
+    served(scenario)
+
+
+def test_full_queue_returns_503(served, mock_server):
+    mock_server.latency = 0.3
+
+    async def scenario(server):
+        pending = [asyncio.ensure_future(http(server.port, "POST", "/chat", {"session": f"s{i}", "message": "hi"}))
+                   for i in range(2)]
+        await asyncio.sleep(0.1)
+        status, headers, _ = await http(server.port, "POST", "/chat", {"session": "s2", "message": "hi"})
+        assert status == 503
+        assert headers["retry-after"]
+        assert [(await request)[0] for request in pending] == [200, 200]
+    served(scenario, workers=1, queue_size=1)
+
+
+def test_stream_sends_events_in_order(served):
+    async def scenario(server):
+        status, headers, body = await http(server.port, "POST", "/chat", {"session": "s1", "message": "hi", "stream": True})
+        assert status == 200
+        assert headers["content-type"].startswith("text/event-stream")
+        events = parse_sse(body)
+        names = [name for name, _ in events]
+        assert names[0] == "iteration_start"
+        assert names[-1] == "done"
+        text = "".join(data["text"] for name, data in events if name == "text_delta")
+        assert text == ANSWER
+    served(scenario)
+
+
+def test_delete_session(served):
+    async def scenario(server):
+        await http(server.port, "POST", "/chat", {"session": "s1", "message": "hi"})
+        assert "s1" in server.agent.context
+        status, _, body = await http(server.port, "DELETE", "/sessions/s1")
+        assert status == 200 and json.loads(body)["deleted"]
+        assert "s1" not in server.agent.context
+    served(scenario)
+
+
+@pytest.mark.parametrize("body", [
+    b"{not json",
+    {"timeout": 1},
+    {"message": "hi", "timeout": "abc"},
+    {"message": "hi", "timeout": -1},
+])
+def test_bad_requests_return_400(served, body):
+    async def scenario(server):
+        status, _, _ = await http(server.port, "POST", "/chat", body)
+        assert status == 400
+    served(scenario)
+
+
+@pytest.mark.parametrize("length", [b"abc", b"-5"])
+def test_bad_content_length_returns_400(served, length):
+    async def scenario(server):
+        reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+        writer.write(b"POST /chat HTTP/1.1\r\nContent-Length: " + length + b"\r\n\r\n{}")
+        await writer.drain()
+        response = await reader.read()
+        writer.close()
+        assert response.startswith(b"HTTP/1.1 400")
+    served(scenario)
+
+
+def test_shutdown_finishes_running_turn(served, mock_server):
+    mock_server.latency = 0.3
+
+    async def scenario(server):
+        turn = asyncio.ensure_future(http(server.port, "POST", "/chat", {"session": "s1", "message": "hi"}))
+        await asyncio.sleep(0.1)
+        await server.shutdown(grace=5)
+        status, _, body = await turn
+        assert status == 200 and json.loads(body)["answer"] == ANSWER
+        with pytest.raises(OSError):
+            await http(server.port, "GET", "/health")
+    served(scenario)
+
+
+def test_cancelled_sync_turn_keeps_session_busy(served, mock_server):
+    mock_server.latency = 0.4
+
+    async def scenario(server):
+        first = asyncio.ensure_future(http(server.port, "POST", "/chat", {"session": "s1", "message": "hi"}))
+        await asyncio.sleep(0.1)
+        next(iter(server._running)).task.cancel()
+        assert (await first)[0] == 503
+        # 线程里的agent.chat还在写这个会话，新的一轮要等它结束
+        status, _, _ = await http(server.port, "POST", "/chat", {"session": "s1", "message": "again"})
+        assert status == 409
+        await asyncio.sleep(0.5)
+        status, _, _ = await http(server.port, "POST", "/chat", {"session": "s1", "message": "again"})
+        assert status == 200
+    served(scenario)
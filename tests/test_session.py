@@ -0,0 +1,74 @@
+import threading
+from pyllm.agent_base import AgentBase
+from pyllm.session import SQLiteSessionStore, MemorySessionStore
+
+
+class SessionAgent(AgentBase):
+    "会话保存在SQLite中的智能体"
+
+
+def dialog(conversation):
+    return [message["content"] for message in conversation if message["role"] in ("user", "assistant")]
+
+
+def test_sqlite_sessions_survive_restart(mock_server, tmp_path):
+    mock_server.add_script("session", ["记住了"])
+    path = str(tmp_path / "sessions.db")
+    store = SQLiteSessionStore(path)
+    agent = SessionAgent(model="session", ak="mock", url=mock_server.url, session_store=store)
+    agent.chat("我叫小明", ctx="u1", style="mute")
+    store.close()
+
+    store = SQLiteSessionStore(path)
+    agent = SessionAgent(model="session", ak="mock", url=mock_server.url, session_store=store)
+    assert dialog(store["u1"]) == ["我叫小明", "记住了"]
+    agent.chat("我叫什么", ctx="u1", style="mute")
+    store.close()
+    assert dialog(SQLiteSessionStore(path)["u1"]) == ["我叫小明", "记住了", "我叫什么", "记住了"]
+
+
+def test_concurrent_loads_share_one_conversation(tmp_path):
+    path = str(tmp_path / "sessions.db")
+    SQLiteSessionStore(path).create("u1", [{"role": "user", "content": "hi"}])
+    store = SQLiteSessionStore(path)
+    barrier = threading.Barrier(8)
+    loaded = []
+
+    def load():
+        barrier.wait()
+        loaded.append(store.get("u1"))
+
+    threads = [threading.Thread(target=load) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len({id(conversation) for conversation in loaded}) == 1
+
+
+def test_append_after_release_from_memory(tmp_path):
+    store = SQLiteSessionStore(str(tmp_path / "sessions.db"), max_cached=1)
+    evicted = []
+    store.on_evict(evicted.append)
+    stale = store.create("u1", [{"role": "user", "content": "1"}])
+    store.create("u2")
+    # u1只是从内存中释放，不是淘汰
+    assert evicted == []
+    fresh = store.get("u1")
+    assert fresh is not stale
+    fresh.append({"role": "assistant", "content": "2"})
+    stale.append({"role": "user", "content": "3"})
+    assert [message["content"] for message in SQLiteSessionStore(store.path)["u1"]] == ["1", "2", "3"]
+    store.delete("u1")
+    assert evicted == ["u1"] and "u1" not in store
+
+
+def test_memory_store_evicts_least_recent():
+    store = MemorySessionStore(max_sessions=2)
+    evicted = []
+    store.on_evict(evicted.append)
+    store["a"] = []
+    store["b"] = []
+    store.get("a")
+    store["c"] = []
+    assert evicted == ["b"] and store.keys() == ["a", "c"]
@@ -0,0 +1,101 @@
+import threading
+import time
+from pyllm.llm import LLM
+from pyllm.tools import TOOL_CACHE_CONVERSATION, TOOL_CACHE_GLOBAL
+
+TEXT_PARAM = {"type": "object", "properties": {"text": {"type": "string"}}, "required": ["text"]}
+
+
+class Tracker:
+    "记录工具的调用次数和最大并发数"
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = []
+        self.active = 0
+        self.max_active = 0
+        self.started = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, text):
+        with self._lock:
+            self.calls.append(text)
+            self.started[text] = time.monotonic()
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(self.delay)
+        with self._lock:
+            self.active -= 1
+        return f"result {text}"
+
+
+def make_llm(mock_server, model, turns, **options):
+    mock_server.add_script(model, turns)
+    return LLM(model=model, ak="mock", url=mock_server.url, **options)
+
+
+def tool_messages(requests):
+    return [message for message in requests[-1]["messages"] if message["role"] == "tool"]
+
+
+def capture(mock_server):
+    requests = []
+    reply = mock_server.reply
+    mock_server.reply = lambda request: requests.append(request) or reply(request)
+    return requests
+
+
+def test_tool_calls_run_concurrently_in_order(mock_server):
+    calls = [("slow", {"text": str(i)}) for i in range(4)]
+    llm = make_llm(mock_server, "parallel", [calls, "done"])
+    tracker = Tracker(delay=0.3)
+    llm.register_tool(tracker, name="slow", tool_desc="慢工具", para_desc=TEXT_PARAM)
+    requests = capture(mock_server)
+    start = time.monotonic()
+    _, history = llm.using_tool("go", style="mute", use_cache=False)
+    assert time.monotonic() - start < 0.9
+    assert tracker.max_active > 1
+    # tool消息按tool_calls的顺序排列
+    messages = tool_messages(requests)
+    assert [message["tool_call_id"] for message in messages] == [f"call_0_{i}" for i in range(4)]
+    assert [message["content"] for message in messages] == [f"result {i}" for i in range(4)]
+    assert [item["result"] for item in history] == [f"result {i}" for i in range(4)]
+
+
+def test_non_parallel_tool_runs_alone(mock_server):
+    llm = make_llm(mock_server, "serial", [[("unsafe", {"text": str(i)}) for i in range(3)], "done"])
+    tracker = Tracker(delay=0.05)
+    llm.register_tool(tracker, name="unsafe", tool_desc="非线程安全", para_desc=TEXT_PARAM, parallel=False)
+    llm.using_tool("go", style="mute", use_cache=False)
+    assert tracker.calls == ["0", "1", "2"] and tracker.max_active == 1
+
+
+def test_early_dispatch_starts_tools_while_streaming(mock_server):
+    mock_server.chunk_delay = 0.01
+    llm = make_llm(mock_server, "early", [[("slow", {"text": "first"}), ("slow", {"text": "x" * 200})], "done"])
+    tracker = Tracker()
+    llm.register_tool(tracker, name="slow", tool_desc="工具", para_desc=TEXT_PARAM)
+    done = []
+    llm.using_tool("go", stream=True, early_dispatch=True, style="mute", use_cache=False,
+                   on_event=lambda event: event.type == "response_done" and done.append(time.monotonic()))
+    # 第一个调用的参数完整后就开始执行，第二个调用的参数还要流式发送约50个chunk
+    assert tracker.started["first"] < done[0] - 0.2
+
+
+def test_conversation_memo(mock_server):
+    llm = make_llm(mock_server, "memo", [[("lookup", {"text": "a"})], [("lookup", {"text": "a"})], "done"])
+    tracker = Tracker()
+    llm.register_tool(tracker, name="lookup", tool_desc="查找", para_desc=TEXT_PARAM, cache_policy=TOOL_CACHE_CONVERSATION)
+    _, history = llm.using_tool("go", style="mute", use_cache=False, ctx="s1")
+    assert [item["cache"] for item in history] == ["miss", "hit"]
+    llm.using_tool("go", style="mute", use_cache=False, ctx="s2")
+    assert tracker.calls == ["a", "a"]
+
+
+def test_global_memo_is_shared_across_sessions(mock_server):
+    llm = make_llm(mock_server, "memo", [[("lookup", {"text": "a"})], "done"])
+    tracker = Tracker()
+    llm.register_tool(tracker, name="lookup", tool_desc="查找", para_desc=TEXT_PARAM, cache_policy=TOOL_CACHE_GLOBAL)
+    llm.using_tool("go", style="mute", use_cache=False, ctx="s1")
+    _, history = llm.using_tool("go", style="mute", use_cache=False, ctx="s2")
+    assert history[0]["cache"] == "hit" and tracker.calls == ["a"]